@@ -2,6 +2,7 @@
 import datetime
 import logging
 import os
+from typing import Iterator, List, Tuple
 
 import discord
 from aiohttp import ClientSession
@@ -22,8 +23,10 @@ from discord.ext.commands.errors import (
     NoPrivateMessage,
     PrivateMessageOnly,
 )
+from discord.utils import time_snowflake
 
-from bot.models import Message, User
+from bot.models import CommandRollup, Counter, Message, MessageRevision, Model, Rep, Tag, TagRequest, User
+from bot.services import PresenceIndex, Priority, Scheduler
 from utils.context import SyltesContext
 from utils.time import human_timedelta
 
@@ -43,6 +46,9 @@ initial_cogs = [
     "bot.cogs.roles",
     "bot.cogs.poll",
     "bot.cogs.adventofcode",
+    "bot.cogs.stats",
+    "bot.cogs.search",
+    "bot.cogs.history",
 ]
 
 
@@ -57,13 +63,43 @@ class Tim(commands.Bot):
         )
         self.start_time = datetime.datetime.utcnow()
         self.clean_text = commands.clean_content(escape_markdown=True, fix_channel_mentions=True)
+        self.scheduler = Scheduler(
+            workers=settings.scheduler.workers,
+            queue_size=settings.scheduler.queue_size,
+            lag_threshold=settings.scheduler.lag_threshold,
+            min_sample_rate=settings.scheduler.min_sample_rate,
+            detach_after=settings.scheduler.detach_after,
+            max_detached=settings.scheduler.max_detached,
+        )
+        self.presences = PresenceIndex()
 
     """  Events   """
 
     async def setup_hook(self) -> None:
         """Connect DB before bot is ready to assure that no calls are made before its ready"""
         self.presence.start()
+        self.partitions.start()
+        self.check_presences.start()
+        self.reconcile_counters.change_interval(hours=settings.counters.reconcile_interval)
+        self.reconcile_counters.start()
+        self.retention.change_interval(hours=settings.retention.interval)
+        self.retention.start()
         self.session = ClientSession(loop=self.loop)
+        await User.load_known()
+        await Message.load_dictionaries()
+        await Counter.load()
+        await Rep.load_cooldowns()
+        await Tag.load_names()
+        await TagRequest.load_pending()
+        Model.spool.start()
+        Message.buffer.start()
+        MessageRevision.buffer.start()
+        User.counters.start()
+        CommandRollup.counters.start()
+        Tag.counters.start()
+        for leaderboard in User.leaderboards.values():
+            leaderboard.start()
+        self.scheduler.start()
 
         for ext in initial_cogs:
             try:
@@ -73,12 +109,41 @@ class Tim(commands.Bot):
 
         log.info(f"Loaded all extensions after {human_timedelta(self.start_time, brief=True, suffix=False)}")
 
+    async def close(self) -> None:
+        """Flush buffered writes before closing the connection"""
+        await self.scheduler.stop()
+        await MessageRevision.buffer.stop()
+        await Message.buffer.stop()
+        await User.counters.stop()
+        await CommandRollup.counters.stop()
+        await Tag.counters.stop()
+        for leaderboard in User.leaderboards.values():
+            await leaderboard.stop()
+        await Model.spool.stop()
+        await super().close()
+
     async def on_ready(self):
         log.info(f"Successfully logged in as {self.user}. In {len(self.guilds)} guilds")
         self.guild = self.get_guild(settings.guild.id)
         self.welcomes = self.guild.get_channel(settings.guild.welcomes_channel_id)
+        self.presences.rebuild(self.member_rows())
+
+    async def on_presence_update(self, before, after):
+        if self.presences.ready:
+            self.presences.set_status(after.id, str(after.status))
+
+    async def on_member_update(self, before, after):
+        if self.presences.ready and before.roles != after.roles:
+            self.presences.set_roles(after.id, self.role_ids(before), self.role_ids(after))
+
+    async def on_member_remove(self, member):
+        if self.presences.ready:
+            self.presences.remove(member.id, self.role_ids(member))
 
     async def on_member_join(self, member):
+        if self.presences.ready:
+            self.presences.add(member.id, str(member.status), self.role_ids(member))
+
         await self.wait_until_ready()
         if member.guild.id == settings.guild.id:
             await self.welcomes.send(
@@ -100,7 +165,7 @@ class Tim(commands.Bot):
         if message.channel.id == settings.challenges.submit_channel_id:
             return
 
-        await self.process_commands(message)
+        self.scheduler.submit(Priority.COMMANDS, self.process_commands, message)
 
     async def process_commands(self, message):
         if message.author.bot:
@@ -109,7 +174,7 @@ class Tim(commands.Bot):
         ctx = await self.get_context(message=message)
 
         if ctx.command is None:
-            return await Message.on_message(message=message)
+            return self.scheduler.submit(Priority.ANALYTICS, Message.on_message, message)
 
         if ctx.command.name in (
             "help",
@@ -121,6 +186,7 @@ class Tim(commands.Bot):
             "users",
             "server_messages",
             "messages",
+            "stats",
         ):
             if ctx.channel.id not in settings.bot.commands_channels_ids:
                 return await message.channel.send(
@@ -130,7 +196,8 @@ class Tim(commands.Bot):
         try:
             await self.invoke(ctx)
         finally:
-            await User.on_command(user=message.author)
+            User.on_command(user=message.author)
+            CommandRollup.on_command(ctx.command.qualified_name)
 
     async def on_command_error(self, ctx, exception):
         await self.wait_until_ready()
@@ -199,6 +266,14 @@ class Tim(commands.Bot):
         For use in `self.on_command_error`"""
         return ", ".join([obj.name if isinstance(obj, discord.Role) else str(obj).replace("_", " ") for obj in list_])
 
+    @staticmethod
+    def role_ids(member: discord.Member) -> List[int]:
+        """Ids of the member's roles for `self.presences`, leaving out @everyone"""
+        return [role.id for role in member.roles if not role.is_default()]
+
+    def member_rows(self) -> Iterator[Tuple[int, str, List[int]]]:
+        return ((member.id, str(member.status), self.role_ids(member)) for member in self.get_all_members())
+
     async def resolve_user(self, user_id: int) -> discord.User:
         """Resolve a user from their ID."""
 
@@ -215,3 +290,57 @@ class Tim(commands.Bot):
     async def presence(self):
         await self.wait_until_ready()
         await self.change_presence(activity=discord.Game(name='use the prefix "tim."'))
+
+    @tasks.loop(minutes=30)
+    async def check_presences(self):
+        """Make sure the presence index still matches the member cache"""
+        if self.presences.ready:
+            self.presences.check(self.member_rows())
+
+    @tasks.loop(hours=24)
+    async def partitions(self):
+        """Create next months' partitions of the messages table ahead of time"""
+        await Message.create_partitions()
+
+    @tasks.loop(hours=6)
+    async def reconcile_counters(self):
+        """Recount the message counters, in case they drifted from the messages table"""
+        if self.reconcile_counters.current_loop == 0:
+            return  # They were just loaded, don't recount on every restart
+
+        await Counter.reconcile_messages(
+            batch_size=settings.counters.reconcile_batch_size,
+            approximate=settings.counters.approximate,
+        )
+
+    @tasks.loop(hours=6)
+    async def retention(self):
+        """Delete the rows that are older than their table's retention, see `settings.retention`"""
+        policy = settings.retention
+        now = datetime.datetime.now(datetime.timezone.utc)
+        options = dict(batch_size=policy.batch_size, pause=policy.pause)
+        if policy.messages is not None:
+            before = now - datetime.timedelta(days=policy.messages)
+            deleted = await Message.prune(before, lock_timeout=policy.lock_timeout, **options)
+            log.info(f"Pruned {deleted} messages sent before {before:%Y-%m-%d}")
+
+        # Revisions can't outlive their message
+        days = min((days for days in (policy.messages, policy.message_revisions) if days is not None), default=None)
+        if days is not None:
+            before = time_snowflake(now - datetime.timedelta(days=days))
+            deleted = await Model.delete_before("message_revisions", "message_id", before, **options)
+            log.info(f"Pruned {deleted} revisions of messages sent more than {days} days ago")
+
+        if policy.reps is not None:
+            before = now.replace(tzinfo=None) - datetime.timedelta(days=policy.reps)
+            deleted = await Model.delete_before("reps", "repped_at", before, **options)
+            log.info(f"Pruned {deleted} reps from before {before:%Y-%m-%d}")
+
+        if policy.polls is not None:  # Poll messages are the polls' ids
+            before = time_snowflake(now - datetime.timedelta(days=policy.polls))
+            deleted = await Model.delete_before("polls", "message_id", before, **options)
+            log.info(f"Pruned {deleted} polls from more than {policy.polls} days ago")
+
+        before = now.replace(tzinfo=None) - datetime.timedelta(days=policy.spool_batches)
+        deleted = await Model.delete_before("spool_batches", "replayed_at", before, **options)
+        log.info(f"Pruned {deleted} ids of spool batches replayed before {before:%Y-%m-%d}")
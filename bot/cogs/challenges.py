@@ -4,6 +4,7 @@ import discord
 from discord.ext import commands
 
 from bot.config import settings
+from bot.services import Priority
 
 
 class ChallengeHandler(commands.Cog):
@@ -131,55 +132,9 @@ class ChallengeHandler(commands.Cog):
             await self.bot.guild.get_member(payload.user_id).add_roles(participant)
 
     @commands.Cog.listener()
-    async def on_message(self, message):  # Submitted role.
+    async def on_message(self, message):
         if message.channel.id == settings.challenges.submit_channel_id:
-
-            if message.author.id == self.bot.user.id:
-                return
-
-            if message.author.bot:
-                return await message.delete()
-
-            submitted = self.bot.guild.get_role(settings.challenges.submitted_role_id)
-            hidden_submission_channel = self.bot.guild.get_channel(settings.challenges.submissions_channel_id)
-
-            if submitted not in message.author.roles:
-                await message.delete()
-                attach = message.attachments and message.attachments[0]
-
-                if not attach:
-                    msg = (
-                        f"{message.author.mention} make sure to __upload a "
-                        f"file__ that only includes the code required "
-                        f"for the challenge!"
-                    )
-                    return await message.channel.send(msg, delete_after=10.0)
-
-                filetype = attach.filename.split(".")[-1]
-
-                if len(filetype) > 4 or len(filetype) == 0:  # Most filetypes are 2-3 chars, 4 just to be safe
-                    return await message.channel.send(
-                        f"{message.author.mention} attachment file extension must be between 1 and 4 characters long",
-                        delete_after=10.0,
-                    )
-
-                code = (await attach.read()).decode("u8")
-
-                content = f"```{filetype}\n" + code.replace("`", "\u200b`") + "```"
-                if len(content) > 4096:
-                    # 4096 = max embed description size
-
-                    msg = (
-                        f"{message.author.mention} your submission can't be __more"
-                        f" than {4096 - len(filetype) - 7} characters__."
-                    )
-                    return await message.channel.send(msg, delete_after=10.0)
-
-                await message.author.add_roles(submitted)
-                embed = discord.Embed(description=content, color=0x36393E)
-                embed.set_author(name=str(message.author), icon_url=message.author.display_avatar.url)
-                embed.set_footer(text=f"#ID: {message.author.id} • {len(code)} chars • Language: {filetype}")
-                await hidden_submission_channel.send(embed=embed)
+            self.bot.scheduler.submit(Priority.MODERATION, self.handle_submission, message)
 
         elif message.channel.id in [
             settings.challenges.channel_id,
@@ -187,6 +142,54 @@ class ChallengeHandler(commands.Cog):
         ]:  # Automatic reaction
             await message.add_reaction("🖐️")
 
+    async def handle_submission(self, message):  # Submitted role.
+        if message.author.id == self.bot.user.id:
+            return
+
+        if message.author.bot:
+            return await message.delete()
+
+        submitted = self.bot.guild.get_role(settings.challenges.submitted_role_id)
+        hidden_submission_channel = self.bot.guild.get_channel(settings.challenges.submissions_channel_id)
+
+        if submitted not in message.author.roles:
+            await message.delete()
+            attach = message.attachments and message.attachments[0]
+
+            if not attach:
+                msg = (
+                    f"{message.author.mention} make sure to __upload a "
+                    f"file__ that only includes the code required "
+                    f"for the challenge!"
+                )
+                return await message.channel.send(msg, delete_after=10.0)
+
+            filetype = attach.filename.split(".")[-1]
+
+            if len(filetype) > 4 or len(filetype) == 0:  # Most filetypes are 2-3 chars, 4 just to be safe
+                return await message.channel.send(
+                    f"{message.author.mention} attachment file extension must be between 1 and 4 characters long",
+                    delete_after=10.0,
+                )
+
+            code = (await attach.read()).decode("u8")
+
+            content = f"```{filetype}\n" + code.replace("`", "\u200b`") + "```"
+            if len(content) > 4096:
+                # 4096 = max embed description size
+
+                msg = (
+                    f"{message.author.mention} your submission can't be __more"
+                    f" than {4096 - len(filetype) - 7} characters__."
+                )
+                return await message.channel.send(msg, delete_after=10.0)
+
+            await message.author.add_roles(submitted)
+            embed = discord.Embed(description=content, color=0x36393E)
+            embed.set_author(name=str(message.author), icon_url=message.author.display_avatar.url)
+            embed.set_footer(text=f"#ID: {message.author.id} • {len(code)} chars • Language: {filetype}")
+            await hidden_submission_channel.send(embed=embed)
+
 
 async def setup(bot):
     await bot.add_cog(ChallengeHandler(bot))
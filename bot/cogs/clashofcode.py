@@ -111,10 +111,9 @@ class ClashOfCode(commands.Cog):
             suffix="",
         )
 
-        for member in self.role.members:
-            if member != ctx.author:
-                if member.status != discord.Status.offline:
-                    pager.add_line(member.mention + ", ")
+        for user_id in self.bot.presences.online(self.role.id):
+            if user_id != ctx.author.id:
+                pager.add_line(f"<@{user_id}>, ")
 
         if not len(pager.pages):
             return await ctx.send(f"{ctx.author.mention}, Nobody is online to play with <:pepesad:733816214010331197>")
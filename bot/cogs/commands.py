@@ -1,9 +1,13 @@
+import asyncio
 import inspect
 import io
+import json
 import os
 import re
 import zlib
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import partial
+from typing import List, Tuple
 
 import discord
 from bs4 import BeautifulSoup
@@ -11,7 +15,7 @@ from discord.ext import commands
 from discord.utils import get
 from tabulate import tabulate
 
-from bot.models import Model, User
+from bot.models import CommandRollup, Counter, Message, MessageRevision, Model, Rep, Tag, User
 from utils.checks import is_staff
 from utils.time import human_timedelta
 
@@ -132,6 +136,9 @@ class Commands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self._docs_cache = None
+        User.leaderboards["messages_sent"].render = partial(self.render_scoreboard, header="Messages")
+        User.leaderboards["commands_used"].render = partial(self.render_scoreboard, header="Commands")
+        User.leaderboards["reps"].render = partial(self.render_scoreboard, header="Reps")
 
     @commands.command(hidden=True)
     @commands.check(predicate)
@@ -143,6 +150,24 @@ class Commands(commands.Cog):
                 "It's much easier and less time consuming.```"
             )
 
+    @commands.command(hidden=True)
+    @commands.check(predicate)
+    async def metrics(self, ctx):
+        """Counters of the bot's internal write buffers and work queues"""
+        rows = [("messages", key, value) for key, value in Message.buffer.stats().items()]
+        rows += [("revisions", key, value) for key, value in MessageRevision.buffer.stats().items()]
+        rows += [("users", key, value) for key, value in User.counters.stats().items()]
+        rows += [("commands", key, value) for key, value in CommandRollup.counters.stats().items()]
+        rows += [("tags", key, value) for key, value in Tag.counters.stats().items()]
+        rows += [("users", "known", len(User.known)), ("users", "known_complete", User.known.complete)]
+        for name, leaderboard in User.leaderboards.items():
+            rows += [(name, key, value) for key, value in leaderboard.stats().items()]
+        rows += [("spool", key, value) for key, value in Model.spool.stats().items()]
+        rows += [("scheduler", key, value) for key, value in self.bot.scheduler.stats().items()]
+        rows += [("presences", key, value) for key, value in self.bot.presences.stats().items()]
+        rows += [("tag cache", key, value) for key, value in Tag.cache_stats().items()]
+        await ctx.send(f"```prolog\n{tabulate(rows, headers=('Service', 'Metric', 'Value'))}\n```")
+
     def get_github_link(self, base_url: str, branch: str, command: str):
         obj = self.bot.get_command(command.replace(".", " "))
 
@@ -225,11 +250,7 @@ class Commands(commands.Cog):
         await ctx.send(embed=embed)
 
     def members(self):
-        members = set(self.bot.get_all_members())
-        d = {"online": 0, "idle": 0, "dnd": 0, "offline": 0}
-        for member in members:
-            d[str(member.status)] += 1
-        return d
+        return self.bot.presences.counts
 
     @commands.command()
     async def users(self, ctx):
@@ -250,21 +271,27 @@ class Commands(commands.Cog):
     @commands.command()
     async def top_user(self, ctx):
         """Find out who is the top user in our server!"""
-        query = """SELECT * FROM users ORDER BY messages_sent DESC LIMIT 1"""
-        top_user = await User.fetchrow(query)
+        top = await User.leaderboards["messages_sent"].fetch_top(1)
+        if not top:
+            return await ctx.send("Nobody has sent any messages yet.")
 
-        user = self.bot.get_user(top_user["id"])
+        ((user_id, messages_sent),) = top
+
+        user = self.bot.get_user(user_id)
         if not isinstance(user, discord.User):
             return await ctx.send(
-                f"Could not find the top user, but his ID is {user.id}"
-                f'\n And he has `{top_user["messages_sent"]}`` messages'
+                f"Could not find the top user, but his ID is {user_id}\n And he has `{messages_sent}` messages"
             )
-        await ctx.send(f'Top User: {user} \nMessages: `{top_user["messages_sent"]}`')
+        await ctx.send(f"Top User: {user} \nMessages: `{messages_sent}`")
 
     @commands.command()
     async def server_messages(self, ctx):
         """Get the total amount of messages sent in the TWT Server"""
-        count = await Model.fetchval("SELECT COUNT(*) FROM messages")
+        count = Counter.get("messages")
+        if count is None:
+            count = await Counter.estimate_messages()
+        count += len(Message.buffer)
+
         started_counting = datetime(year=2019, month=11, day=13)
         await ctx.send(
             f"I have read `{count}` messages after "
@@ -284,90 +311,87 @@ class Commands(commands.Cog):
         embed.set_footer(text=str(ctx.author), icon_url=ctx.author.display_avatar.url)
         await ctx.send(embed=embed)
 
-    @commands.command(aliases=["lb"])
-    async def scoreboard(self, ctx):
-        """Scoreboard over users message count"""
-        users = await User.fetch("SELECT * FROM users ORDER BY messages_sent DESC LIMIT 10")
+    async def render_scoreboard(self, rows: List[Tuple[int, int]], header: str) -> str:
+        """Leaderboard rows as a table, the users that aren't cached are fetched all at once"""
 
-        table = []
-        for row in users:
-            user = self.bot.get_user(row.id)
+        async def resolve(user_id: int):
+            user = self.bot.get_user(user_id)
             if user is None:
                 try:
-                    user = await self.bot.fetch_user(row.id)
+                    user = await self.bot.fetch_user(user_id)
                 except discord.HTTPException:
-                    user = row.id
-
-            table.append((str(user), row.messages_sent))
+                    user = user_id
+            return user
 
+        users = await asyncio.gather(*(resolve(user_id) for user_id, _ in rows))
         table = tabulate(
-            table,
+            [(str(user), score) for user, (_, score) in zip(users, rows)],
             headers=(
                 "User",
-                "Messages",
+                header,
             ),
             tablefmt="fancy_grid",
         )
-        await ctx.send(f">>> ```prolog\n{table}\n```")
-
-    #     @commands.command(name='reps', aliases=['my_reps'])
-    #     async def reps_(self, ctx, member: commands.MemberConverter = None):
-    #         """How many reps do you have?"""
-    #         member = member or ctx.author
-    #         user = await self.bot.db.get_user(member.id, get_reps=True)
-
-    #         reps = user.reps
+        return f">>> ```prolog\n{table}\n```"
 
-    #         ret = f'{member.display_name} has received `{len(reps)}` reps'
-
-    #         if len(reps) > 0:
-    #             last_rep = max(reps, key=lambda r: r.repped_at)
-    #             ret += f'\nLast rep: {human_timedelta(last_rep.repped_at)}'
-
-    #             user_reps = {
-    #                 int(rep.author_id): len(list(filter(lambda x: x.author_id == rep.author_id, reps)))
-    #                 for rep in reps
-    #             }
+    @commands.command(aliases=["lb"])
+    async def scoreboard(self, ctx, counter: str = "messages"):
+        """Scoreboard over users message count, use `scoreboard commands` for the commands used"""
+        field = {"messages": "messages_sent", "commands": "commands_used"}.get(counter.lower())
+        if field is None:
+            return await ctx.send("You can see the scoreboard of either `messages` or `commands`.")
 
-    #             table = []
-    #             for user_id, reps in sorted(user_reps.items(), key=lambda i: i[1], reverse=True)[:10]:
-    #                 table.append((str(self.bot.get_user(user_id)), str(reps)))
+        await ctx.send(await User.leaderboards[field].table())
 
-    #             ret += f"\n>>> ```prolog\n{tabulate(table, headers=('User', 'Reps', ), tablefmt='fancy_grid')}\n```"
+    @commands.command(name="reps", aliases=["my_reps"])
+    async def reps_(self, ctx, member: commands.MemberConverter = None):
+        """How many reps do you have?"""
+        member = member or ctx.author
+        user = await User.fetch_user(member.id)
 
-    #         await ctx.send(ret)
+        ret = f"{member.display_name} has received `{user.reps}` reps"
 
-    #     @commands.command(aliases=['rlb'])
-    #     async def rep_scoreboard(self, ctx):
-    #         """Rep scoreboard!"""
-    #         users = await self.bot.db.get_all_users(get_reps=True, get_messages=False)
+        if user.reps > 0:
+            received = await Rep.fetch_received(member.id)
+            last_rep = await Rep.last_received(member.id)
+            if last_rep is not None:  # The reps themselves may be past the retention, the count stays
+                ret += f"\nLast rep: {human_timedelta(last_rep)}"
 
-    #         table = []
-    #         for user in sorted(users, key=lambda u: len(u.reps), reverse=True)[:10]:
-    #             table.append((str(user), len(user.reps)))
+            table = [(str(self.bot.get_user(record["author_id"])), str(record["reps"])) for record in received]
+            ret += f"\n>>> ```prolog\n{tabulate(table, headers=('User', 'Reps', ), tablefmt='fancy_grid')}\n```"
 
-    #         await ctx.send(f'>>> ```prolog\n{tabulate(table, headers=("User", "Reps",), tablefmt="fancy_grid")}\n```')
+        await ctx.send(ret)
 
-    #     @commands.command(name='rep')
-    #     async def rep(self, ctx, member: commands.MemberConverter):
-    #         """Rep someone! 24hr cooldown."""
-    #         if member.id == ctx.author.id:
-    #             return await ctx.send('You cannot rep yourself.')
+    @commands.command(aliases=["rlb"])
+    async def rep_scoreboard(self, ctx):
+        """Rep scoreboard!"""
+        await ctx.send(await User.leaderboards["reps"].table())
 
-    #         if member.bot:
-    #             return await ctx.send('You cannot rep bots.')
+    @commands.command(name="rep")
+    async def rep(self, ctx, member: commands.MemberConverter):
+        """Rep someone! 24hr cooldown."""
+        if member.id == ctx.author.id:
+            return await ctx.send("You cannot rep yourself.")
 
-    #         user = await self.bot.db.get_user(member.id)
+        if member.bot:
+            return await ctx.send("You cannot rep bots.")
 
-    #         result = await user.add_rep(message_id=ctx.message.id, author_id=ctx.author.id,
-    #                                     repped_at=ctx.message.created_at, extra_info={"channel_id": ctx.channel.id})
+        rep = Rep(
+            rep_id=ctx.message.id,
+            user_id=member.id,
+            author_id=ctx.author.id,
+            repped_at=ctx.message.created_at.replace(tzinfo=None),
+            extra_info=json.dumps({"channel_id": ctx.channel.id}),
+        )
+        result = await rep.post()
 
-    #         if result is not None:
-    #             delta = timedelta(days=1, hours=0, minutes=0, seconds=0, milliseconds=0, microseconds=0)
-    #             return await ctx.send(f'{ctx.author.mention} You can rep **{member.display_name}** '
-    #                                   f'again in {human_timedelta(result + delta, suffix=False, accuracy=2)}')
-    #         else:
-    #             await ctx.send(f"{ctx.author.mention} has repped **{member.display_name}**!")
+        if result is not None:
+            return await ctx.send(
+                f"{ctx.author.mention} You can rep **{member.display_name}** "
+                f"again in {human_timedelta(result + timedelta(days=1), suffix=False, accuracy=2)}"
+            )
+        else:
+            await ctx.send(f"{ctx.author.mention} has repped **{member.display_name}**!")
 
     @commands.command("pipsearch", aliases=["pip", "pypi"])
     @commands.cooldown(2, 5, commands.BucketType.user)
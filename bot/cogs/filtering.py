@@ -6,6 +6,7 @@ import discord
 from discord.ext import commands
 
 from bot.models import FilterConfig
+from bot.services import Priority
 from utils.checks import is_staff
 
 
@@ -31,8 +32,7 @@ class Filtering(commands.Cog):
         if not message.guild:
             return
 
-        await self.assure_config(message.guild.id)
-        await self._do_filtering(message)
+        self.bot.scheduler.submit(Priority.MODERATION, self.filter_message, message)
 
     @commands.Cog.listener()
     async def on_message_edit(self, before, after):
@@ -40,8 +40,11 @@ class Filtering(commands.Cog):
         if not before.guild:
             return
 
-        await self.assure_config(after.guild.id)
-        await self._do_filtering(after)
+        self.bot.scheduler.submit(Priority.MODERATION, self.filter_message, after)
+
+    async def filter_message(self, message: discord.Message):
+        await self.assure_config(message.guild.id)
+        await self._do_filtering(message)
 
     async def _do_filtering(self, message: discord.Message):
         config = self.configs[str(message.guild.id)]
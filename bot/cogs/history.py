@@ -0,0 +1,77 @@
+import re
+from datetime import datetime
+
+import discord
+from discord.ext import commands
+from discord.utils import parse_time
+
+from bot.models import MessageRevision
+from utils.checks import is_staff
+
+MESSAGE_LINK = re.compile(r"https?://(?:\w+\.)?discord(?:app)?\.com/channels/\d+/\d+/(\d+)")
+
+
+def message_id(argument: str) -> int:
+    """A message id, or the id at the end of a message link"""
+    match = MESSAGE_LINK.fullmatch(argument)
+    try:
+        return int(match.group(1) if match else argument)
+    except ValueError:
+        raise commands.BadArgument(f"`{argument}` isn't a message id or link")
+
+
+class History(commands.Cog):
+    """Records edits and deletions of the logged messages.
+    The raw events are used, so messages that fell out of the message cache are still covered."""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        data = payload.data
+        if (
+            "guild_id" not in data
+            or "content" not in data
+            or not data.get("edited_timestamp")
+            or data.get("author", {}).get("bot")
+        ):
+            return  # Embeds being resolved also send edits, those don't change the content
+
+        MessageRevision.on_edit(payload.message_id, data["content"], parse_time(data["edited_timestamp"]))
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if payload.guild_id is not None:
+            MessageRevision.on_delete(payload.message_id, datetime.utcnow())
+
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        if payload.guild_id is not None:
+            deleted_at = datetime.utcnow()
+            for message_id_ in payload.message_ids:
+                MessageRevision.on_delete(message_id_, deleted_at)
+
+    @commands.command(hidden=True)
+    @commands.guild_only()
+    @commands.check(lambda ctx: is_staff(ctx.author))
+    async def history(self, ctx, message: message_id):
+        """Show every revision of a logged message, by id or link"""
+        await MessageRevision.buffer.flush()
+        revisions = await MessageRevision.fetch_history(message)
+        if not revisions:
+            return await ctx.send("That message wasn't logged.")
+
+        embed = discord.Embed(title=f"History of {message}", colour=discord.Colour.blue())
+        for revised_at, kind, content in revisions[-25:]:
+            when = discord.utils.snowflake_time(message) if revised_at is None else revised_at
+            content = discord.utils.remove_markdown(content or "")[:1000] or "*No text*"
+            embed.add_field(name=f"{kind.capitalize()} at {when:%Y-%m-%d %H:%M:%S}", value=content, inline=False)
+
+        if len(revisions) > 25:
+            embed.set_footer(text=f"Showing the last 25 of {len(revisions)} revisions")
+        await ctx.send(embed=embed)
+
+
+async def setup(bot):
+    await bot.add_cog(History(bot))
@@ -0,0 +1,113 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import discord
+from asyncpg import Record
+from discord.ext import commands
+
+from bot.models import Message
+from utils.checks import is_staff
+
+PAGE_SIZE = 5
+
+
+class SearchFlags(commands.FlagConverter, delimiter=" ", prefix="--"):
+    channel: Optional[discord.TextChannel] = None
+    author: Optional[discord.User] = None
+    after: Optional[str] = None
+    before: Optional[str] = None
+
+
+def parse_date(value: Optional[str]) -> Optional[datetime]:
+    if value is None:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except ValueError:
+        raise commands.BadArgument(f"`{value}` isn't a date like 2022-12-31")
+
+
+class SearchView(discord.ui.View):
+    """Keyset pagination of a search, only the staff member that searched can flip pages"""
+
+    def __init__(self, ctx, query: str, filters: dict, records: List[Record]):
+        super().__init__(timeout=300)
+        self.ctx = ctx
+        self.query = query
+        self.filters = filters
+        self.cursors: List[Optional[Tuple[float, int]]] = [None]  # Cursor of the first result of every page
+        self.records = records
+        self.update_buttons()
+
+    @property
+    def page(self) -> int:
+        return len(self.cursors)
+
+    def update_buttons(self) -> None:
+        self.previous.disabled = self.page == 1
+        self.next.disabled = len(self.records) < PAGE_SIZE
+
+    def embed(self) -> discord.Embed:
+        embed = discord.Embed(title=f"Search: {self.query}", colour=discord.Colour.blue())
+        guild_id = self.ctx.guild.id
+        for record in self.records:
+            content = record["content"] if record["body"] is None else Message.codec.decode(record["body"])
+            content = discord.utils.remove_markdown(content or "")[:200] or "*No text*"
+            url = f"https://discord.com/channels/{guild_id}/{record['channel_id']}/{record['message_id']}"
+            embed.add_field(
+                name=f"{discord.utils.snowflake_time(record['message_id']):%Y-%m-%d %H:%M} (rank {record['rank']:.3f})",
+                value=f"<@{record['author_id']}> in <#{record['channel_id']}> [jump]({url})\n{content}",
+                inline=False,
+            )
+        embed.set_footer(text=f"Page {self.page}")
+        return embed
+
+    async def show(self, interaction: discord.Interaction, cursor: Optional[Tuple[float, int]]) -> None:
+        self.records = await Message.search(
+            self.query, self.ctx.guild.id, cursor=cursor, limit=PAGE_SIZE, **self.filters
+        )
+        self.update_buttons()
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return interaction.user.id == self.ctx.author.id
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.cursors.pop()
+        await self.show(interaction, self.cursors[-1])
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.primary)
+    async def next(self, interaction: discord.Interaction, button: discord.ui.Button):
+        last = self.records[-1]
+        self.cursors.append((last["rank"], last["message_id"]))
+        await self.show(interaction, self.cursors[-1])
+
+
+class Search(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.command(hidden=True)
+    @commands.guild_only()
+    @commands.check(lambda ctx: is_staff(ctx.author))
+    async def search(self, ctx, query: str, *, flags: SearchFlags):
+        """Search the logged messages of this server.
+        Put multiple words in quotes, e.g. `t.search "async await" --channel #help --after 2022-01-31`
+        Supports `"exact phrases"`, `or` and `-excluded` words"""
+        filters = dict(
+            channel_id=flags.channel and flags.channel.id,
+            author_id=flags.author and flags.author.id,
+            after=parse_date(flags.after),
+            before=parse_date(flags.before),
+        )
+        records = await Message.search(query, ctx.guild.id, limit=PAGE_SIZE, **filters)
+        if not records:
+            return await ctx.send("No messages found.")
+
+        view = SearchView(ctx, query, filters, records)
+        await ctx.send(embed=view.embed(), view=view)
+
+
+async def setup(bot):
+    await bot.add_cog(Search(bot))
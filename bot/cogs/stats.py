@@ -0,0 +1,142 @@
+from functools import partial
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+import discord
+import pandas as pd
+from asyncpg import Record
+from discord.ext import commands
+from tabulate import tabulate
+
+from bot.models import CommandRollup, MessageRollup
+from bot.services import MISSING, LRUCache
+
+CACHE_TTL = 600  # Rollups only change by the hour, so a result can be reused for a while
+CACHE_SIZE = 256  # Results kept, every guild and period is cached on its own
+
+
+def to_frame(records: List[Record], columns: Tuple[str, ...]) -> pd.DataFrame:
+    frame = pd.DataFrame.from_records(records, columns=columns)
+    frame["hour"] = pd.to_datetime(frame["hour"])
+    return frame
+
+
+def render(rows, headers: Tuple[str, ...], tablefmt: str = "fancy_grid") -> str:
+    return f">>> ```prolog\n{tabulate(rows, headers=headers, tablefmt=tablefmt)}\n```"
+
+
+def render_trends(records: List[Record]) -> str:
+    """Weekly and monthly totals with the change to the period before"""
+    hourly = to_frame(records, ("hour", "messages")).set_index("hour")["messages"]
+
+    tables = []
+    for rule, label, periods, fmt in (("W-MON", "Week of", 8, "%Y-%m-%d"), ("MS", "Month", 6, "%Y-%m")):
+        totals = hourly.resample(rule, label="left", closed="left").sum().tail(periods + 1)
+        change = (totals.pct_change() * 100).round(1)
+        rows = [
+            (period.strftime(fmt), total, "" if pd.isna(pct) else f"{pct:+.1f}%")
+            for period, total, pct in zip(totals.index, totals, change)
+        ][1:]
+        tables.append(render(rows, (label, "Messages", "Change")))
+    return "\n".join(tables)
+
+
+def render_hours(records: List[Record], days: int) -> str:
+    """Average messages per hour of the day (UTC)"""
+    frame = to_frame(records, ("hour", "messages"))
+    per_hour = frame.groupby(frame["hour"].dt.hour)["messages"].sum().reindex(range(24), fill_value=0) / days
+    scale = 20 / per_hour.max() if per_hour.max() else 0
+    rows = [(f"{hour:02}:00", f"{average:.1f}", "█" * round(average * scale)) for hour, average in per_hour.items()]
+    return render(rows, ("Hour", "Avg", ""), tablefmt="simple")  # 24 rows don't fit in a message with grid lines
+
+
+def render_channels(records: List[Record], names: Dict[int, str]) -> str:
+    """Each channel's share of the messages"""
+    frame = to_frame(records, ("hour", "channel_id", "messages"))
+    totals = frame.groupby("channel_id")["messages"].sum().nlargest(10)
+    share = (totals / frame["messages"].sum() * 100).round(1)
+    rows = [(names.get(channel_id, channel_id), total, f"{share[channel_id]}%") for channel_id, total in totals.items()]
+    return render(rows, ("Channel", "Messages", "Share"))
+
+
+def render_commands(records: List[Record]) -> str:
+    frame = to_frame(records, ("hour", "command", "uses"))
+    totals = frame.groupby("command")["uses"].sum().nlargest(10)
+    return render(list(totals.items()), ("Command", "Uses"))
+
+
+class Stats(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self._cache = LRUCache(max_size=CACHE_SIZE, ttl=CACHE_TTL)
+
+    async def cached(self, key: tuple, load: Callable[[], Awaitable[List[Record]]], build: Callable[..., str]) -> str:
+        """Run `build` on the loaded rollups in an executor, reusing the result for `CACHE_TTL` seconds"""
+        result = self._cache.get(key)
+        if result is not MISSING:
+            return result
+
+        records = await load()
+        if not records:
+            result = "There is no activity recorded for that period yet."
+        else:
+            result = await self.bot.loop.run_in_executor(None, build, records)
+
+        self._cache.set(key, result)
+        return result
+
+    @commands.group(invoke_without_command=True)
+    @commands.guild_only()
+    async def stats(self, ctx):
+        """Activity statistics of the server"""
+        await ctx.send_help(ctx.command)
+
+    @stats.command(name="trends")
+    async def stats_trends(self, ctx):
+        """Messages per week and month"""
+        result = await self.cached(
+            ("trends", ctx.guild.id), partial(MessageRollup.fetch_guild, ctx.guild.id, days=240), render_trends
+        )
+        await ctx.send(result)
+
+    @stats.command(name="hours")
+    async def stats_hours(self, ctx, days: int = 30):
+        """The busiest hours of the day (UTC) over the last `days` days"""
+        days = max(1, min(days, 365))
+        result = await self.cached(
+            ("hours", ctx.guild.id, days),
+            partial(MessageRollup.fetch_guild, ctx.guild.id, days=days),
+            partial(render_hours, days=days),
+        )
+        await ctx.send(result)
+
+    @stats.command(name="channels")
+    async def stats_channels(self, ctx, days: int = 30):
+        """The most active channels over the last `days` days"""
+        days = max(1, min(days, 365))
+        names = {channel.id: f"#{channel.name}" for channel in ctx.guild.channels}
+        result = await self.cached(
+            ("channels", ctx.guild.id, days),
+            partial(MessageRollup.fetch_channels, ctx.guild.id, days=days),
+            partial(render_channels, names=names),
+        )
+        await ctx.send(result)
+
+    @stats.command(name="commands")
+    async def stats_commands(self, ctx, days: int = 30):
+        """The most used commands over the last `days` days"""
+        days = max(1, min(days, 365))
+        result = await self.cached(("commands", days), partial(CommandRollup.fetch_since, days=days), render_commands)
+        await ctx.send(result)
+
+    @stats.command(name="user", aliases=["me"])
+    async def stats_user(self, ctx, member: discord.Member = None):
+        """Messages per week and month of a member"""
+        member = member or ctx.author
+        result = await self.cached(
+            ("user", member.id), partial(MessageRollup.fetch_user, member.id, days=240), render_trends
+        )
+        await ctx.send(f"**{member.display_name}**\n{result}")
+
+
+async def setup(bot):
+    await bot.add_cog(Stats(bot))
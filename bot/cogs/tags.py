@@ -3,10 +3,11 @@ from datetime import datetime
 from typing import TYPE_CHECKING, List, Literal
 
 import discord
+from discord import app_commands
 from discord.ext import commands
 
 from bot.config import settings
-from bot.models import Model, Tag
+from bot.models import Model, Tag, TagRequest
 from utils.checks import is_admin, is_engineer_check, is_staff
 
 if TYPE_CHECKING:
@@ -85,9 +86,26 @@ class TagCommands(commands.Cog, name="Tags"):
         except discord.Forbidden:
             pass
 
-    async def request(self, **kwargs):
+    @staticmethod
+    async def not_found(guild_id: int, name: str) -> str:
+        text = "Could not find a tag with that name."
+        if suggestions := await Tag.search(guild_id, name, limit=3):
+            text += " Did you mean: " + ", ".join(f"`{suggestion}`" for suggestion in suggestions) + "?"
+        return text
+
+    async def request(self, ctx, **kwargs):
         embeds = self.log_embeds(**kwargs)
         log = await self.log_channel.send(embeds=embeds)
+        await TagRequest(
+            message_id=log.id,
+            guild_id=ctx.guild.id,
+            kind=kwargs["rtype"].lower(),
+            name=kwargs["tname"] or kwargs["before"],  # Renames have no `tname`
+            before=kwargs["before"],
+            after=kwargs["after"],
+            author_id=kwargs["author_id"],
+            requested_by=ctx.author.id,
+        ).post()
 
         for emoji in EMOJIS:
             await log.add_reaction(emoji)
@@ -100,15 +118,31 @@ class TagCommands(commands.Cog, name="Tags"):
 
         if tag is None:
             await ctx.message.delete(delay=10.0)
-            message = await ctx.send("Could not find a tag with that name.")
+            message = await ctx.send(await self.not_found(ctx.guild.id, name))
             return await message.delete(delay=10.0)
 
         await ctx.send(tag.text)
-        await Model.execute(
-            "UPDATE tags SET uses = uses + 1 WHERE guild_id = $1 AND name = $2",
-            ctx.guild.id,
-            name,
-        )
+        Tag.on_use(ctx.guild.id, name)
+
+    @app_commands.command(name="tag")
+    @app_commands.guild_only()
+    @app_commands.describe(name="The tag's name")
+    async def tag_slash(self, interaction: discord.Interaction, name: str):
+        """Send a tag."""
+        name = name.lower()
+        tag = await Tag.fetch_tag(guild_id=interaction.guild_id, name=name)
+
+        if tag is None:
+            return await interaction.response.send_message(
+                await self.not_found(interaction.guild_id, name), ephemeral=True
+            )
+
+        await interaction.response.send_message(tag.text)
+        Tag.on_use(interaction.guild_id, name)
+
+    @tag_slash.autocomplete("name")
+    async def tag_slash_autocomplete(self, interaction: discord.Interaction, current: str):
+        return [app_commands.Choice(name=name, value=name) for name in Tag.complete(interaction.guild_id, current)]
 
     ####################################################################################################################
     # Commands
@@ -118,13 +152,14 @@ class TagCommands(commands.Cog, name="Tags"):
     async def info(self, ctx, *, name: commands.clean_content):
         """Get information regarding the specified tag."""
         name = name.lower()
-        tag = await Tag.fetch_tag(guild_id=ctx.guild.id, name=name)
+        tag = await Tag.fetch_tag(guild_id=ctx.guild.id, name=name, cached=False)
 
         if tag is None:
             await ctx.message.delete(delay=10.0)
             message = await ctx.send("Could not find a tag with that name.")
             return await message.delete(delay=10.0)
 
+        tag = tag.copy().merge_pending()
         author = self.bot.get_user(tag.creator_id)
         author = str(author) if isinstance(author, discord.User) else f"(ID: {tag.creator_id})"
         text = f"Tag: {name}\n\n```prolog\nCreator: {author}\n   Uses: {tag.uses}\n```"
@@ -161,7 +196,7 @@ class TagCommands(commands.Cog, name="Tags"):
 
             return await ctx.send("You have successfully created your tag.")
 
-        await self.request(**kwargs)
+        await self.request(ctx, **kwargs)
         return await ctx.reply("Tag creation request submitted.")
 
     @tag.command()
@@ -247,7 +282,7 @@ class TagCommands(commands.Cog, name="Tags"):
             await self.log_channel.send(embeds=self.log_embeds(**kwargs, approve=True, approver=ctx.author))
             return await ctx.send("You have successfully edited your tag.")
 
-        await self.request(**kwargs)
+        await self.request(ctx, **kwargs)
         return await ctx.reply("Tag update request submitted.")
 
     @tag.command()
@@ -284,16 +319,15 @@ class TagCommands(commands.Cog, name="Tags"):
     @tag.command()
     @commands.cooldown(1, 1, commands.BucketType.user)
     async def search(self, ctx, *, term: str):
-        """Search for a tag given a search term. PostgreSQL syntax must be used for the search."""
-        query = """SELECT name FROM tags WHERE guild_id = $1 AND name LIKE $2 LIMIT 10"""
-        records = await Model.fetch(query, ctx.guild.id, term)
+        """Search for a tag by its name, typos are fine."""
+        names = await Tag.search(ctx.guild.id, term, limit=10)
 
-        if not records:
+        if not names:
             return await ctx.send("No tags found that has the term in it's name", delete_after=10)
-        count = "Maximum of 10" if len(records) == 10 else len(records)
-        records = "\n".join([record["name"] for record in records])
+        count = "Maximum of 10" if len(names) == 10 else len(names)
+        names = "\n".join(names)
 
-        await ctx.send(f"**{count} tags found with search term on this server.**```\n{records}\n```")
+        await ctx.send(f"**{count} tags found with search term on this server.**```\n{names}\n```")
 
     @tag.command()
     @is_engineer_check()
@@ -332,7 +366,7 @@ class TagCommands(commands.Cog, name="Tags"):
             await self.log_channel.send(embeds=self.log_embeds(**kwargs, approve=True, approver=ctx.author))
             return await ctx.send("You have successfully renamed your tag.")
 
-        await self.request(**kwargs)
+        await self.request(ctx, **kwargs)
         return await ctx.reply("Tag update request submitted.")
 
     @tag.command()
@@ -369,7 +403,7 @@ class TagCommands(commands.Cog, name="Tags"):
             await self.log_channel.send(embeds=self.log_embeds(**kwargs, approve=True, approver=ctx.author))
             return await ctx.send("You have successfully appended to your tag content.")
 
-        await self.request(**kwargs)
+        await self.request(ctx, **kwargs)
         return await ctx.reply("Tag update request submitted.")
 
     @commands.Cog.listener()
@@ -377,56 +411,32 @@ class TagCommands(commands.Cog, name="Tags"):
         if event.channel_id != settings.tags.log_channel_id:
             return
 
-        if event.member.bot:
-            return
-
-        message = await self.bot.get_channel(event.channel_id).fetch_message(event.message_id)
-
-        if not message.embeds:
+        if event.member is None or event.member.bot:
             return
 
-        if str(event.emoji) not in EMOJIS:
+        if str(event.emoji) not in EMOJIS or event.message_id not in TagRequest.pending:
             return
 
         approved = str(event.emoji) == "\N{WHITE HEAVY CHECK MARK}"
+        request = await TagRequest.resolve(event.message_id, approved, event.member.id)
+        if request is None:  # Another staff member was faster
+            return
 
-        if message.embeds[0].title == "Tag Create Request":
-            await message.clear_reactions()
-            return self.bot.dispatch(
-                "tag_create_response",
-                message,
-                approved,
-                user=event.member,
-            )
-        elif message.embeds[0].title == "Tag Update Request":
-            await message.clear_reactions()
-            return self.bot.dispatch(
-                "tag_update_response",
-                message,
-                approved,
-                user=event.member,
-            )
-        elif message.embeds[0].title == "Tag Rename Request":
-            await message.clear_reactions()
-            return self.bot.dispatch(
-                "tag_rename_response",
-                message,
-                approved,
-                user=event.member,
-            )
+        message = self.log_channel.get_partial_message(event.message_id)
+        await message.clear_reactions()
+        return self.bot.dispatch(f"tag_{request.kind}_response", message, request, approved, user=event.member)
 
     ####################################################################################################################
     # Listeners
     ####################################################################################################################
 
     @commands.Cog.listener()
-    async def on_tag_rename_response(self, message: discord.Message, approved, user):
-        embed = message.embeds[0]
-        before, after = embed.fields[0].value, embed.fields[1].value
-        creator_id = int(embed.fields[-1].value.split("(")[-1][:-1])
-        author = await self.bot.resolve_user(creator_id)
+    async def on_tag_rename_response(self, message: discord.PartialMessage, request: TagRequest, approved, user):
+        before, after = request.before, request.after
+        author = await self.bot.resolve_user(request.author_id)
+        Tag.invalidate(request.guild_id, before, after)  # The request may be older than the cached tags
         if approved:
-            tag = await Tag.fetch_tag(guild_id=message.guild.id, name=before)
+            tag = await Tag.fetch_tag(guild_id=request.guild_id, name=before)
 
             if tag is None:
                 # embed.title = "Tag Rename Failed"
@@ -436,38 +446,27 @@ class TagCommands(commands.Cog, name="Tags"):
 
             await tag.rename(new_name=after)
 
-        await message.edit(
-            embeds=self.log_embeds(
-                rtype="Rename",
-                tname="",
-                before=before,
-                after=after,
-                author_id=author.id,
-                approver=user,
-                approve=approved,
-            ),
-        )
+        await message.edit(embeds=self.log_embeds(**request.log_kwargs(), approver=user, approve=approved))
         await self.notify(
             author,
             f"Tag `{before}` renaming to `{after}` request has been {['deni', 'approv'][approved]}ed.",
         )
 
     @commands.Cog.listener()
-    async def on_tag_create_response(self, message: discord.Message, approved, user):
-        embed = message.embeds[0]
-        name, text = embed.fields[0].value, embed.description.split("\n", 1)[-1]
-        creator_id = int(embed.fields[-1].value.split("(")[-1][:-1])
-        author = await self.bot.resolve_user(creator_id)
+    async def on_tag_create_response(self, message: discord.PartialMessage, request: TagRequest, approved, user):
+        name, text = request.name, request.after
+        author = await self.bot.resolve_user(request.author_id)
+        Tag.invalidate(request.guild_id, name)
 
         if approved:
             tag = Tag(
                 bot=self.bot,
-                guild_id=message.guild.id,
-                creator_id=creator_id,
+                guild_id=request.guild_id,
+                creator_id=request.author_id,
                 name=name,
                 text=text,
             )
-            if await Tag.fetch_tag(guild_id=message.guild.id, name=name):
+            if await Tag.fetch_tag(guild_id=request.guild_id, name=name):
                 # embed.title = "Tag Create Failed"
                 # embed.colour = discord.Color.red()
                 # return await message.edit(embed=embed)
@@ -475,35 +474,20 @@ class TagCommands(commands.Cog, name="Tags"):
 
             await tag.post()
 
-        await message.edit(
-            embeds=self.log_embeds(
-                rtype="Create",
-                tname=name,
-                before="",
-                after=text,
-                author_id=author.id,
-                approver=user,
-                approve=approved,
-            ),
-        )
+        await message.edit(embeds=self.log_embeds(**request.log_kwargs(), approver=user, approve=approved))
         await self.notify(
             author,
             f"Tag `{name}` creating request has been {['deni', 'approv'][approved]}ed.",
         )
 
     @commands.Cog.listener()
-    async def on_tag_update_response(self, message: discord.Message, approved, user):
-        embeds = message.embeds
-        name = embeds[1].fields[0].value
-        before, after = (
-            embeds[0].description.split("\n", 1)[-1],
-            embeds[1].description.split("\n", 1)[-1],
-        )
-        creator_id = int(embeds[1].fields[-1].value.split("(")[-1][:-1])
-        author = await self.bot.resolve_user(creator_id)
+    async def on_tag_update_response(self, message: discord.PartialMessage, request: TagRequest, approved, user):
+        name = request.name
+        author = await self.bot.resolve_user(request.author_id)
+        Tag.invalidate(request.guild_id, name)
 
         if approved:
-            tag = await Tag.fetch_tag(guild_id=message.guild.id, name=name)
+            tag = await Tag.fetch_tag(guild_id=request.guild_id, name=name)
 
             if tag is None:
                 # embeds[0].title = "Tag Update Failed"
@@ -511,19 +495,9 @@ class TagCommands(commands.Cog, name="Tags"):
                 # return await message.edit(embeds=embeds)
                 return await message.delete()
 
-            await tag.update(text=after)
+            await tag.update(text=request.after)
 
-        await message.edit(
-            embeds=self.log_embeds(
-                rtype="Update",
-                tname=name,
-                before=before,
-                after=after,
-                author_id=author.id,
-                approver=user,
-                approve=approved,
-            ),
-        )
+        await message.edit(embeds=self.log_embeds(**request.log_kwargs(), approver=user, approve=approved))
         await self.notify(
             author,
             f"Tag `{name}` updating request has been {['deni', 'approv'][approved]}ed.",
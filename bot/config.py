@@ -1,6 +1,6 @@
 import json
 import logging
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from pydantic import BaseModel, BaseSettings, PostgresDsn, ValidationError, validator
 
@@ -42,11 +42,28 @@ class CoC(BaseModel):
     role_id: int
 
 
+class Counters(BaseModel):
+    reconcile_interval: float = 6.0  # Hours between exact recounts of the counters
+    reconcile_batch_size: int = 50  # Channels recounted per transaction
+    approximate: bool = False  # Only estimate the global count from the planner statistics when reconciling
+
+
 class Guild(BaseModel):
     id: int
     welcomes_channel_id: int
 
 
+class Ingestion(BaseModel):
+    batch_size: int = 500  # Flush once this many messages are buffered
+    max_age: float = 5.0  # Seconds a message may stay buffered before it is flushed
+    max_pending: int = 50_000  # Messages kept while the database is unavailable, older ones are dropped
+    counters_interval: float = 10.0  # Seconds between writes of the users' message/command counters
+    known_users_max: int = 1_000_000  # User ids remembered in memory to skip existence checks
+    compact: bool = False  # Store new messages compressed, see `cli.py compact`
+    leaderboard_size: int = 100  # Highest scores kept in memory per leaderboard
+    leaderboard_interval: float = 300.0  # Seconds between reconciles of the leaderboards with the database
+
+
 class Moderation(BaseModel):
     admin_roles_ids: List[int]
     staff_role_id: int
@@ -79,9 +96,48 @@ class ReactionRoles(BaseModel):
         return {int(k): v for k, v in json.loads(val).items()}
 
 
+class Retention(BaseModel):
+    messages: Optional[int] = None  # Days messages are kept, None keeps them forever
+    message_revisions: Optional[int] = None  # Days edits/deletions are kept, never longer than the messages
+    reps: Optional[int] = None  # Days reps are kept, the reps counted on users stay
+    polls: Optional[int] = None  # Days polls are kept
+    spool_batches: int = (
+        30  # Days the ids of replayed spool batches are kept, a batch replayed again later is counted twice
+    )
+    interval: float = 6.0  # Hours between runs of the pruning job
+    batch_size: int = 1000  # Rows deleted per transaction
+    pause: float = 0.5  # Seconds between batches, to spread out the load and WAL
+    lock_timeout: float = 2.0  # Seconds to wait for the locks to drop a whole partition, retried on the next run
+
+    @validator("reps")
+    def val_func(cls, v):
+        if v is not None and v < 1:
+            raise ValueError("reps must be kept at least a day, they are needed for the cooldowns")
+        return v
+
+
+class Scheduler(BaseModel):
+    workers: int = 8  # Jobs handled at the same time
+    queue_size: int = 1000  # Jobs queued per priority class before new analytics jobs are dropped
+    lag_threshold: float = 0.25  # Seconds of event loop lag after which analytics work is sampled
+    min_sample_rate: float = 0.1  # Lowest share of analytics work that is still accepted
+    detach_after: float = 2.0  # Seconds a worker waits for a job before leaving it to run on its own
+    max_detached: int = 100  # Jobs running on their own at most, past that workers wait for their jobs
+
+
+class Spool(BaseModel):
+    path: str = "spool"  # Directory for writes that couldn't reach postgres
+    segment_size: int = 16 * 1024 * 1024  # Bytes per segment file
+    fsync_interval: float = 1.0  # Seconds between fsyncs of the current segment
+    replay_interval: float = 5.0  # Seconds between attempts to replay spooled writes
+    use_mmap: bool = True  # Read segments through mmap while replaying
+
+
 class Tags(BaseModel):
     log_channel_id: int
     required_role_id: int  # [lvl 30] Engineer
+    cache_size: int = 256  # Tags cached per guild
+    cache_ttl: float = 300.0  # Seconds a cached tag is served before it is fetched again
 
 
 class Timathon(BaseModel):
@@ -94,11 +150,16 @@ class Settings(BaseSettings):
     bot: Bot
     challenges: Challenges
     coc: CoC
+    counters: Counters = Counters()
     postgres: Postgres
     guild: Guild
+    ingestion: Ingestion = Ingestion()
     moderation: Moderation
     notification: Notification  # For tim's youtube channel (currently unused)
     reaction_roles: ReactionRoles
+    retention: Retention = Retention()
+    scheduler: Scheduler = Scheduler()
+    spool: Spool = Spool()
     tags: Tags
     timathon: Timathon
 
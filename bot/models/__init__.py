@@ -1,15 +1,26 @@
+from .backfill import BackfillCheckpoint
+from .counter import Counter
 from .gconfig import FilterConfig
 from .message import Message
 from .model import Model
 from .rep import Rep
+from .revision import MessageRevision
+from .rollup import CommandRollup, MessageRollup
 from .tag import Tag
+from .tag_request import TagRequest
 from .user import User
 
 __all__ = (  # Fixes F401
     Model,
+    BackfillCheckpoint,
+    Counter,
     FilterConfig,
     Message,
+    MessageRevision,
+    MessageRollup,
+    CommandRollup,
     Rep,
     Tag,
+    TagRequest,
     User,
 )
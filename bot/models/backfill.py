@@ -0,0 +1,41 @@
+from datetime import datetime
+from typing import ClassVar, Dict, List
+
+from asyncpg import Connection
+from pydantic import Field
+
+from .model import Model
+
+
+class BackfillCheckpoint(Model):
+    channel_id: int
+    guild_id: int
+    before_id: int
+    stop_id: int
+    fetched: int = 0
+    done: bool = False
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+    columns: ClassVar[tuple] = ("channel_id", "guild_id", "before_id", "stop_id", "fetched", "done")
+
+    async def post(self, con: Connection = None) -> None:
+        """Save the checkpoint, call this in the same transaction as the messages it covers."""
+        query = """INSERT INTO backfill_checkpoints ( channel_id, guild_id, before_id, stop_id, fetched, done )
+                   VALUES ( $1, $2, $3, $4, $5, $6 )
+                   ON CONFLICT ( channel_id ) DO UPDATE
+                   SET before_id  = EXCLUDED.before_id,
+                       stop_id    = EXCLUDED.stop_id,
+                       fetched    = EXCLUDED.fetched,
+                       done       = EXCLUDED.done,
+                       updated_at = NOW()"""
+        await self.execute(query, *(getattr(self, column) for column in self.columns), con=con)
+
+    @classmethod
+    async def fetch_channels(cls, channel_ids: List[int]) -> Dict[int, "BackfillCheckpoint"]:
+        query = """SELECT * FROM backfill_checkpoints WHERE channel_id = ANY($1::bigint[])"""
+        return {checkpoint.channel_id: checkpoint for checkpoint in await cls.fetch(query, channel_ids)}
+
+    @classmethod
+    async def clear(cls, channel_ids: List[int], con: Connection = None) -> None:
+        query = """DELETE FROM backfill_checkpoints WHERE channel_id = ANY($1::bigint[])"""
+        await cls.execute(query, channel_ids, con=con)
@@ -0,0 +1,154 @@
+import logging
+from datetime import datetime
+from typing import ClassVar, Dict, Iterable, List, Literal, Mapping, Optional, Tuple
+
+from asyncpg import Connection, Record
+
+from .model import Model
+
+log = logging.getLogger(__name__)
+
+Scope = Literal["global", "guild", "channel"]
+
+
+class Counter(Model):
+    name: str
+    scope: Scope
+    scope_id: int
+    value: int
+    reconciled_at: Optional[datetime]
+
+    cache: ClassVar[Dict[Tuple[str, str, int], int]] = {}
+
+    @classmethod
+    def get(cls, name: str, scope: Scope = "global", scope_id: int = 0) -> Optional[int]:
+        """The cached value, None if it isn't loaded (yet)."""
+        return cls.cache.get((name, scope, scope_id))
+
+    @classmethod
+    def update_cache(cls, name: str, records: Iterable[Mapping]) -> None:
+        """Cache the (scope, scope_id, value) records returned by the statements that change counters."""
+        for record in records:
+            cls.cache[name, record["scope"], record["scope_id"]] = record["value"]
+
+    @classmethod
+    async def load(cls) -> None:
+        records = await cls.fetch("""SELECT name, scope, scope_id, value FROM counters""", convert=False)
+        cls.cache = {(record["name"], record["scope"], record["scope_id"]): record["value"] for record in records}
+
+    @classmethod
+    async def add_messages(cls, counts: Mapping[Optional[int], int], con: Connection = None) -> List[Record]:
+        """Add `{channel_id: n}` to the messages counters of the channels, their guilds and the global one.
+        The rows are locked in the same order as at ingestion, negative counts subtract.
+        Returns the changed counters, pass them to `update_cache` once the transaction has committed."""
+        query = """WITH per_channel ( channel_id, n ) AS (
+                       SELECT * FROM unnest($1::bigint[], $2::bigint[])
+                   )
+                   INSERT INTO counters ( name, scope, scope_id, value )
+                   SELECT 'messages', scope, scope_id, n FROM (
+                       SELECT 'channel' AS scope, channel_id AS scope_id, n
+                       FROM per_channel
+                       WHERE channel_id IS NOT NULL
+                       UNION ALL
+                       SELECT 'guild', c.guild_id, SUM(p.n)::BIGINT
+                       FROM per_channel p
+                       JOIN channels c USING (channel_id)
+                       GROUP BY c.guild_id
+                       UNION ALL
+                       SELECT 'global', 0, SUM(n)::BIGINT FROM per_channel HAVING COUNT(*) > 0
+                   ) AS d
+                   ORDER BY scope, scope_id
+                   ON CONFLICT ( name, scope, scope_id ) DO UPDATE
+                   SET value = counters.value + EXCLUDED.value
+                   RETURNING scope, scope_id, value"""
+        return await cls.fetch(query, list(counts), list(counts.values()), con=con, convert=False)
+
+    @classmethod
+    async def estimate_messages(cls) -> int:
+        """Estimated amount of messages from the planner statistics, for when exact counts are too expensive."""
+        query = """SELECT SUM(GREATEST(c.reltuples, 0))::BIGINT
+                   FROM pg_partition_tree('messages') p
+                   JOIN pg_class c ON c.oid = p.relid"""
+        return await cls.fetchval(query) or 0
+
+    @classmethod
+    async def reconcile_messages(cls, batch_size: int = 50, approximate: bool = False) -> None:
+        """Recount the messages counters, `batch_size` channels per transaction.
+
+        The messages are counted without locks, in a snapshot that also reads the counters. Ingestion commits
+        the messages together with their counter increments, so the difference between the two is the drift
+        at that snapshot, which is then added to the counters in a short transaction. Increments committed
+        in between are kept that way, the counter rows are only locked for that last statement.
+        With `approximate` only the global counter is set, from `estimate_messages`."""
+        if approximate:
+            query = """INSERT INTO counters ( name, scope, scope_id, value, reconciled_at )
+                       VALUES ( 'messages', 'global', 0, $1, NOW() )
+                       ON CONFLICT ( name, scope, scope_id ) DO UPDATE
+                       SET value = EXCLUDED.value, reconciled_at = EXCLUDED.reconciled_at"""
+            await cls.execute(query, await cls.estimate_messages())
+            return await cls.load()
+
+        query = """SELECT channel_id FROM channels
+                   UNION
+                   SELECT scope_id FROM counters WHERE name = 'messages' AND scope = 'channel'
+                   ORDER BY 1"""
+        channel_ids = [record[0] for record in await cls.fetch(query, convert=False)]
+
+        for i in range(0, len(channel_ids), batch_size):
+            drifts = await cls._snapshot_drifts(
+                """SELECT 'channel' AS scope, id AS scope_id,
+                          (SELECT COUNT(*) FROM messages m WHERE m.channel_id = id) - COALESCE(c.value, 0) AS drift
+                   FROM unnest($1::bigint[]) AS id
+                   LEFT JOIN counters c ON c.name = 'messages' AND c.scope = 'channel' AND c.scope_id = id""",
+                channel_ids[i : i + batch_size],
+            )
+            await cls._add_drifts(drifts)
+
+        drifts = await cls._snapshot_drifts(
+            """WITH channel_counters AS (
+                   SELECT scope_id AS channel_id, value FROM counters
+                   WHERE name = 'messages' AND scope = 'channel'
+               ), expected AS (
+                   SELECT 'global' AS scope, 0::BIGINT AS scope_id,
+                          (SELECT COALESCE(SUM(value), 0) FROM channel_counters)
+                              + (SELECT COUNT(*) FROM messages WHERE channel_id IS NULL) AS value
+                   UNION ALL
+                   SELECT 'guild', c.guild_id, SUM(cc.value)
+                   FROM channel_counters cc
+                   JOIN channels c USING (channel_id)
+                   GROUP BY c.guild_id
+               )
+               SELECT e.scope, e.scope_id, e.value - COALESCE(c.value, 0) AS drift
+               FROM expected e
+               LEFT JOIN counters c ON c.name = 'messages' AND c.scope = e.scope AND c.scope_id = e.scope_id"""
+        )
+        await cls._add_drifts(drifts)
+
+        await cls.load()
+        log.info(f"Reconciled the messages counters of {len(channel_ids)} channels")
+
+    @classmethod
+    async def _snapshot_drifts(cls, query: str, *args) -> List[Record]:
+        """Run a query returning (scope, scope_id, drift) records in a single snapshot, without locking anything."""
+        async with cls.pool.acquire() as con:
+            async with con.transaction(isolation="repeatable_read", readonly=True):
+                return await cls.fetch(query, *args, con=con, convert=False)
+
+    @classmethod
+    async def _add_drifts(cls, drifts: List[Record]) -> None:
+        """Add the drifts to the messages counters, in the lock order of ingestion, and mark them reconciled."""
+        if not drifts:
+            return
+
+        query = """INSERT INTO counters ( name, scope, scope_id, value, reconciled_at )
+                   SELECT 'messages', d.scope, d.scope_id, d.drift, NOW()
+                   FROM unnest($1::varchar[], $2::bigint[], $3::bigint[]) AS d ( scope, scope_id, drift )
+                   ORDER BY d.scope, d.scope_id
+                   ON CONFLICT ( name, scope, scope_id ) DO UPDATE
+                   SET value = counters.value + EXCLUDED.value, reconciled_at = EXCLUDED.reconciled_at"""
+        await cls.execute(
+            query,
+            [record["scope"] for record in drifts],
+            [record["scope_id"] for record in drifts],
+            [record["drift"] for record in drifts],
+        )
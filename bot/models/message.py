@@ -1,10 +1,24 @@
-from datetime import datetime
+import asyncio
+import logging
+import re
+from datetime import datetime, timezone
+from typing import ClassVar, List, Mapping, Optional, Tuple
 
+from asyncpg import Connection, DeadlockDetectedError, LockNotAvailableError, Record
 from discord import Message as Discord_Message
+from discord.utils import parse_time, time_snowflake
 
+from bot.config import settings
+from bot.services import Codec, RecordBuffer, train_dictionary
+
+from .counter import Counter
 from .model import Model
 from .user import User
 
+log = logging.getLogger(__name__)
+
+PARTITION_UPPER_BOUND = re.compile(r"TO \('?(\d+)'?\)")  # Of `FOR VALUES FROM (...) TO ('...')`
+
 
 class Message(Model):
     created_at: datetime
@@ -14,24 +28,306 @@ class Message(Model):
     guild_id: int
     author_id: int
 
-    async def post(self) -> None:
-        """We shouldn't have to check for duplicate messages here ->
-        Unless someone mis-uses this.
-        If a conflict somehow still occurs nothing will happen. ( hopefully :shrug: )"""
+    columns: ClassVar[tuple] = ("message_id", "guild_id", "channel_id", "author_id", "content", "created_at", "body")
+    buffer: ClassVar[RecordBuffer]
+    codec: ClassVar[Codec] = Codec()
 
-        query = """INSERT INTO messages ( message_id, guild_id, channel_id, author_id, content, created_at )
-                   VALUES ( $1, $2, $3, $4, $5, $6 )
-                   ON CONFLICT DO NOTHING"""
-        await self.execute(
-            query,
+    def to_record(self, compact: bool = settings.ingestion.compact) -> tuple:
+        """A row for the messages table.
+        Compact rows only keep the ids and the compressed content, the rest is derived on read.
+        `guild_id` and `content` are kept so they can be recorded in the channels table and the search vector,
+        they are dropped when moved out of staging."""
+        if compact:
+            return (
+                self.message_id,
+                self.guild_id,
+                self.channel_id,
+                self.author_id,
+                self.content,
+                None,
+                self.codec.encode(self.content),
+            )
+
+        return (
             self.message_id,
             self.guild_id,
             self.channel_id,
             self.author_id,
             self.content,
             self.created_at.replace(tzinfo=None),
+            None,
+        )
+
+    @classmethod
+    def from_record(cls, record: Mapping) -> "Message":
+        """Build a message from a row of `messages_expanded`, decompressing the content of compact rows."""
+        content = record["content"]
+        if content is None and record["body"] is not None:
+            content = cls.codec.decode(record["body"])
+
+        return cls(
+            created_at=record["created_at"],
+            content=content or "",
+            message_id=record["message_id"],
+            channel_id=record["channel_id"],
+            guild_id=record["guild_id"],
+            author_id=record["author_id"],
+        )
+
+    @classmethod
+    def from_payload(cls, data: Mapping, guild_id: int) -> "Message":
+        """Build a message from a raw api payload, like the pages returned by `HTTPClient.logs_from`."""
+        return cls(
+            created_at=parse_time(data["timestamp"]),
+            content=data["content"],
+            message_id=int(data["id"]),
+            channel_id=int(data["channel_id"]),
+            guild_id=guild_id,
+            author_id=int(data["author"]["id"]),
         )
 
+    async def post(self) -> None:
+        """We shouldn't have to check for duplicate messages here ->
+        Unless someone mis-uses this.
+        If a conflict somehow still occurs nothing will happen. ( hopefully :shrug: )"""
+        await self.bulk_post([self.to_record()])
+
+    @classmethod
+    async def bulk_post(cls, records: List[tuple], con: Connection = None) -> None:
+        """Write many records (see `to_record`) at once.
+        They are COPY'd into a temporary table first, so duplicates can be skipped when moving them over.
+        The messages counters and hourly rollups are incremented by the rows that were actually inserted."""
+        if con is None:
+            async with cls.pool.acquire() as con:
+                return await cls.bulk_post(records, con=con)
+
+        async with con.transaction():
+            await con.execute(
+                """CREATE TEMPORARY TABLE IF NOT EXISTS messages_staging
+                   (
+                       message_id BIGINT,
+                       guild_id   BIGINT,
+                       channel_id BIGINT,
+                       author_id  BIGINT,
+                       content    VARCHAR,
+                       created_at TIMESTAMP,
+                       body       BYTEA
+                   ) ON COMMIT DELETE ROWS"""
+            )
+            await con.copy_records_to_table("messages_staging", records=records, columns=cls.columns)
+            await con.execute(
+                """INSERT INTO channels ( channel_id, guild_id )
+                   SELECT DISTINCT channel_id, guild_id FROM messages_staging
+                   ON CONFLICT DO NOTHING"""
+            )
+            counters = await con.fetch(
+                """WITH inserted AS (
+                       INSERT INTO messages ( message_id, guild_id, channel_id, author_id, content, created_at, body,
+                                              search )
+                       SELECT message_id, CASE WHEN body IS NULL THEN guild_id END, channel_id, author_id,
+                              CASE WHEN body IS NULL THEN content END, created_at, body,
+                              TO_TSVECTOR('english', COALESCE(content, ''))
+                       FROM messages_staging
+                       ON CONFLICT DO NOTHING
+                       RETURNING message_id, channel_id, author_id
+                   ), per_hour AS (
+                       SELECT DATE_TRUNC('hour', snowflake_time(message_id)) AS hour, channel_id, author_id,
+                              COUNT(*) AS n
+                       FROM inserted
+                       GROUP BY 1, 2, 3
+                   ), per_channel AS (
+                       SELECT channel_id, SUM(n)::BIGINT AS n FROM per_hour GROUP BY channel_id
+                   ), rollups AS (
+                       INSERT INTO message_rollups ( hour, scope, scope_id, messages )
+                       SELECT hour, scope, scope_id, SUM(n) FROM (
+                           SELECT hour, 'channel' AS scope, channel_id AS scope_id, n
+                           FROM per_hour
+                           WHERE channel_id IS NOT NULL
+                           UNION ALL
+                           SELECT hour, 'user', author_id, n FROM per_hour WHERE author_id IS NOT NULL
+                           UNION ALL
+                           SELECT h.hour, 'guild', c.guild_id, h.n FROM per_hour h JOIN channels c USING (channel_id)
+                       ) AS r
+                       GROUP BY scope, scope_id, hour
+                       ORDER BY scope, scope_id, hour
+                       ON CONFLICT ( scope, scope_id, hour ) DO UPDATE
+                       SET messages = message_rollups.messages + EXCLUDED.messages
+                   )
+                   INSERT INTO counters ( name, scope, scope_id, value )
+                   SELECT 'messages', scope, scope_id, n FROM (
+                       SELECT 'channel' AS scope, channel_id AS scope_id, n
+                       FROM per_channel
+                       WHERE channel_id IS NOT NULL
+                       UNION ALL
+                       SELECT 'guild', c.guild_id, SUM(p.n)::BIGINT
+                       FROM per_channel p
+                       JOIN channels c USING (channel_id)
+                       GROUP BY c.guild_id
+                       UNION ALL
+                       SELECT 'global', 0, SUM(n)::BIGINT FROM per_channel HAVING COUNT(*) > 0
+                   ) AS d
+                   ORDER BY scope, scope_id  -- Same lock order as `Counter.reconcile_messages`
+                   ON CONFLICT ( name, scope, scope_id ) DO UPDATE
+                   SET value = counters.value + EXCLUDED.value
+                   RETURNING scope, scope_id, value"""
+            )
+
+        Counter.update_cache("messages", counters)
+
+    @classmethod
+    async def search(
+        cls,
+        query: str,
+        guild_id: int,
+        *,
+        channel_id: Optional[int] = None,
+        author_id: Optional[int] = None,
+        after: Optional[datetime] = None,
+        before: Optional[datetime] = None,
+        cursor: Optional[Tuple[float, int]] = None,
+        limit: int = 5,
+    ) -> List[Record]:
+        """Messages matching the web search style `query`, best matches first.
+        Pass the (rank, message_id) of the last result as `cursor` to get the next page."""
+        low = time_snowflake(after.replace(tzinfo=after.tzinfo or timezone.utc)) if after else 0
+        high = time_snowflake(before.replace(tzinfo=before.tzinfo or timezone.utc)) - 1 if before else 2**63 - 1
+        rank, last_id = cursor or (None, None)
+
+        query_ = """SELECT * FROM (
+                        SELECT m.message_id, m.channel_id, m.author_id, m.content, m.body,
+                               TS_RANK(m.search, q)::REAL AS rank
+                        FROM messages m
+                        JOIN channels c ON c.channel_id = m.channel_id
+                        CROSS JOIN WEBSEARCH_TO_TSQUERY('english', $1) AS q
+                        WHERE m.search @@ q
+                          AND c.guild_id = $2
+                          AND ($3::BIGINT IS NULL OR m.channel_id = $3)
+                          AND ($4::BIGINT IS NULL OR m.author_id = $4)
+                          AND m.message_id BETWEEN $5 AND $6
+                    ) AS r
+                    WHERE $7::REAL IS NULL OR (r.rank, r.message_id) < ($7, $8::BIGINT)
+                    ORDER BY r.rank DESC, r.message_id DESC
+                    LIMIT $9"""
+        return await cls.fetch(
+            query_, query, guild_id, channel_id, author_id, low, high, rank, last_id, limit, convert=False
+        )
+
+    @classmethod
+    async def create_partitions(cls, months_ahead: int = 3) -> None:
+        """Make sure the monthly partitions exist for the current month and `months_ahead` months after it."""
+        query = """SELECT create_messages_partition(month::DATE)
+                   FROM GENERATE_SERIES(
+                       DATE_TRUNC('month', NOW()),
+                       DATE_TRUNC('month', NOW()) + MAKE_INTERVAL(months => $1),
+                       INTERVAL '1 month'
+                   ) AS month"""
+        await cls.execute(query, months_ahead)
+
+    @classmethod
+    async def prune(
+        cls, before: datetime, *, batch_size: int = 1000, pause: float = 0.5, lock_timeout: float = 2.0
+    ) -> int:
+        """Delete the messages sent before `before` and subtract them from the messages counters.
+        Partitions that are entirely older are dropped whole, which leaves no dead rows to vacuum,
+        the rest is deleted in batches of `batch_size` with `pause` seconds in between.
+        The users' `messages_sent` and the hourly rollups are lifetime totals and are kept as they are.
+        Returns the amount of messages deleted."""
+        cutoff = time_snowflake(before.replace(tzinfo=before.tzinfo or timezone.utc))
+        query = """SELECT p.relid::regclass::text AS name, PG_GET_EXPR(c.relpartbound, c.oid) AS bound
+                   FROM pg_partition_tree('messages') p
+                   JOIN pg_class c ON c.oid = p.relid
+                   WHERE p.isleaf
+                   ORDER BY name"""
+        deleted = 0
+        for record in await cls.fetch(query, convert=False):
+            match = PARTITION_UPPER_BOUND.search(record["bound"])
+            if match is not None and int(match.group(1)) <= cutoff:
+                deleted += await cls._drop_partition(record["name"], lock_timeout)
+
+        query = """WITH deleted AS (
+                       DELETE FROM messages
+                       WHERE message_id = ANY(ARRAY(
+                           SELECT message_id FROM messages
+                           WHERE message_id > $1 AND message_id < $2
+                           ORDER BY message_id
+                           LIMIT $3
+                       ))
+                       RETURNING message_id, channel_id
+                   )
+                   SELECT channel_id, COUNT(*) AS n, MAX(message_id) AS last_id FROM deleted GROUP BY channel_id"""
+        last_id = 0
+        batches = 0
+        while True:
+            async with cls.pool.acquire() as con:
+                async with con.transaction():
+                    records = await cls.fetch(query, last_id, cutoff, batch_size, con=con, convert=False)
+                    counters = await Counter.add_messages(
+                        {record["channel_id"]: -record["n"] for record in records}, con=con
+                    )
+            if not records:
+                break
+
+            Counter.update_cache("messages", counters)
+            last_id = max(record["last_id"] for record in records)
+            deleted += sum(record["n"] for record in records)
+            batches += 1
+            if batches % 100 == 0:
+                log.info(f"messages: deleted {deleted} rows so far")
+            await asyncio.sleep(pause)
+
+        return deleted
+
+    @classmethod
+    async def _drop_partition(cls, name: str, lock_timeout: float) -> int:
+        """Drop a partition and subtract its rows from the counters, in one transaction.
+        The partition is only locked against writes while it is counted, `messages` itself is locked
+        just for the drop. Gives up after `lock_timeout` seconds of waiting, it's retried on the next run."""
+        async with cls.pool.acquire() as con:
+            try:
+                async with con.transaction():
+                    await con.execute(f"""SET LOCAL lock_timeout = {int(lock_timeout * 1000)}""")
+                    await con.execute(f"""LOCK TABLE {name} IN SHARE MODE""")
+                    query = f"""SELECT channel_id, COUNT(*) AS n FROM {name} GROUP BY channel_id"""
+                    records = await cls.fetch(query, con=con, convert=False)
+                    # Before the counters, ingestion takes the lock on messages first as well
+                    await con.execute("""LOCK TABLE messages IN ACCESS EXCLUSIVE MODE""")
+                    counters = await Counter.add_messages(
+                        {record["channel_id"]: -record["n"] for record in records}, con=con
+                    )
+                    await con.execute(f"""DROP TABLE {name}""")
+            except (LockNotAvailableError, DeadlockDetectedError) as error:
+                log.warning(f"Couldn't drop partition {name}, retrying on the next run: {error}")
+                return 0
+
+        Counter.update_cache("messages", counters)
+        deleted = sum(record["n"] for record in records)
+        log.info(f"Dropped partition {name} with {deleted} messages")
+        return deleted
+
+    @classmethod
+    async def load_dictionaries(cls) -> None:
+        """Load the compression dictionaries, new content is compressed with the latest one."""
+        for record in await cls.fetch("""SELECT id, data FROM compression_dictionaries ORDER BY id""", convert=False):
+            cls.codec.load(record["id"], record["data"])
+
+    @classmethod
+    async def train_dictionary(cls, sample_size: int = 20_000) -> int:
+        """Train a new compression dictionary on a sample of the stored messages and start using it.
+        Returns the id of the new dictionary."""
+        query = """SELECT content FROM messages TABLESAMPLE SYSTEM (1) WHERE content IS NOT NULL LIMIT $1"""
+        records = await cls.fetch(query, sample_size, convert=False)
+        if len(records) < sample_size // 10:  # Small tables don't sample well, use the latest messages instead
+            query = """SELECT content FROM messages WHERE content IS NOT NULL ORDER BY message_id DESC LIMIT $1"""
+            records = await cls.fetch(query, sample_size, convert=False)
+
+        data = train_dictionary(record["content"] for record in records)
+        query = """INSERT INTO compression_dictionaries ( id, data )
+                   SELECT COALESCE(MAX(id), 0) + 1, $1 FROM compression_dictionaries
+                   RETURNING id"""
+        dictionary_id = await cls.fetchval(query, data)
+        cls.codec.load(dictionary_id, data)
+        return dictionary_id
+
     @classmethod
     async def on_message(cls, message: Discord_Message) -> None:
         self = cls(
@@ -42,5 +338,15 @@ class Message(Model):
             channel_id=message.channel.id,
             author_id=message.author.id,
         )
-        await self.post()
-        await User.on_message(message.author)
+        cls.buffer.add(self.to_record())
+        User.on_message(message.author)
+
+
+Message.buffer = RecordBuffer(
+    "messages",
+    Message.bulk_post,
+    max_size=settings.ingestion.batch_size,
+    max_age=settings.ingestion.max_age,
+    max_pending=settings.ingestion.max_pending,
+    spool=Message.spool,
+)
@@ -5,4 +5,11 @@ CREATE TABLE IF NOT EXISTS migrations
     direction TEXT,
     name      TEXT,
     timestamp TIMESTAMP DEFAULT NOW()
-)
+);
+
+-- Timing and progress, rows with a `step` record the single steps of a migration
+ALTER TABLE migrations ADD COLUMN IF NOT EXISTS step TEXT;
+ALTER TABLE migrations ADD COLUMN IF NOT EXISTS started_at TIMESTAMP;
+ALTER TABLE migrations ADD COLUMN IF NOT EXISTS duration REAL;
+ALTER TABLE migrations ADD COLUMN IF NOT EXISTS progress BIGINT;
+ALTER TABLE migrations ADD COLUMN IF NOT EXISTS done BOOLEAN NOT NULL DEFAULT TRUE;
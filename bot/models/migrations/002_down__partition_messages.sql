@@ -0,0 +1,27 @@
+CREATE TABLE messages_unpartitioned
+(
+    created_at DATE,
+    content    VARCHAR,
+    message_id BIGINT,
+    channel_id BIGINT,
+    guild_id   BIGINT,
+    author_id  BIGINT
+);
+
+INSERT INTO messages_unpartitioned ( created_at, content, message_id, channel_id, guild_id, author_id )
+SELECT created_at::DATE, content, message_id, channel_id, guild_id, author_id
+FROM messages;
+
+DO
+$$
+BEGIN
+    IF TO_REGCLASS('messages_legacy') IS NOT NULL THEN
+        INSERT INTO messages_unpartitioned SELECT * FROM messages_legacy;
+        DROP TABLE messages_legacy;
+    END IF;
+END
+$$;
+
+DROP TABLE messages;
+DROP FUNCTION create_messages_partition(DATE), time_snowflake(TIMESTAMP), snowflake_time(BIGINT);
+ALTER TABLE messages_unpartitioned RENAME TO messages;
@@ -0,0 +1,56 @@
+-- Discord snowflakes start with the milliseconds since the discord epoch (2015-01-01),
+-- so a range of message ids is also a range of time.
+CREATE OR REPLACE FUNCTION time_snowflake(ts TIMESTAMP) RETURNS BIGINT
+    LANGUAGE SQL IMMUTABLE AS
+$$ SELECT ((EXTRACT(EPOCH FROM ts) * 1000)::BIGINT - 1420070400000) << 22 $$;
+
+CREATE OR REPLACE FUNCTION snowflake_time(id BIGINT) RETURNS TIMESTAMP
+    LANGUAGE SQL IMMUTABLE AS
+$$ SELECT TO_TIMESTAMP(((id >> 22) + 1420070400000) / 1000.0) AT TIME ZONE 'UTC' $$;
+
+-- The old rows are moved over in batches by `cli.py migrate messages`
+ALTER TABLE messages RENAME TO messages_legacy;
+
+-- Partitioned by message id, one partition per month, which lets `message_id` be the primary key on its own
+CREATE TABLE messages
+(
+    message_id BIGINT    NOT NULL,
+    guild_id   BIGINT,
+    channel_id BIGINT,
+    author_id  BIGINT,
+    content    VARCHAR,
+    created_at TIMESTAMP NOT NULL,
+    PRIMARY KEY (message_id)
+) PARTITION BY RANGE (message_id);
+
+CREATE INDEX messages_author_id_created_at_idx ON messages (author_id, created_at);
+CREATE INDEX messages_channel_id_created_at_idx ON messages (channel_id, created_at);
+
+CREATE OR REPLACE FUNCTION create_messages_partition(month DATE) RETURNS VOID
+    LANGUAGE plpgsql AS
+$$
+DECLARE
+    first_day DATE := DATE_TRUNC('month', month);
+BEGIN
+    EXECUTE FORMAT(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF messages FOR VALUES FROM (%s) TO (%s)',
+        'messages_' || TO_CHAR(first_day, 'YYYY_MM'),
+        time_snowflake(first_day),
+        time_snowflake((first_day + INTERVAL '1 month')::DATE)
+    );
+END
+$$;
+
+-- Everything before the bot started counting goes into a single partition
+DO
+$$
+BEGIN
+    EXECUTE FORMAT(
+        'CREATE TABLE IF NOT EXISTS messages_old PARTITION OF messages FOR VALUES FROM (MINVALUE) TO (%s)',
+        time_snowflake('2019-11-01')
+    );
+    PERFORM create_messages_partition(month::DATE)
+    FROM GENERATE_SERIES('2019-11-01'::DATE, DATE_TRUNC('month', NOW()) + INTERVAL '3 months', INTERVAL '1 month')
+         AS month;
+END
+$$;
@@ -0,0 +1,19 @@
+-- Compressed content can't be restored in SQL, run `cli.py compact --expand` before migrating down
+DROP VIEW messages_expanded;
+
+UPDATE messages SET created_at = snowflake_time(message_id) WHERE created_at IS NULL;
+
+UPDATE messages m
+SET guild_id = c.guild_id
+FROM channels c
+WHERE c.channel_id = m.channel_id AND m.guild_id IS NULL;
+
+CREATE INDEX messages_author_id_created_at_idx ON messages (author_id, created_at);
+CREATE INDEX messages_channel_id_created_at_idx ON messages (channel_id, created_at);
+DROP INDEX messages_author_id_message_id_idx, messages_channel_id_message_id_idx;
+
+DROP TABLE compression_dictionaries, channels;
+
+ALTER TABLE messages
+    DROP COLUMN body,
+    ALTER COLUMN created_at SET NOT NULL;
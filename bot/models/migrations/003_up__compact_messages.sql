@@ -0,0 +1,34 @@
+-- Compact rows keep only the ids and the compressed content in `body`,
+-- `created_at` is derived from the snowflake and `guild_id` from the channels table.
+ALTER TABLE messages
+    ALTER COLUMN created_at DROP NOT NULL,
+    ADD COLUMN body BYTEA;
+
+CREATE TABLE IF NOT EXISTS channels
+(
+    channel_id BIGINT PRIMARY KEY,
+    guild_id   BIGINT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS compression_dictionaries
+(
+    id         SMALLINT PRIMARY KEY CHECK (id BETWEEN 1 AND 255),
+    data       BYTEA NOT NULL,
+    created_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Snowflakes are ordered by time, so these indexes serve time ranges for compact rows as well
+CREATE INDEX messages_author_id_message_id_idx ON messages (author_id, message_id);
+CREATE INDEX messages_channel_id_message_id_idx ON messages (channel_id, message_id);
+DROP INDEX messages_author_id_created_at_idx, messages_channel_id_created_at_idx;
+
+CREATE VIEW messages_expanded AS
+SELECT m.message_id,
+       COALESCE(m.guild_id, c.guild_id)                     AS guild_id,
+       m.channel_id,
+       m.author_id,
+       m.content,
+       m.body,
+       COALESCE(m.created_at, snowflake_time(m.message_id)) AS created_at
+FROM messages m
+LEFT JOIN channels c ON c.channel_id = m.channel_id;
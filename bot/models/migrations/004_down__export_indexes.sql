@@ -0,0 +1,3 @@
+DROP INDEX IF EXISTS users_joined_at_idx;
+DROP INDEX IF EXISTS reps_repped_at_idx;
+DROP INDEX IF EXISTS tags_created_at_idx;
@@ -0,0 +1,13 @@
+-- Used by the --since/--until filters of `cli.py export`, messages are filtered on message_id instead.
+-- Each step drops the invalid index an interrupted build leaves behind first
+-- step: users_joined_at concurrently
+DROP INDEX CONCURRENTLY IF EXISTS users_joined_at_idx;
+CREATE INDEX CONCURRENTLY users_joined_at_idx ON users (joined_at);
+
+-- step: reps_repped_at concurrently
+DROP INDEX CONCURRENTLY IF EXISTS reps_repped_at_idx;
+CREATE INDEX CONCURRENTLY reps_repped_at_idx ON reps (repped_at);
+
+-- step: tags_created_at concurrently
+DROP INDEX CONCURRENTLY IF EXISTS tags_created_at_idx;
+CREATE INDEX CONCURRENTLY tags_created_at_idx ON tags (created_at);
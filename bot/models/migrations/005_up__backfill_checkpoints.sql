@@ -0,0 +1,11 @@
+-- Progress of `cli.py backfill`, history is walked backwards from `before_id` until `stop_id`
+CREATE TABLE IF NOT EXISTS backfill_checkpoints
+(
+    channel_id BIGINT PRIMARY KEY,
+    guild_id   BIGINT  NOT NULL,
+    before_id  BIGINT  NOT NULL,
+    stop_id    BIGINT  NOT NULL,
+    fetched    BIGINT  NOT NULL DEFAULT 0,
+    done       BOOLEAN NOT NULL DEFAULT FALSE,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
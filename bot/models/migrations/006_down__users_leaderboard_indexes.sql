@@ -0,0 +1,2 @@
+DROP INDEX IF EXISTS users_messages_sent_idx;
+DROP INDEX IF EXISTS users_commands_used_idx;
@@ -0,0 +1,9 @@
+-- Serve the leaderboards' reconciles with an index scan instead of sorting the whole table.
+-- Each step drops the invalid index an interrupted build leaves behind first
+-- step: messages_sent concurrently
+DROP INDEX CONCURRENTLY IF EXISTS users_messages_sent_idx;
+CREATE INDEX CONCURRENTLY users_messages_sent_idx ON users (messages_sent DESC NULLS LAST);
+
+-- step: commands_used concurrently
+DROP INDEX CONCURRENTLY IF EXISTS users_commands_used_idx;
+CREATE INDEX CONCURRENTLY users_commands_used_idx ON users (commands_used DESC NULLS LAST);
@@ -0,0 +1,37 @@
+-- Row counts kept up to date at ingestion, `scope` is either 'global' (scope_id 0), 'guild' or 'channel'
+CREATE TABLE IF NOT EXISTS counters
+(
+    name          VARCHAR NOT NULL,
+    scope         VARCHAR NOT NULL CHECK (scope IN ('global', 'guild', 'channel')),
+    scope_id      BIGINT  NOT NULL,
+    value         BIGINT  NOT NULL DEFAULT 0,
+    reconciled_at TIMESTAMP,
+    PRIMARY KEY (name, scope, scope_id)
+);
+
+-- Uncompacted rows from before the channels table existed still have their guild_id
+INSERT INTO channels ( channel_id, guild_id )
+SELECT DISTINCT channel_id, guild_id
+FROM messages
+WHERE channel_id IS NOT NULL AND guild_id IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+-- Seed the counters with one last full scan
+CREATE TEMPORARY TABLE channel_counts ON COMMIT DROP AS
+SELECT channel_id, COUNT(*) AS n
+FROM messages
+GROUP BY channel_id;
+
+INSERT INTO counters ( name, scope, scope_id, value, reconciled_at )
+SELECT 'messages', 'channel', channel_id, n, NOW()
+FROM channel_counts
+WHERE channel_id IS NOT NULL
+UNION ALL
+SELECT 'messages', 'guild', c.guild_id, SUM(cc.n), NOW()
+FROM channel_counts cc
+JOIN channels c USING (channel_id)
+GROUP BY c.guild_id
+UNION ALL
+SELECT 'messages', 'global', 0, COALESCE(SUM(n), 0), NOW()
+FROM channel_counts
+ON CONFLICT DO NOTHING;
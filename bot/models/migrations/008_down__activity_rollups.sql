@@ -0,0 +1,2 @@
+DROP TABLE IF EXISTS message_rollups;
+DROP TABLE IF EXISTS command_rollups;
@@ -0,0 +1,43 @@
+-- Messages per hour, `scope` is either 'guild', 'channel' or 'user' (the author)
+CREATE TABLE IF NOT EXISTS message_rollups
+(
+    hour     TIMESTAMP NOT NULL,
+    scope    VARCHAR   NOT NULL CHECK (scope IN ('guild', 'channel', 'user')),
+    scope_id BIGINT    NOT NULL,
+    messages INT       NOT NULL DEFAULT 0,
+    PRIMARY KEY (scope, scope_id, hour)
+);
+
+CREATE TABLE IF NOT EXISTS command_rollups
+(
+    hour    TIMESTAMP NOT NULL,
+    command VARCHAR   NOT NULL,
+    uses    INT       NOT NULL DEFAULT 0,
+    PRIMARY KEY (command, hour)
+);
+
+CREATE INDEX IF NOT EXISTS message_rollups_hour_idx ON message_rollups (hour);
+CREATE INDEX IF NOT EXISTS command_rollups_hour_idx ON command_rollups (hour);
+
+-- Seed with the history that is already stored
+CREATE TEMPORARY TABLE hourly ON COMMIT DROP AS
+SELECT DATE_TRUNC('hour', snowflake_time(message_id)) AS hour, channel_id, author_id, COUNT(*) AS n
+FROM messages
+GROUP BY 1, 2, 3;
+
+INSERT INTO message_rollups ( hour, scope, scope_id, messages )
+SELECT hour, 'channel', channel_id, SUM(n)
+FROM hourly
+WHERE channel_id IS NOT NULL
+GROUP BY hour, channel_id
+UNION ALL
+SELECT hour, 'user', author_id, SUM(n)
+FROM hourly
+WHERE author_id IS NOT NULL
+GROUP BY hour, author_id
+UNION ALL
+SELECT h.hour, 'guild', c.guild_id, SUM(h.n)
+FROM hourly h
+JOIN channels c USING (channel_id)
+GROUP BY h.hour, c.guild_id
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,4 @@
+DROP INDEX IF EXISTS users_reps_idx;
+ALTER TABLE users DROP COLUMN IF EXISTS reps;
+DROP INDEX IF EXISTS reps_user_id_idx;
+DROP INDEX IF EXISTS reps_author_id_repped_at_idx;
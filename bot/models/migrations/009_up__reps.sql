@@ -0,0 +1,22 @@
+-- Serves the 24h cooldown check (latest rep of an author) and the per-user breakdown of `reps`.
+-- The index steps drop the invalid index an interrupted build leaves behind first
+-- step: reps_author_id_repped_at concurrently
+DROP INDEX CONCURRENTLY IF EXISTS reps_author_id_repped_at_idx;
+CREATE INDEX CONCURRENTLY reps_author_id_repped_at_idx ON reps (author_id, repped_at DESC);
+
+-- step: reps_user_id concurrently
+DROP INDEX CONCURRENTLY IF EXISTS reps_user_id_idx;
+CREATE INDEX CONCURRENTLY reps_user_id_idx ON reps (user_id);
+
+-- Received reps, incremented together with every insert into reps
+-- step: users_reps
+ALTER TABLE users ADD COLUMN IF NOT EXISTS reps INT NOT NULL DEFAULT 0;
+
+UPDATE users u
+SET reps = r.n
+FROM (SELECT user_id, COUNT(*) AS n FROM reps GROUP BY user_id) AS r
+WHERE u.id = r.user_id;
+
+-- step: users_reps_index concurrently
+DROP INDEX CONCURRENTLY IF EXISTS users_reps_idx;
+CREATE INDEX CONCURRENTLY users_reps_idx ON users (reps DESC NULLS LAST);
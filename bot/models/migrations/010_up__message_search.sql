@@ -0,0 +1,30 @@
+-- Maintained at ingestion, from the plain content even for compact rows.
+-- Rows stored before this migration are indexed by `cli.py index-search`
+-- step: column
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS search TSVECTOR;
+
+-- The index is created on the parent only, where it stays invalid until the index of every partition is attached.
+-- Partitions created afterwards get theirs right away
+-- step: index
+CREATE INDEX IF NOT EXISTS messages_search_idx ON ONLY messages USING GIN (search);
+
+-- Builds the partitions' indexes without blocking writes, one partition at a time. Partitions with an attached
+-- index are done, a leftover of an interrupted build is dropped and built again
+-- step: partition_indexes concurrently generate
+SELECT s.statement
+FROM pg_partition_tree('messages') p
+JOIN pg_class c ON c.oid = p.relid
+CROSS JOIN LATERAL (
+    VALUES (1, FORMAT('DROP INDEX CONCURRENTLY IF EXISTS %I', c.relname || '_search_idx')),
+           (2, FORMAT('CREATE INDEX CONCURRENTLY %I ON %I USING GIN (search)', c.relname || '_search_idx', c.relname)),
+           (3, FORMAT('ALTER INDEX messages_search_idx ATTACH PARTITION %I', c.relname || '_search_idx'))
+) AS s ( position, statement )
+WHERE p.isleaf
+  AND NOT EXISTS (
+    SELECT 1
+    FROM pg_inherits i
+    JOIN pg_index x ON x.indexrelid = i.inhrelid
+    WHERE i.inhparent = 'messages_search_idx'::REGCLASS
+      AND x.indrelid = p.relid
+)
+ORDER BY c.relname, s.position;
@@ -0,0 +1 @@
+DROP TABLE IF EXISTS message_revisions;
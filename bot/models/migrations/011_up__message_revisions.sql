@@ -0,0 +1,10 @@
+-- Edits and deletions of logged messages. `messages` keeps the latest content, `delta` turns the content
+-- after an edit back into the content before it, so every revision can be rebuilt walking back from the latest
+CREATE TABLE IF NOT EXISTS message_revisions
+(
+    message_id BIGINT    NOT NULL,
+    revised_at TIMESTAMP NOT NULL,
+    kind       VARCHAR   NOT NULL CHECK (kind IN ('edit', 'delete')),
+    delta      BYTEA,
+    PRIMARY KEY (message_id, revised_at, kind)
+);
@@ -0,0 +1,2 @@
+-- The extension is left installed, other databases on the server may use it
+DROP INDEX IF EXISTS tags_name_trgm_idx;
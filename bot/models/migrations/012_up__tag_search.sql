@@ -0,0 +1,22 @@
+-- Fuzzy search of tag names. Without the extension (it needs to be installed on the server) `Tag.search`
+-- uses an index in memory instead, so this doesn't fail when it's missing
+-- step: extension
+DO
+$$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+EXCEPTION
+    WHEN insufficient_privilege OR undefined_file THEN
+        RAISE NOTICE 'pg_trgm is not available, tags will be searched in memory';
+END
+$$;
+
+-- step: index
+DO
+$$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE INDEX IF NOT EXISTS tags_name_trgm_idx ON tags USING GIN (name gin_trgm_ops);
+    END IF;
+END
+$$;
@@ -0,0 +1,20 @@
+-- Tag requests that wait for a staff reaction in the log channel, keyed by their log message.
+-- Resolving one only succeeds while it's pending, so concurrent reactions can't apply it twice
+CREATE TABLE IF NOT EXISTS tag_requests
+(
+    message_id   BIGINT PRIMARY KEY,
+    guild_id     BIGINT    NOT NULL,
+    kind         VARCHAR   NOT NULL CHECK (kind IN ('create', 'update', 'rename')),
+    name         VARCHAR   NOT NULL,
+    before       TEXT      NOT NULL DEFAULT '',
+    after        TEXT      NOT NULL DEFAULT '',
+    author_id    BIGINT    NOT NULL,
+    requested_by BIGINT    NOT NULL,
+    requested_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'utc'),
+    status       VARCHAR   NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'approved', 'denied')),
+    resolved_by  BIGINT,
+    resolved_at  TIMESTAMP
+);
+
+-- Loading the pending requests on startup
+CREATE INDEX IF NOT EXISTS tag_requests_pending_idx ON tag_requests (message_id) WHERE status = 'pending';
@@ -0,0 +1,10 @@
+-- Ids of the spooled batches of counter deltas that were replayed, recorded in the transaction of their deltas.
+-- A batch replayed again after a crash is skipped instead of counted twice
+CREATE TABLE IF NOT EXISTS spool_batches
+(
+    batch_id    UUID PRIMARY KEY,
+    replayed_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'utc')
+);
+
+-- Pruning by `settings.retention.spool_batches`
+CREATE INDEX IF NOT EXISTS spool_batches_replayed_at_idx ON spool_batches (replayed_at);
@@ -1,10 +1,77 @@
+import re
 from datetime import datetime
-from typing import Literal, Optional
+from typing import Dict, List, Literal, NamedTuple, Optional
 
+from asyncpg import Connection
 from pydantic import Field
 
 from bot.models import Model
 
+STEP = re.compile(r"^--\s*step:\s*(?P<name>\S+)(?P<options>.*)$", re.MULTILINE)
+STATEMENT_END = re.compile(r";[ \t]*$", re.MULTILINE)
+
+
+def is_comment(sql: str) -> bool:
+    """Whether `sql` holds nothing but comments and whitespace."""
+    return all(not line.strip() or line.strip().startswith("--") for line in sql.splitlines())
+
+
+class Step(NamedTuple):
+    """A part of a migration that is run and recorded on its own.
+
+    - "transaction" steps run in a transaction with a lock timeout, and are retried when a lock isn't granted.
+    - "concurrently" steps run outside a transaction, for `CREATE INDEX CONCURRENTLY` and the like. Their statements,
+      ending with a `;` at the end of a line, are run one by one. An interrupted `CREATE INDEX CONCURRENTLY` leaves
+      an invalid index behind, so the step should drop it first.
+      With `generate`, the step is a query returning the statements to run instead, which are run one by one,
+      like the per partition index builds of partitioned tables. Rerunning it should only return what is left.
+    - "batched" steps are run over and over, each time in their own transaction. The statement gets the key
+      it stopped at (0 at first) as $1 and the batch size as $2, and returns the key of the last row it
+      handled, or NULL once there is nothing left. The key is recorded, so an interrupted step resumes."""
+
+    name: str
+    sql: str
+    mode: Literal["transaction", "concurrently", "batched"] = "transaction"
+    batch_size: int = 1000
+    generate: bool = False
+
+    @property
+    def statements(self) -> List[str]:
+        return [statement.strip() for statement in STATEMENT_END.split(self.sql) if not is_comment(statement)]
+
+    @classmethod
+    def parse(cls, sql: str) -> List["Step"]:
+        """Split a migration on its `-- step: <name> [concurrently [generate]|batched [batch_size=<n>]]` lines.
+        Returns an empty list for migrations without them, those are run as a whole."""
+        matches = list(STEP.finditer(sql))
+        if not matches:
+            return []
+
+        steps = []
+        prelude = sql[: matches[0].start()]
+        if not is_comment(prelude):
+            steps.append(cls("prelude", prelude))
+
+        for match, next_ in zip(matches, matches[1:] + [None]):
+            body = sql[match.end() : next_.start() if next_ else len(sql)]
+            mode = "transaction"
+            batch_size = 1000
+            generate = False
+            for option in match.group("options").split():
+                if option in ("concurrently", "batched"):
+                    mode = option
+                elif option.startswith("batch_size="):
+                    batch_size = int(option.partition("=")[2])
+                elif option == "generate":
+                    generate = True
+                else:
+                    raise ValueError(f"Unknown option {option!r} of step {match.group('name')!r}")
+            if generate and mode != "concurrently":
+                raise ValueError(f"Step {match.group('name')!r} can only generate statements when run concurrently")
+            steps.append(cls(match.group("name"), body, mode, batch_size, generate))
+
+        return steps
+
 
 class Migration(Model):
     id: int = 0  # serial
@@ -12,6 +79,11 @@ class Migration(Model):
     direction: Literal["up", "down"]
     name: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
+    step: Optional[str] = None  # Set on the rows of the single steps, see `Step`
+    started_at: Optional[datetime] = None
+    duration: Optional[float] = None  # Seconds
+    progress: Optional[int] = None  # Key a batched step stopped at
+    done: bool = True
 
     @property
     def filename(self):
@@ -23,12 +95,53 @@ class Migration(Model):
 
     @classmethod
     async def fetch_latest(cls) -> Optional["Migration"]:
-        query = """SELECT * FROM migrations ORDER BY timestamp DESC LIMIT 1"""
+        query = """SELECT * FROM migrations WHERE step IS NULL ORDER BY timestamp DESC LIMIT 1"""
         return await cls.fetchrow(query)
 
+    async def fetch_steps(self) -> Dict[str, "Migration"]:
+        """The steps of this migration that were recorded since the last completed migration,
+        which are the ones of an earlier, interrupted attempt to run it."""
+        query = """SELECT DISTINCT ON (step) * FROM migrations
+                   WHERE version = $1 AND direction = $2 AND step IS NOT NULL
+                     AND timestamp > COALESCE((SELECT MAX(timestamp) FROM migrations WHERE step IS NULL), '-infinity')
+                   ORDER BY step, id DESC"""
+        return {step.step: step for step in await self.fetch(query, self.version, self.direction)}
+
+    def start_step(self, step: str) -> "Migration":
+        return Migration(
+            version=self.version,
+            direction=self.direction,
+            name=self.name,
+            step=step,
+            started_at=datetime.utcnow(),
+            done=False,
+        )
+
     async def post(self):
         query = """
-        INSERT INTO migrations (version, direction, name, timestamp)
-            VALUES ($1, $2, $3, $4)
+        INSERT INTO migrations (version, direction, name, timestamp, step, started_at, duration, progress, done)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+            RETURNING id
         """
-        await self.execute(query, self.version, self.direction, self.name, self.timestamp)
+        self.id = await self.fetchval(
+            query,
+            self.version,
+            self.direction,
+            self.name,
+            self.timestamp,
+            self.step,
+            self.started_at,
+            self.duration,
+            self.progress,
+            self.done,
+        )
+
+    async def save_progress(self, progress: int, duration: float, con: Connection = None) -> None:
+        self.progress, self.duration = progress, duration
+        query = """UPDATE migrations SET progress = $2, duration = $3 WHERE id = $1"""
+        await self.execute(query, self.id, progress, duration, con=con)
+
+    async def finish(self, duration: float) -> None:
+        self.duration, self.done, self.timestamp = duration, True, datetime.utcnow()
+        query = """UPDATE migrations SET duration = $2, done = TRUE, timestamp = $3 WHERE id = $1"""
+        await self.execute(query, self.id, duration, self.timestamp)
@@ -5,12 +5,31 @@ from typing import ClassVar, List, Type, TypeVar, Union
 from asyncpg import Connection, Pool, Record, connect, create_pool
 from pydantic import BaseModel
 
+from bot.config import settings
+from bot.services import Spool
+
 BM = TypeVar("BM", bound="Model")
+# The (table, column) pairs `Model.delete_before` accepts, as they become part of its query
+PRUNABLE = frozenset(
+    {
+        ("message_revisions", "message_id"),
+        ("reps", "repped_at"),
+        ("polls", "message_id"),
+        ("spool_batches", "replayed_at"),
+    }
+)
 log = logging.getLogger(__name__)
 
 
 class Model(BaseModel):
     pool: ClassVar[Pool]
+    spool: ClassVar[Spool] = Spool(
+        settings.spool.path,
+        segment_size=settings.spool.segment_size,
+        fsync_interval=settings.spool.fsync_interval,
+        replay_interval=settings.spool.replay_interval,
+        use_mmap=settings.spool.use_mmap,
+    )
 
     @classmethod
     async def create_pool(
@@ -62,3 +81,36 @@ class Model(BaseModel):
         if con is None:
             con = cls.pool
         return await con.execute(query, *args)
+
+    @classmethod
+    async def delete_before(cls, table: str, column: str, before, *, batch_size: int = 1000, pause: float = 0.5) -> int:
+        """Delete the rows of `table` with `column` below `before`, `batch_size` rows per transaction.
+        The batches walk `column` in order, so it should be indexed, and sleep `pause` seconds in between
+        to keep the locks short and spread out the WAL. Returns the amount of rows deleted.
+        Only the tables and columns in `PRUNABLE` are accepted."""
+        if (table, column) not in PRUNABLE:
+            raise ValueError(f"Deleting from {table}.{column} is not allowed, add it to PRUNABLE first")
+
+        query = f"""WITH deleted AS (
+                        DELETE FROM {table}
+                        WHERE ctid = ANY(ARRAY(
+                            SELECT ctid FROM {table}
+                            WHERE {column} >= $1 AND {column} < $2
+                            ORDER BY {column}
+                            LIMIT $3
+                        ))
+                        RETURNING {column}
+                    )
+                    SELECT COUNT(*), MAX({column}) FROM deleted"""
+        last = await cls.fetchval(f"""SELECT MIN({column}) FROM {table}""")
+        total = batches = 0
+        while last is not None:
+            deleted, last = await cls.fetchrow(query, last, before, batch_size)
+            total += deleted
+            batches += 1
+            if batches % 100 == 0:
+                log.info(f"{table}: deleted {total} rows so far")
+            if last is not None:
+                await asyncio.sleep(pause)
+
+        return total
@@ -1,8 +1,16 @@
+import logging
 from datetime import datetime, timedelta
+from typing import ClassVar, Dict, List, Optional
 
+from asyncpg import Record
 from pydantic import Field
 
 from .model import Model
+from .user import User
+
+log = logging.getLogger(__name__)
+
+COOLDOWN = timedelta(days=1)
 
 
 class Rep(Model):
@@ -12,6 +20,37 @@ class Rep(Model):
     repped_at: datetime = Field(default_factory=datetime.utcnow)
     extra_info: str = ""
 
+    cooldowns: ClassVar[Dict[int, datetime]] = {}  # author_id: latest rep, for the authors that repped in the last 24h
+    cooldowns_complete: ClassVar[bool] = False
+
+    @classmethod
+    async def load_cooldowns(cls) -> None:
+        """Remember the latest rep of every author that is still on cooldown,
+        after which authors that aren't in `Rep.cooldowns` can rep without checking the database."""
+        query = """SELECT author_id, MAX(repped_at) AS repped_at FROM reps
+                   WHERE repped_at > $1
+                   GROUP BY author_id"""
+        records = await cls.fetch(query, datetime.utcnow() - COOLDOWN, convert=False)
+        cls.cooldowns = {record["author_id"]: record["repped_at"] for record in records}
+        cls.cooldowns_complete = True
+        log.info(f"Loaded the rep cooldowns of {len(cls.cooldowns)} users")
+
+    @classmethod
+    async def last_rep(cls, author_id: int) -> Optional[datetime]:
+        """When `author_id` last repped someone, None if that is more than 24 hours ago."""
+        repped_at = cls.cooldowns.get(author_id)
+        if repped_at is None and not cls.cooldowns_complete:
+            query = """SELECT repped_at FROM reps
+                       WHERE author_id = $1
+                       ORDER BY repped_at DESC
+                       LIMIT 1"""
+            repped_at = await cls.fetchval(query, author_id)
+
+        if repped_at is not None and repped_at + COOLDOWN <= datetime.utcnow():
+            cls.cooldowns.pop(author_id, None)
+            return None
+        return repped_at
+
     async def post(self, assure_24h: bool = True):
         """We shouldn't have to check for duplicate reps either. ->
         Unless someone mis-uses this.
@@ -25,25 +64,50 @@ class Rep(Model):
             If post is on cooldown, returns a datetime object on when the last rep was added.
         """
         if assure_24h:
-            query = """SELECT * FROM reps
-                       WHERE author_id = $1
-                       ORDER BY repped_at DESC
-                       LIMIT 1"""
+            repped_at = await self.last_rep(self.author_id)
+            if repped_at is not None:
+                return repped_at
 
-            rep = await self.fetchrow(query, self.author_id)
-            if rep:
-                if (rep.repped_at + timedelta(days=1)) > datetime.utcnow():
-                    return rep.repped_at
-
-        query = """INSERT INTO reps ( rep_id, user_id, author_id, repped_at, extra_info )
-                   VALUES (  $1, $2, $3, $4, $5 )
-                   ON CONFLICT DO NOTHING"""
-        await self.execute(
-            query,
-            self.rep_id,
-            self.user_id,
-            self.author_id,
-            self.repped_at,
-            f"{self.extra_info}",
-        )
+        previous = self.cooldowns.get(self.author_id)
+        self.cooldowns[self.author_id] = self.repped_at  # Before awaiting, so a second rep can't slip through
+        try:
+            await User.ensure(self.user_id)
+            query = """WITH inserted AS (
+                           INSERT INTO reps ( rep_id, user_id, author_id, repped_at, extra_info )
+                           VALUES (  $1, $2, $3, $4, $5 )
+                           ON CONFLICT DO NOTHING
+                           RETURNING user_id
+                       )
+                       UPDATE users SET reps = reps + 1 FROM inserted WHERE users.id = inserted.user_id"""
+            await self.execute(
+                query,
+                self.rep_id,
+                self.user_id,
+                self.author_id,
+                self.repped_at,
+                f"{self.extra_info}",
+            )
+        except Exception:
+            if previous is None:
+                self.cooldowns.pop(self.author_id, None)
+            else:
+                self.cooldowns[self.author_id] = previous
+            raise
+
+        User.leaderboards["reps"].bump(self.user_id)
         return None
+
+    @classmethod
+    async def last_received(cls, user_id: int) -> Optional[datetime]:
+        """When `user_id` was last repped, by anyone."""
+        return await cls.fetchval("""SELECT MAX(repped_at) FROM reps WHERE user_id = $1""", user_id)
+
+    @classmethod
+    async def fetch_received(cls, user_id: int, limit: int = 10) -> List[Record]:
+        """The users that repped `user_id` the most, with how often and when they last did."""
+        query = """SELECT author_id, COUNT(*) AS reps, MAX(repped_at) AS last_repped_at FROM reps
+                   WHERE user_id = $1
+                   GROUP BY author_id
+                   ORDER BY reps DESC
+                   LIMIT $2"""
+        return await cls.fetch(query, user_id, limit, convert=False)
@@ -0,0 +1,139 @@
+import asyncio
+from datetime import datetime
+from typing import ClassVar, Dict, List, Literal, Optional, Tuple
+
+from asyncpg import Connection
+
+from bot.config import settings
+from bot.services import RecordBuffer, diff, patch
+
+from .message import Message
+from .model import Model
+
+
+class MessageRevision(Model):
+    message_id: int
+    revised_at: datetime
+    kind: Literal["edit", "delete"]
+    delta: Optional[bytes]
+
+    columns: ClassVar[tuple] = ("message_id", "revised_at", "kind", "delta")
+    buffer: ClassVar[RecordBuffer]
+
+    @classmethod
+    def on_edit(cls, message_id: int, content: str, edited_at: datetime) -> None:
+        cls.buffer.add((message_id, edited_at.replace(tzinfo=None), "edit", content))
+
+    @classmethod
+    def on_delete(cls, message_id: int, deleted_at: datetime) -> None:
+        cls.buffer.add((message_id, deleted_at.replace(tzinfo=None), "delete", None))
+
+    @staticmethod
+    def _deltas(events: List[tuple], contents: Dict[int, str]) -> Tuple[List[tuple], Dict[int, str]]:
+        """Turn (message_id, revised_at, kind, new content) events into revision rows.
+        `contents` holds the stored content of every message, edits of messages that weren't logged are skipped.
+        Returns the rows and the new content of the edited messages."""
+        rows = []
+        edited = {}
+        for message_id, revised_at, kind, content in sorted(events, key=lambda event: event[:2]):
+            current = contents.get(message_id)
+            if current is None:
+                continue
+
+            if kind == "delete":
+                rows.append((message_id, revised_at, kind, None))
+            elif content != current:
+                rows.append((message_id, revised_at, kind, Message.codec.encode(diff(content, current))))
+                contents[message_id] = edited[message_id] = content
+
+        return rows, edited
+
+    @classmethod
+    async def bulk_post(cls, events: List[tuple], con: Connection = None) -> None:
+        """Store buffered edits and deletions as revisions, and update the content of edited messages.
+        The deltas are computed in an executor, as diffing a batch of long messages takes a while.
+        `Message.buffer` is flushed by the buffer beforehand, messages can be edited before they were written."""
+        if con is None:
+            async with cls.pool.acquire() as con:
+                return await cls.bulk_post(events, con=con)
+
+        query = """SELECT message_id, content, body FROM messages WHERE message_id = ANY($1::bigint[])"""
+        records = await cls.fetch(query, list({event[0] for event in events}), con=con, convert=False)
+        contents = {
+            record["message_id"]: record["content"] if record["body"] is None else Message.codec.decode(record["body"])
+            for record in records
+        }
+        compact = {record["message_id"] for record in records if record["body"] is not None}
+
+        rows, edited = await asyncio.get_running_loop().run_in_executor(None, cls._deltas, events, contents)
+        if not rows:
+            return
+
+        async with con.transaction():
+            await con.execute(
+                """CREATE TEMPORARY TABLE IF NOT EXISTS message_revisions_staging
+                   (
+                       message_id BIGINT,
+                       revised_at TIMESTAMP,
+                       kind       VARCHAR,
+                       delta      BYTEA
+                   ) ON COMMIT DELETE ROWS"""
+            )
+            await con.copy_records_to_table("message_revisions_staging", records=rows, columns=cls.columns)
+            await con.execute(
+                """INSERT INTO message_revisions ( message_id, revised_at, kind, delta )
+                   SELECT * FROM message_revisions_staging
+                   ON CONFLICT DO NOTHING"""
+            )
+            if edited:
+                await con.execute(
+                    """UPDATE messages m
+                       SET content = CASE WHEN m.body IS NULL THEN d.content END,
+                           body    = CASE WHEN m.body IS NOT NULL THEN d.body END,
+                           search  = TO_TSVECTOR('english', d.content)
+                       FROM unnest($1::bigint[], $2::varchar[], $3::bytea[]) AS d ( message_id, content, body )
+                       WHERE m.message_id = d.message_id""",
+                    list(edited),
+                    list(edited.values()),
+                    [
+                        Message.codec.encode(content) if message_id in compact else None
+                        for message_id, content in edited.items()
+                    ],
+                )
+
+    @classmethod
+    async def fetch_history(cls, message_id: int) -> List[Tuple[Optional[datetime], str, str]]:
+        """Every revision of a message as (revised_at, kind, content), oldest first.
+        The first one is the message as it was sent, with `revised_at` None."""
+        record = await Message.fetchrow(
+            """SELECT content, body, created_at FROM messages_expanded WHERE message_id = $1""",
+            message_id,
+            convert=False,
+        )
+        if record is None:
+            return []
+
+        content = record["content"] if record["body"] is None else Message.codec.decode(record["body"])
+        query = """SELECT revised_at, kind, delta FROM message_revisions
+                   WHERE message_id = $1
+                   ORDER BY revised_at DESC"""
+        revisions = await cls.fetch(query, message_id, convert=False)
+
+        history = []
+        for revision in revisions:
+            history.append((revision["revised_at"], revision["kind"], content))
+            if revision["kind"] == "edit":
+                content = patch(content, Message.codec.decode(revision["delta"]))
+        history.append((None, "sent", content))
+        return history[::-1]
+
+
+MessageRevision.buffer = RecordBuffer(
+    "message_revisions",
+    MessageRevision.bulk_post,
+    max_size=settings.ingestion.batch_size,
+    max_age=settings.ingestion.max_age,
+    max_pending=settings.ingestion.max_pending,
+    spool=MessageRevision.spool,
+    depends_on=Message.buffer,
+)
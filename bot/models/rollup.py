@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+from typing import ClassVar, Dict, List, Literal, Tuple
+
+from asyncpg import Connection, Record
+
+from bot.config import settings
+from bot.services import DeltaAggregator
+
+from .model import Model
+
+
+class MessageRollup(Model):
+    """Messages per hour, maintained by `Message.bulk_post`"""
+
+    hour: datetime
+    scope: Literal["guild", "channel", "user"]
+    scope_id: int
+    messages: int
+
+    @classmethod
+    async def fetch_guild(cls, guild_id: int, days: int) -> List[Record]:
+        query = """SELECT hour, messages FROM message_rollups
+                   WHERE scope = 'guild' AND scope_id = $1 AND hour >= $2"""
+        return await cls.fetch(query, guild_id, datetime.utcnow() - timedelta(days=days), convert=False)
+
+    @classmethod
+    async def fetch_user(cls, user_id: int, days: int) -> List[Record]:
+        query = """SELECT hour, messages FROM message_rollups
+                   WHERE scope = 'user' AND scope_id = $1 AND hour >= $2"""
+        return await cls.fetch(query, user_id, datetime.utcnow() - timedelta(days=days), convert=False)
+
+    @classmethod
+    async def fetch_channels(cls, guild_id: int, days: int) -> List[Record]:
+        query = """SELECT r.hour, r.scope_id AS channel_id, r.messages
+                   FROM message_rollups r
+                   JOIN channels c ON c.channel_id = r.scope_id
+                   WHERE r.scope = 'channel' AND c.guild_id = $1 AND r.hour >= $2"""
+        return await cls.fetch(query, guild_id, datetime.utcnow() - timedelta(days=days), convert=False)
+
+
+class CommandRollup(Model):
+    """Command uses per hour, buffered in `CommandRollup.counters`"""
+
+    hour: datetime
+    command: str
+    uses: int
+
+    counters: ClassVar[DeltaAggregator]
+
+    @classmethod
+    async def bulk_increment(cls, deltas: Dict[Tuple[datetime, str], List[int]], con: Connection = None) -> None:
+        """Apply `{(hour, command): [uses]}` increments."""
+        query = """INSERT INTO command_rollups ( hour, command, uses )
+                   SELECT * FROM unnest($1::timestamp[], $2::varchar[], $3::int[])
+                   ORDER BY 2, 1
+                   ON CONFLICT ( command, hour ) DO UPDATE
+                   SET uses = command_rollups.uses + EXCLUDED.uses"""
+        await cls.execute(
+            query,
+            [hour for hour, _ in deltas],
+            [command for _, command in deltas],
+            [uses for uses, in deltas.values()],
+            con=con,
+        )
+
+    @classmethod
+    async def fetch_since(cls, days: int) -> List[Record]:
+        query = """SELECT hour, command, uses FROM command_rollups WHERE hour >= $1"""
+        return await cls.fetch(query, datetime.utcnow() - timedelta(days=days), convert=False)
+
+    @classmethod
+    def on_command(cls, command: str) -> None:
+        hour = datetime.utcnow().replace(minute=0, second=0, microsecond=0)
+        cls.counters.add((hour, command), uses=1)
+
+
+CommandRollup.counters = DeltaAggregator(
+    "commands",
+    CommandRollup.bulk_increment,
+    fields=("uses",),
+    interval=settings.ingestion.counters_interval,
+    spool=CommandRollup.spool,
+    acquire=lambda: CommandRollup.pool.acquire(),
+)
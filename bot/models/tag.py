@@ -1,10 +1,17 @@
+import logging
 from datetime import datetime
-from typing import Optional
+from typing import ClassVar, Dict, List, Optional, Tuple
 
+from asyncpg import Connection
 from pydantic import Field
 
+from bot.config import settings
+from bot.services import MISSING, DeltaAggregator, LRUCache, NameIndex
+
 from .model import Model
 
+log = logging.getLogger(__name__)
+
 
 class Tag(Model):
     guild_id: int
@@ -14,33 +21,163 @@ class Tag(Model):
     uses: int = 0
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
+    cache: ClassVar[Dict[int, LRUCache]] = {}  # Per guild, name: tag or None for names that don't exist
+    counters: ClassVar[DeltaAggregator]
+    trigram: ClassVar[bool] = False  # Whether pg_trgm is installed, see migration 012
+    names: ClassVar[Dict[int, NameIndex]] = {}  # Per guild, for autocompletion and searches without pg_trgm
+
+    @classmethod
+    def guild_cache(cls, guild_id: int) -> LRUCache:
+        cache = cls.cache.get(guild_id)
+        if cache is None:
+            cache = cls.cache[guild_id] = LRUCache(max_size=settings.tags.cache_size, ttl=settings.tags.cache_ttl)
+        return cache
+
+    @classmethod
+    def invalidate(cls, guild_id: int, *names: str) -> None:
+        cache = cls.cache.get(guild_id)
+        if cache is not None:
+            for name in names:
+                cache.invalidate(name)
+
+    @classmethod
+    def cache_stats(cls) -> Dict[str, int]:
+        """The stats of the guilds' caches added up."""
+        stats = {"guilds": len(cls.cache), "size": 0, "hits": 0, "misses": 0, "evictions": 0}
+        for cache in cls.cache.values():
+            for key, value in cache.stats().items():
+                stats[key] += value
+        return stats
+
     @classmethod
-    async def fetch_tag(cls, guild_id: int, name: str) -> Optional["Tag"]:
+    async def fetch_tag(cls, guild_id: int, name: str, cached: bool = True) -> Optional["Tag"]:
+        """Tags are served from the guild's cache, pass `cached=False` for the latest `uses`."""
+        cache = cls.guild_cache(guild_id)
+        if cached:
+            tag = cache.get(name)
+            if tag is not MISSING:
+                return tag
+
         query = """SELECT * FROM tags WHERE guild_id = $1 AND name = $2"""
-        return await cls.fetchrow(query, guild_id, name)
+        tag = await cls.fetchrow(query, guild_id, name)
+        cache.set(name, tag)
+        return tag
+
+    @classmethod
+    async def load_names(cls) -> None:
+        """Load the tags' names into `Tag.names`, and check whether pg_trgm is installed for searches."""
+        query = """SELECT EXISTS(SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')"""
+        cls.trigram = await cls.fetchval(query)
+        cls.names.clear()
+        for record in await cls.fetch("""SELECT guild_id, name FROM tags""", convert=False):
+            cls.guild_names(record["guild_id"]).add(record["name"])
+        log.info(
+            f"Loaded {sum(map(len, cls.names.values()))} tag names"
+            + ("" if cls.trigram else ", pg_trgm is missing so they are searched in memory")
+        )
+
+    @classmethod
+    def guild_names(cls, guild_id: int) -> NameIndex:
+        names = cls.names.get(guild_id)
+        if names is None:
+            names = cls.names[guild_id] = NameIndex()
+        return names
+
+    @classmethod
+    async def search(cls, guild_id: int, term: str, limit: int = 10) -> List[str]:
+        """Names of the tags matching `term`: the ones starting with it first, then the ones containing it,
+        then the most similar ones, so typos are fine. `term` is taken literally, there are no wildcards."""
+        term = term.lower()
+        if not cls.trigram:
+            return [name for name, _ in cls.guild_names(guild_id).search(term, limit)]
+
+        pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        query = """SELECT name FROM tags
+                   WHERE guild_id = $1 AND (name % $2 OR name LIKE $3)
+                   ORDER BY LEFT(name, LENGTH($2)) = $2 DESC, name LIKE $3 DESC, SIMILARITY(name, $2) DESC, name
+                   LIMIT $4"""
+        return [record["name"] for record in await cls.fetch(query, guild_id, term, pattern, limit, convert=False)]
+
+    @classmethod
+    def complete(cls, guild_id: int, term: str, limit: int = 25) -> List[str]:
+        """Names for autocompletion, answered from memory only."""
+        return cls.guild_names(guild_id).complete(term, limit)
+
+    def merge_pending(self) -> "Tag":
+        """Add the uses that haven't been written to the database yet."""
+        self.uses += self.counters.pending((self.guild_id, self.name))["uses"]
+        return self
+
+    @classmethod
+    async def bulk_increment(cls, deltas: Dict[Tuple[int, str], List[int]], con: Connection = None) -> None:
+        """Apply `{(guild_id, name): [uses]}` increments, tags that were deleted meanwhile are skipped."""
+        query = """UPDATE tags
+                   SET uses = tags.uses + d.uses
+                   FROM unnest($1::bigint[], $2::varchar[], $3::int[]) AS d ( guild_id, name, uses )
+                   WHERE tags.guild_id = d.guild_id AND tags.name = d.name"""
+        await cls.execute(
+            query,
+            [guild_id for guild_id, _ in deltas],
+            [name for _, name in deltas],
+            [uses for uses, in deltas.values()],
+            con=con,
+        )
+
+    @classmethod
+    def on_use(cls, guild_id: int, name: str) -> None:
+        cls.counters.add((guild_id, name), uses=1)
 
     async def post(self):
         query = """INSERT INTO tags ( guild_id, creator_id, text, name, uses, created_at )
                    VALUES ( $1, $2, $3, $4, $5, $6 )"""
-        await self.execute(
-            query,
-            self.guild_id,
-            self.creator_id,
-            self.text,
-            self.name,
-            self.uses,
-            self.created_at,
-        )
+        try:
+            await self.execute(
+                query,
+                self.guild_id,
+                self.creator_id,
+                self.text,
+                self.name,
+                self.uses,
+                self.created_at,
+            )
+        finally:
+            self.invalidate(self.guild_id, self.name)
+        self.guild_names(self.guild_id).add(self.name)
 
     async def update(self, text):
         self.text = text
         query = """UPDATE tags SET text = $2 WHERE guild_id = $1 AND name = $3"""
-        await self.execute(query, self.guild_id, self.text, self.name)
+        try:
+            await self.execute(query, self.guild_id, self.text, self.name)
+        finally:
+            self.invalidate(self.guild_id, self.name)
 
     async def delete(self):
         query = """DELETE FROM tags WHERE guild_id = $1 AND name = $2"""
-        await self.execute(query, self.guild_id, self.name)
+        try:
+            await self.execute(query, self.guild_id, self.name)
+        finally:
+            self.invalidate(self.guild_id, self.name)
+        self.counters.discard((self.guild_id, self.name))  # A tag created with the name later starts from 0
+        self.guild_names(self.guild_id).remove(self.name)
 
     async def rename(self, new_name):
         query = """UPDATE tags SET name = $3 WHERE guild_id = $1 AND name = $2"""
-        await self.execute(query, self.guild_id, self.name, new_name)
+        async with self.counters.hold():  # Pending uses are keyed by the old name, none may be written meanwhile
+            try:
+                await self.execute(query, self.guild_id, self.name, new_name)
+            finally:
+                self.invalidate(self.guild_id, self.name, new_name)
+            self.counters.move((self.guild_id, self.name), (self.guild_id, new_name))
+        self.guild_names(self.guild_id).remove(self.name)
+        self.guild_names(self.guild_id).add(new_name)
+
+
+Tag.counters = DeltaAggregator(
+    "tags",
+    Tag.bulk_increment,
+    fields=("uses",),
+    interval=settings.ingestion.counters_interval,
+    spool=Tag.spool,
+    acquire=lambda: Tag.pool.acquire(),
+)
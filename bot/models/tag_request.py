@@ -0,0 +1,82 @@
+import logging
+from datetime import datetime
+from typing import ClassVar, Dict, Literal, Optional
+
+from pydantic import Field
+
+from .model import Model
+
+log = logging.getLogger(__name__)
+
+
+class TagRequest(Model):
+    """A tag change submitted by a non-staff member, approved or denied by reacting to its log message."""
+
+    message_id: int  # Of the log message
+    guild_id: int
+    kind: Literal["create", "update", "rename"]
+    name: str
+    before: str = ""  # The text before an update, the old name for a rename
+    after: str = ""  # The requested text or name
+    author_id: int  # The tag's creator
+    requested_by: int
+    requested_at: datetime = Field(default_factory=datetime.utcnow)
+    status: Literal["pending", "approved", "denied"] = "pending"
+    resolved_by: Optional[int] = None
+    resolved_at: Optional[datetime] = None
+
+    pending: ClassVar[Dict[int, "TagRequest"]] = {}  # message_id: request
+
+    @classmethod
+    async def load_pending(cls) -> None:
+        query = """SELECT * FROM tag_requests WHERE status = 'pending'"""
+        cls.pending = {request.message_id: request for request in await cls.fetch(query)}
+        log.info(f"Loaded {len(cls.pending)} pending tag requests")
+
+    @classmethod
+    async def resolve(cls, message_id: int, approved: bool, user_id: int) -> Optional["TagRequest"]:
+        """Claim the pending request logged as `message_id`, None if there is none or it was resolved already.
+        Of concurrent reactions, here or in another process, only the first one gets the request."""
+        request = cls.pending.pop(message_id, None)  # Before awaiting, so a second reaction finds nothing
+        if request is None:
+            return None
+
+        query = """UPDATE tag_requests
+                   SET status = $2, resolved_by = $3, resolved_at = $4
+                   WHERE message_id = $1 AND status = 'pending'
+                   RETURNING *"""
+        try:
+            return await cls.fetchrow(
+                query, message_id, "approved" if approved else "denied", user_id, datetime.utcnow()
+            )
+        except Exception:
+            cls.pending[message_id] = request
+            raise
+
+    def log_kwargs(self) -> dict:
+        """The arguments of `TagCommands.log_embeds` for this request."""
+        return dict(
+            rtype=self.kind.capitalize(),
+            tname="" if self.kind == "rename" else self.name,
+            before=self.before,
+            after=self.after,
+            author_id=self.author_id,
+        )
+
+    async def post(self):
+        query = """INSERT INTO tag_requests ( message_id, guild_id, kind, name, before, after, author_id, requested_by,
+                                              requested_at )
+                   VALUES ( $1, $2, $3, $4, $5, $6, $7, $8, $9 )"""
+        await self.execute(
+            query,
+            self.message_id,
+            self.guild_id,
+            self.kind,
+            self.name,
+            self.before,
+            self.after,
+            self.author_id,
+            self.requested_by,
+            self.requested_at,
+        )
+        self.pending[self.message_id] = self
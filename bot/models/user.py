@@ -1,82 +1,208 @@
+import logging
 from datetime import datetime
-from typing import Optional, Union
+from functools import partial
+from typing import ClassVar, Dict, List, Literal, Optional, Tuple, Union
 
 import discord
+from asyncpg import Connection
 from pydantic import Field
 
+from bot.config import settings
+from bot.services import DeltaAggregator, IdSet, Leaderboard
+
 from .model import Model
 
+log = logging.getLogger(__name__)
+
+Ranking = Literal["messages_sent", "commands_used", "reps"]
+
 
 class User(Model):
     id: int
     commands_used: int = 0
     joined_at: datetime = Field(default_factory=datetime.utcnow)
     messages_sent: int = 0
+    reps: int = 0
+
+    counters: ClassVar[DeltaAggregator]
+    leaderboards: ClassVar[Dict[str, Leaderboard]]
+    known: ClassVar[IdSet] = IdSet(max_size=settings.ingestion.known_users_max)
 
     async def post(self) -> None:
-        """We shouldn't have to check for duplicate messages here ->
-        Unless someone mis-uses this.
-        If a conflict somehow still occurs nothing will happen. ( hopefully :shrug: )"""
-        query = """SELECT count(*) FROM users WHERE id = $1"""
-        assure_exclusive = await self.fetchval(query, self.id)
-        if assure_exclusive == 0:
-            query = """INSERT INTO users ( id, commands_used, joined_at, messages_sent )
-                    VALUES ( $1, $2, $3, $4 )
-                    ON CONFLICT DO NOTHING"""
-            await self.execute(query, self.id, self.commands_used, self.joined_at, self.messages_sent)
+        """Conflicts are ignored, so this is safe to call for users that already exist."""
+        query = """INSERT INTO users ( id, commands_used, joined_at, messages_sent )
+                   VALUES ( $1, $2, $3, $4 )
+                   ON CONFLICT DO NOTHING"""
+        await self.execute(query, self.id, self.commands_used, self.joined_at, self.messages_sent)
+        self.known.add(self.id)
+
+    @classmethod
+    async def load_known(cls) -> None:
+        """Load every user id into `User.known`, streaming them so the ids are never all in a list."""
+        cls.known.clear()
+        complete = True
+        async with cls.pool.acquire() as con:
+            async with con.transaction():
+                async for record in con.cursor("""SELECT id FROM users ORDER BY id""", prefetch=10_000):
+                    if not cls.known.append_sorted(record["id"]):
+                        complete = False
+                        break
+        cls.known.complete = complete
+        log.info(f"Loaded {len(cls.known)} known users" + ("" if complete else " (limit reached)"))
+
+    @classmethod
+    async def ensure(cls, user_id: int) -> None:
+        """Make sure a row exists for `user_id`, only reaching the database for ids that aren't known yet."""
+        if user_id not in cls.known:
+            await cls(id=user_id).post()
+
+    def merge_pending(self) -> "User":
+        """Add the counters that haven't been written to the database yet."""
+        pending = self.counters.pending(self.id)
+        self.commands_used += pending["commands_used"]
+        self.messages_sent += pending["messages_sent"]
+        return self
 
     @classmethod
     async def fetch_user(cls, user_id: int, create_if_no_exist=True) -> Optional["User"]:
-        query = """SELECT * FROM users WHERE id = $1"""
-        user = await cls.fetchrow(query, user_id)
+        if cls.known.complete and user_id not in cls.known:
+            user = None  # Every existing user is known, so there is nothing to select
+        else:
+            query = """SELECT * FROM users WHERE id = $1"""
+            user = await cls.fetchrow(query, user_id)
+
         if user is None and create_if_no_exist:
             user = cls(id=user_id)
             await user.post()
-        return user
+        return user and user.merge_pending()
 
     @classmethod
-    async def on_command(cls, user: Union[discord.Member, discord.User]):
-        await cls.fetch_user(user.id)
-        query = """UPDATE users SET commands_used = commands_used + 1 WHERE id = $1"""
-        await cls.execute(query, user.id)
+    async def fetch_top(cls, limit: int = 10, order_by: Ranking = "messages_sent") -> List["User"]:
+        """Fetch the users with the highest `order_by` counter, including the pending counters.
+        Pending counters only go up, so the top is among the indexed top rows and the users with pending counters."""
+        pending = cls.counters.pending_items()
+        query = f"""WITH d ( id, commands_used, messages_sent ) AS (
+                        SELECT * FROM unnest($1::bigint[], $2::int[], $3::int[])
+                    ), candidates AS (
+                        (SELECT id FROM users ORDER BY {order_by} DESC NULLS LAST LIMIT $4)
+                        UNION
+                        SELECT id FROM d
+                    )
+                    SELECT c.id,
+                           COALESCE(u.commands_used, 0) + COALESCE(d.commands_used, 0) AS commands_used,
+                           COALESCE(u.joined_at, NOW() AT TIME ZONE 'utc') AS joined_at,
+                           COALESCE(u.messages_sent, 0) + COALESCE(d.messages_sent, 0) AS messages_sent,
+                           COALESCE(u.reps, 0) AS reps
+                    FROM candidates c
+                    LEFT JOIN users u ON u.id = c.id
+                    LEFT JOIN d ON d.id = c.id
+                    ORDER BY {order_by} DESC
+                    LIMIT $4"""
+        return await cls.fetch(
+            query,
+            [key for key, _ in pending],
+            [deltas[0] for _, deltas in pending],
+            [deltas[1] for _, deltas in pending],
+            limit,
+        )
 
     @classmethod
-    async def on_message(cls, user: Union[discord.Member, discord.User]):
-        await cls.fetch_user(user.id)
-        query = """UPDATE users SET messages_sent = messages_sent + 1 WHERE id = $1"""
-        await cls.execute(query, user.id)
-
-    # async def add_rep(
-    #     self,
-    #     message_id: int,
-    #     author_id: int,
-    #     repped_at: datetime = datetime.utcnow(),
-    #     extra_info: dict = None,
-    #     assure_24h: bool = True,
-    # ):
-    #     """
-    #     Add a rep using `self.id` as user_id
-    #     :param message_id:
-    #         passed to rep_id
-    #     :param author_id:
-    #         The user that repped `self`
-    #     :param repped_at:
-    #         datetime object for when the rep was added
-    #     :param extra_info:
-    #         dict
-    #     :param assure_24h:
-    #                     if True, this will only post the rep if the latest
-    #         rep for this user_id is more than 24 hours ago.
-    #     :return:
-    #         If posting is successful, returns None.
-    #         If post is on cooldown, returns a datetime object on when the last rep was added.
-    #     """
-    #     rep = Rep(
-    #         bot=self.bot,
-    #         rep_id=message_id,
-    #         user_id=self.id,
-    #         author_id=author_id,
-    #         repped_at=repped_at,
-    #         extra_info=extra_info,
-    #     )
-    #     return await rep.post(assure_24h=assure_24h)
+    async def bulk_increment(cls, deltas: Dict[int, List[int]], con: Connection = None) -> None:
+        """Apply `{user_id: [commands_used, messages_sent]}` increments in a single transaction.
+        Known users are updated in place, the others are upserted which creates the missing rows."""
+        if con is None:
+            async with cls.pool.acquire() as con:
+                return await cls.bulk_increment(deltas, con=con)
+
+        known = {user_id: values for user_id, values in deltas.items() if user_id in cls.known}
+        unknown = {user_id: values for user_id, values in deltas.items() if user_id not in known}
+
+        async with con.transaction():
+            if known:
+                query = """UPDATE users
+                           SET commands_used = users.commands_used + d.commands_used,
+                               messages_sent = users.messages_sent + d.messages_sent
+                           FROM unnest($1::bigint[], $2::int[], $3::int[]) AS d ( id, commands_used, messages_sent )
+                           WHERE users.id = d.id"""
+                await cls.execute(query, *cls._unzip(known), con=con)
+
+            if unknown:
+                query = """INSERT INTO users ( id, commands_used, joined_at, messages_sent )
+                           SELECT d.id, d.commands_used, NOW() AT TIME ZONE 'utc', d.messages_sent
+                           FROM unnest($1::bigint[], $2::int[], $3::int[]) AS d ( id, commands_used, messages_sent )
+                           ON CONFLICT ( id ) DO UPDATE
+                           SET commands_used = users.commands_used + EXCLUDED.commands_used,
+                               messages_sent = users.messages_sent + EXCLUDED.messages_sent"""
+                await cls.execute(query, *cls._unzip(unknown), con=con)
+
+        for user_id in unknown:
+            cls.known.add(user_id)
+
+    @classmethod
+    async def recount_messages(cls, user_ids: List[int]) -> None:
+        """Raise `messages_sent` to the amount of stored messages, for after messages were inserted in bulk.
+        It's never lowered, messages past the retention are pruned but stay counted."""
+        query = """INSERT INTO users ( id, commands_used, joined_at, messages_sent )
+                   SELECT author_id, 0, NOW() AT TIME ZONE 'utc', COUNT(*)
+                   FROM messages
+                   WHERE author_id = ANY($1::bigint[])
+                   GROUP BY author_id
+                   ON CONFLICT ( id ) DO UPDATE
+                   SET messages_sent = GREATEST(users.messages_sent, EXCLUDED.messages_sent)"""
+        await cls.execute(query, user_ids)
+        for user_id in user_ids:
+            cls.known.add(user_id)
+
+    @classmethod
+    async def set_messages_sent(cls, counts: Dict[int, int]) -> None:
+        """Overwrite `messages_sent` with `{user_id: messages_sent}` in one upsert, see `cli.py stats rebuild`."""
+        query = """INSERT INTO users ( id, commands_used, joined_at, messages_sent )
+                   SELECT d.id, 0, NOW() AT TIME ZONE 'utc', d.messages_sent
+                   FROM unnest($1::bigint[], $2::int[]) AS d ( id, messages_sent )
+                   ORDER BY d.id
+                   ON CONFLICT ( id ) DO UPDATE
+                   SET messages_sent = EXCLUDED.messages_sent"""
+        await cls.execute(query, list(counts), list(counts.values()))
+        for user_id in counts:
+            cls.known.add(user_id)
+
+    @staticmethod
+    def _unzip(deltas: Dict[int, List[int]]) -> Tuple[List[int], List[int], List[int]]:
+        return (
+            list(deltas.keys()),
+            [commands_used for commands_used, _ in deltas.values()],
+            [messages_sent for _, messages_sent in deltas.values()],
+        )
+
+    @classmethod
+    async def load_leaderboard(cls, limit: int, order_by: Ranking) -> List[tuple]:
+        return [(user.id, getattr(user, order_by)) for user in await cls.fetch_top(limit, order_by=order_by)]
+
+    @classmethod
+    def on_command(cls, user: Union[discord.Member, discord.User]):
+        cls.counters.add(user.id, commands_used=1)
+        cls.leaderboards["commands_used"].bump(user.id)
+
+    @classmethod
+    def on_message(cls, user: Union[discord.Member, discord.User]):
+        cls.counters.add(user.id, messages_sent=1)
+        cls.leaderboards["messages_sent"].bump(user.id)
+
+
+User.counters = DeltaAggregator(
+    "users",
+    User.bulk_increment,
+    fields=("commands_used", "messages_sent"),
+    interval=settings.ingestion.counters_interval,
+    spool=User.spool,
+    acquire=lambda: User.pool.acquire(),
+)
+User.leaderboards = {
+    field: Leaderboard(
+        field,
+        partial(User.load_leaderboard, order_by=field),
+        size=settings.ingestion.leaderboard_size,
+        interval=settings.ingestion.leaderboard_interval,
+    )
+    for field in ("messages_sent", "commands_used", "reps")
+}
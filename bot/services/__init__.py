@@ -0,0 +1,39 @@
+from .aggregator import DeltaAggregator
+from .backfill import Backfill, BackfillJob
+from .buffer import RecordBuffer
+from .cache import MISSING, LRUCache
+from .compression import Codec, train_dictionary
+from .delta import diff, patch
+from .export import WRITERS, copy_to_writer
+from .idset import IdSet
+from .leaderboard import Leaderboard
+from .names import NameIndex, trigrams
+from .presence import PresenceIndex
+from .report import FrameWriter, Report
+from .scheduler import Priority, Scheduler
+from .spool import Spool
+
+__all__ = (  # Fixes F401
+    Backfill,
+    BackfillJob,
+    Codec,
+    DeltaAggregator,
+    FrameWriter,
+    IdSet,
+    Leaderboard,
+    LRUCache,
+    NameIndex,
+    PresenceIndex,
+    Priority,
+    RecordBuffer,
+    Report,
+    Scheduler,
+    Spool,
+    train_dictionary,
+    copy_to_writer,
+    diff,
+    patch,
+    trigrams,
+    MISSING,
+    WRITERS,
+)
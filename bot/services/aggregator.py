@@ -0,0 +1,223 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import (
+    AsyncContextManager,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+from uuid import UUID
+
+from asyncpg import Connection
+
+from .spool import UNAVAILABLE, Spool
+
+log = logging.getLogger(__name__)
+
+Deltas = Dict[Hashable, List[int]]
+FlushCallback = Callable[..., Awaitable[None]]
+
+
+class DeltaAggregator:
+    """Adds up increments per key in memory and hands them to `callback` every `interval` seconds.
+
+    Each key holds one delta per name in `fields`. Deltas that are being written are still
+    reported by `pending`, so reads can merge them until the write has gone through.
+    With `acquire`, the callback gets a connection as `con` in a transaction of its own, and the written
+    deltas stop being pending as soon as it commits, so reads don't count them twice meanwhile.
+    With a `spool`, deltas that can't be written because postgres is unavailable go to disk instead.
+    Replaying them again after a crash would count them twice, so with `acquire` the id of every replayed
+    batch is recorded in `spool_batches`, in the transaction of its deltas, and batches found there are skipped."""
+
+    def __init__(
+        self,
+        name: str,
+        callback: FlushCallback,
+        *,
+        fields: Sequence[str],
+        interval: float = 10.0,
+        spool: Optional[Spool] = None,
+        acquire: Optional[Callable[[], AsyncContextManager[Connection]]] = None,
+    ):
+        self.name = name
+        self.callback = callback
+        self.fields = tuple(fields)
+        self.interval = interval
+        self.spool = spool
+        self.acquire = acquire
+        if spool is not None:
+            spool.register(name, self._replay)
+
+        self.added = 0
+        self.flushed = 0
+        self.spooled = 0
+
+        self._deltas: Deltas = {}
+        self._flushing: Deltas = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._deltas)
+
+    def add(self, key: Hashable, **increments: int) -> None:
+        deltas = self._deltas.get(key)
+        if deltas is None:
+            deltas = self._deltas[key] = [0] * len(self.fields)
+
+        for name, value in increments.items():
+            deltas[self.fields.index(name)] += value
+        self.added += 1
+
+    def pending(self, key: Hashable) -> Dict[str, int]:
+        """The increments for `key` that haven't been written yet."""
+        result = dict.fromkeys(self.fields, 0)
+        for deltas in (self._flushing.get(key), self._deltas.get(key)):
+            if deltas is not None:
+                for name, value in zip(self.fields, deltas):
+                    result[name] += value
+        return result
+
+    def pending_items(self) -> List[Tuple[Hashable, List[int]]]:
+        """All increments that haven't been written yet, merged per key."""
+        merged = {key: list(deltas) for key, deltas in self._flushing.items()}
+        for key, deltas in self._deltas.items():
+            if key in merged:
+                merged[key] = [a + b for a, b in zip(merged[key], deltas)]
+            else:
+                merged[key] = list(deltas)
+        return list(merged.items())
+
+    def move(self, key: Hashable, new_key: Hashable) -> None:
+        """Move the increments of `key` over to `new_key`, for when what the key points to is renamed.
+        Call it while holding `hold`, so no flush is writing the increments under the old key meanwhile."""
+        deltas = self._deltas.pop(key, None)
+        if deltas is not None:
+            self._merge_back({new_key: deltas})
+
+    def discard(self, key: Hashable) -> None:
+        """Forget the increments of `key`, for when what it points to is deleted."""
+        self._deltas.pop(key, None)
+
+    @asynccontextmanager
+    async def hold(self) -> AsyncIterator[None]:
+        """Keep flushes from running, waiting for the one that is running to finish."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            yield
+
+    def _merge_back(self, deltas: Deltas) -> None:
+        for key, values in deltas.items():
+            current = self._deltas.get(key)
+            if current is None:
+                self._deltas[key] = values
+            else:
+                self._deltas[key] = [a + b for a, b in zip(values, current)]
+
+    async def flush(self) -> int:
+        """Write out all pending deltas.
+        Returns the amount of keys written."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            flushing, self._deltas = self._deltas, {}
+            if not flushing:
+                return 0
+
+            if self.spool is not None and not self.spool.healthy and await self._to_spool(flushing):
+                return 0
+
+            self._flushing = flushing
+            try:
+                await self._write(flushing, flushing=True)
+            except asyncio.CancelledError:
+                if self._flushing:  # Not committed, written by the flush of `stop` instead
+                    self._flushing = {}
+                    self._merge_back(flushing)
+                raise
+            except Exception as error:
+                self._flushing = {}
+                if self.spool is not None and isinstance(error, UNAVAILABLE) and await self._to_spool(flushing):
+                    log.warning(f"{self.name}: postgres is unavailable, spooled {len(flushing)} keys: {error!r}")
+                    return 0
+
+                log.error(f"{self.name}: failed to flush {len(flushing)} keys, retrying later", exc_info=error)
+                self._merge_back(flushing)
+                return 0
+
+            self._flushing = {}
+            self.flushed += len(flushing)
+            return len(flushing)
+
+    async def _write(self, deltas: Deltas, flushing: bool = False, batch_id: Optional[UUID] = None) -> None:
+        """Hand `deltas` to the callback. For a flush, they stop being pending once committed,
+        before the connection is released. The deltas of a replayed `batch_id` are only written once."""
+        if self.acquire is None:
+            await self.callback(deltas)
+            return
+
+        async with self.acquire() as con:
+            async with con.transaction():
+                if batch_id is not None and not await con.fetchval(
+                    """INSERT INTO spool_batches ( batch_id ) VALUES ( $1 ) ON CONFLICT DO NOTHING RETURNING TRUE""",
+                    batch_id,
+                ):
+                    log.info(f"{self.name}: batch {batch_id} was replayed already, skipping it")
+                    return
+                await self.callback(deltas, con=con)
+            if flushing:
+                self._flushing = {}
+
+    async def _to_spool(self, deltas: Deltas) -> bool:
+        try:
+            await self.spool.write(self.name, list(deltas.items()))
+        except OSError as error:
+            log.error(f"{self.name}: failed to spool {len(deltas)} keys", exc_info=error)
+            return False
+
+        self.spooled += len(deltas)
+        return True
+
+    async def _replay(self, items: List[Tuple[Hashable, List[int]]], batch_id: Optional[UUID]) -> None:
+        deltas: Deltas = {}
+        for key, values in items:
+            current = deltas.get(key)
+            deltas[key] = values if current is None else [a + b for a, b in zip(current, values)]
+        await self._write(deltas, batch_id=batch_id)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self) -> None:
+        """Start flushing in the background."""
+        if self._task is None:
+            self._lock = self._lock or asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background flusher and write out whatever is left."""
+        if self._task is not None:
+            async with self.hold():  # Lets a flush in progress finish, instead of cancelling it halfway
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending": len(self._deltas), "added": self.added, "flushed": self.flushed, "spooled": self.spooled}
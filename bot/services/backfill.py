@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional
+
+import discord
+
+log = logging.getLogger(__name__)
+
+
+class BackfillJob(NamedTuple):
+    channel_id: int
+    before_id: int  # Exclusive, history is walked backwards from here
+    stop_id: int  # Exclusive, messages at or before this id aren't fetched
+
+
+SaveCallback = Callable[[BackfillJob, List[dict], int, bool], Awaitable[None]]
+
+
+class Backfill:
+    """Fetches the history of many channels through the REST api, `concurrency` channels at a time.
+
+    Pages are collected until `batch_size` messages are fetched, which are then handed to `save` with
+    the id to continue from and whether the channel is done. `save` should store the messages and the
+    checkpoint together, so an interrupted backfill can resume from the last saved batch.
+    Rate limits are handled by discord.py's http client, which waits on the buckets shared by all channels."""
+
+    def __init__(
+        self,
+        http: discord.http.HTTPClient,
+        save: SaveCallback,
+        *,
+        concurrency: int = 4,
+        batch_size: int = 1000,
+        page_size: int = 100,
+        on_channel_done: Optional[Callable[[BackfillJob, int], None]] = None,
+    ):
+        self.http = http
+        self.save = save
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.page_size = page_size
+        self.on_channel_done = on_channel_done
+
+        self.pages = 0
+        self.fetched = 0
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self._started: Optional[float] = None
+
+    async def run(self, jobs: Iterable[BackfillJob]) -> None:
+        self._started = time.monotonic()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_job(job: BackfillJob) -> None:
+            async with semaphore:
+                await self.channel(job)
+
+        await asyncio.gather(*(run_job(job) for job in jobs))
+
+    async def channel(self, job: BackfillJob) -> None:
+        """Walk one channel back to `job.stop_id`, saving a checkpoint with every batch."""
+        before = job.before_id
+        batch: List[dict] = []
+        fetched = 0
+
+        try:
+            while True:
+                page = await self.http.logs_from(job.channel_id, self.page_size, before=before)
+                self.pages += 1
+
+                wanted = [message for message in page if int(message["id"]) > job.stop_id]
+                done = len(page) < self.page_size or len(wanted) < len(page)
+                if wanted:
+                    before = int(wanted[-1]["id"])
+                    batch.extend(wanted)
+
+                if len(batch) >= self.batch_size or done:
+                    await self.save(job, batch, before, done)
+                    fetched += len(batch)
+                    self.fetched += len(batch)
+                    batch = []
+
+                if done:
+                    break
+
+        except (discord.Forbidden, discord.NotFound) as error:
+            log.warning(f"Skipping channel {job.channel_id}: {error}")
+            await self.save(job, [], before, True)
+            self.skipped += 1
+
+        except Exception:
+            log.exception(f"Backfilling channel {job.channel_id} failed, it resumes from {before} on the next run")
+            self.failed += 1
+
+        else:
+            self.done += 1
+
+        if self.on_channel_done is not None:
+            self.on_channel_done(job, fetched)
+
+    def stats(self) -> Dict[str, float]:
+        elapsed = time.monotonic() - self._started if self._started else 0
+        return {
+            "pages": self.pages,
+            "fetched": self.fetched,
+            "done": self.done,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "rate": round(self.fetched / elapsed, 1) if elapsed else 0.0,
+        }
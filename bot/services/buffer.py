@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+from uuid import UUID
+
+from .spool import UNAVAILABLE, Spool
+
+log = logging.getLogger(__name__)
+
+FlushCallback = Callable[[List[tuple]], Awaitable[None]]
+
+
+class RecordBuffer:
+    """Collects rows in memory and hands them to `callback` in batches.
+
+    A flush happens once `max_size` rows are buffered or the oldest row is `max_age` seconds old.
+    If the callback raises, the rows are kept for the next attempt, but never more than
+    `max_pending` of them, anything above that is dropped (oldest first).
+    With a `spool`, rows that can't be written because postgres is unavailable go to disk instead.
+    Rows that refer to the rows of another buffer, `depends_on`, are only written after that buffer
+    was flushed, and follow its rows into the spool, so a replay writes them in the same order.
+    A batch can be replayed twice after a crash, the callback has to skip the rows it has written already."""
+
+    def __init__(
+        self,
+        name: str,
+        callback: FlushCallback,
+        *,
+        max_size: int = 500,
+        max_age: float = 5.0,
+        max_pending: int = 50_000,
+        spool: Optional[Spool] = None,
+        depends_on: Optional["RecordBuffer"] = None,
+    ):
+        self.name = name
+        self.callback = callback
+        self.max_size = max_size
+        self.max_age = max_age
+        self.max_pending = max_pending
+        self.spool = spool
+        self.depends_on = depends_on
+        if spool is not None:
+            spool.register(name, self._replay)
+
+        self.buffered = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.spooled = 0
+
+        self._rows: List[tuple] = []
+        self._oldest: Optional[float] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, row: tuple) -> None:
+        """Buffer a single row, waking up the flusher if the batch is full."""
+        if not self._rows:
+            self._oldest = time.monotonic()
+
+        self._rows.append(row)
+        self.buffered += 1
+        self._trim()
+
+        if len(self._rows) >= self.max_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def _trim(self) -> None:
+        overflow = len(self._rows) - self.max_pending
+        if overflow > 0:
+            del self._rows[:overflow]
+            self.dropped += overflow
+            log.warning(f"{self.name}: dropped {overflow} rows, buffer is over {self.max_pending} rows")
+
+    async def flush(self) -> int:
+        """Write out everything that is currently buffered.
+        Returns the amount of rows written."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            rows, self._rows = self._rows, []
+            oldest, self._oldest = self._oldest, None
+            if not rows:
+                return 0
+
+            if self.depends_on is not None:
+                pending = len(self.depends_on)
+                if await self.depends_on.flush() < pending:
+                    log.warning(f"{self.name}: {self.depends_on.name} couldn't be flushed, retrying later")
+                    self._restore(rows, oldest)
+                    return 0
+
+            if self.spool is not None and not self.spool.healthy and await self._to_spool(rows):
+                return len(rows)
+
+            try:
+                await self.callback(rows)
+            except asyncio.CancelledError:
+                self._restore(rows, oldest)  # Rolled back with the cancelled write, for the flush of `stop`
+                raise
+            except Exception as error:
+                if self.spool is not None and isinstance(error, UNAVAILABLE) and await self._to_spool(rows):
+                    log.warning(f"{self.name}: postgres is unavailable, spooled {len(rows)} rows: {error!r}")
+                    return len(rows)
+
+                log.error(f"{self.name}: failed to flush {len(rows)} rows, retrying later", exc_info=error)
+                self._restore(rows, oldest)
+                return 0
+
+            self.flushed += len(rows)
+            return len(rows)
+
+    def _restore(self, rows: List[tuple], oldest: Optional[float]) -> None:
+        self._rows[:0] = rows
+        self._oldest = oldest
+        self._trim()
+
+    async def _to_spool(self, rows: List[tuple]) -> bool:
+        try:
+            await self.spool.write(self.name, rows)
+        except OSError as error:
+            log.error(f"{self.name}: failed to spool {len(rows)} rows", exc_info=error)
+            return False
+
+        self.spooled += len(rows)
+        return True
+
+    async def _replay(self, rows: List[tuple], batch_id: Optional[UUID]) -> None:
+        await self.callback(rows)
+
+    async def _run(self) -> None:
+        while True:
+            timeout = self.max_age
+            if self._oldest is not None:
+                timeout = max(0.0, self._oldest + self.max_age - time.monotonic())
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+            self._wakeup.clear()
+            if self._rows and not await self.flush():
+                await asyncio.sleep(self.max_age)  # Back off while the callback is failing
+
+    def start(self) -> None:
+        """Start flushing in the background."""
+        if self._task is not None:
+            return
+
+        self._lock = self._lock or asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background flusher and write out whatever is left."""
+        if self._task is not None:
+            async with self._lock:  # Lets a flush in progress finish, instead of cancelling it halfway
+                self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        await self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": len(self._rows),
+            "buffered": self.buffered,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "spooled": self.spooled,
+        }
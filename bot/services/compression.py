@@ -0,0 +1,62 @@
+import re
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, Optional
+
+TOKEN = re.compile(r" ?\S+")
+MAX_DICTIONARY_SIZE = 32 * 1024  # zlib only looks back 32KiB, a larger dictionary is never used
+
+
+def train_dictionary(samples: Iterable[str], size: int = MAX_DICTIONARY_SIZE) -> bytes:
+    """Build a zlib preset dictionary out of the tokens that save the most bytes across `samples`.
+    The most valuable tokens are placed at the end, as zlib finds closer matches with shorter codes."""
+    counts = Counter()
+    for text in samples:
+        counts.update(TOKEN.findall(text))
+
+    tokens = []
+    total = 0
+    scored = ((count * len(token.encode()), token.encode()) for token, count in counts.items() if count > 1)
+    for _, token in sorted(scored, reverse=True):
+        if total + len(token) > size:
+            continue
+        tokens.append(token)
+        total += len(token)
+
+    return b"".join(reversed(tokens))
+
+
+class Codec:
+    """Compresses text with raw deflate and a preset dictionary.
+
+    The first byte of every encoded value is the id of the dictionary it was compressed with,
+    0 means the text is stored as plain utf-8 (used when compressing wouldn't make it smaller)."""
+
+    def __init__(self, level: int = 9):
+        self.level = level
+        self.dictionaries: Dict[int, bytes] = {}
+        self.current: Optional[int] = None
+
+    def load(self, dictionary_id: int, data: bytes) -> None:
+        if not 0 < dictionary_id < 256:
+            raise ValueError("Dictionary ids must be between 1 and 255")
+        self.dictionaries[dictionary_id] = data
+        if self.current is None or dictionary_id > self.current:
+            self.current = dictionary_id
+
+    def encode(self, text: str) -> bytes:
+        raw = text.encode()
+        if self.current is not None:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=self.dictionaries[self.current])
+            compressed = compressor.compress(raw) + compressor.flush()
+            if len(compressed) < len(raw):
+                return bytes((self.current,)) + compressed
+        return b"\x00" + raw
+
+    def decode(self, data: bytes) -> str:
+        dictionary_id, body = data[0], data[1:]
+        if dictionary_id == 0:
+            return body.decode()
+
+        decompressor = zlib.decompressobj(-15, zdict=self.dictionaries[dictionary_id])
+        return (decompressor.decompress(body) + decompressor.flush()).decode()
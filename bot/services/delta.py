@@ -0,0 +1,22 @@
+import json
+from difflib import SequenceMatcher
+from typing import List, Union
+
+Op = Union[List[int], str]  # [start, end] copies a slice of the source, a string is inserted as is
+
+
+def diff(source: str, target: str) -> str:
+    """A delta that turns `source` into `target`, as compact json.
+    Only the parts of `target` that aren't in `source` are stored, the rest are references to slices."""
+    ops: List[Op] = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, source, target, autojunk=False).get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif tag in ("replace", "insert"):
+            ops.append(target[j1:j2])
+    return json.dumps(ops, ensure_ascii=False, separators=(",", ":"))
+
+
+def patch(source: str, delta: str) -> str:
+    """Apply a delta made by `diff(source, target)`, returning `target`."""
+    return "".join(source[op[0] : op[1]] if isinstance(op, list) else op for op in json.loads(delta))
@@ -0,0 +1,219 @@
+import csv
+import gzip
+import json
+import struct
+from abc import ABC, abstractmethod
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+POSTGRES_EPOCH = datetime(2000, 1, 1)
+SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+
+INT16 = struct.Struct(">h")
+INT32 = struct.Struct(">i")
+
+
+def _timestamp(data: bytes) -> datetime:
+    return POSTGRES_EPOCH + timedelta(microseconds=struct.unpack(">q", data)[0])
+
+
+DECODERS: Dict[str, Callable[[bytes], Any]] = {
+    "bool": lambda data: data == b"\x01",
+    "int2": lambda data: struct.unpack(">h", data)[0],
+    "int4": lambda data: struct.unpack(">i", data)[0],
+    "int8": lambda data: struct.unpack(">q", data)[0],
+    "float8": lambda data: struct.unpack(">d", data)[0],
+    "text": lambda data: data.decode(),
+    "bytea": bytes,
+    "date": lambda data: (POSTGRES_EPOCH + timedelta(days=struct.unpack(">i", data)[0])).date(),
+    "timestamp": _timestamp,
+    "timestamptz": lambda data: _timestamp(data).replace(tzinfo=timezone.utc),
+}
+
+
+class BinaryCopyDecoder:
+    """Incrementally decodes the output of `COPY ... TO STDOUT (FORMAT binary)` into tuples.
+
+    Chunks can be cut anywhere, incomplete rows are kept until the next `feed`.
+    `types` are the postgres type names of the selected columns, see `DECODERS`."""
+
+    def __init__(self, types: Sequence[str]):
+        self.decoders = [DECODERS[name] for name in types]
+        self.finished = False
+        self._buffer = bytearray()
+        self._header_read = False
+
+    def feed(self, chunk: bytes) -> List[tuple]:
+        self._buffer += chunk
+        rows = []
+        offset = 0
+
+        if not self._header_read:
+            if len(self._buffer) < 19:
+                return rows
+            if self._buffer[:11] != SIGNATURE:
+                raise ValueError("Not a binary COPY stream")
+            (extension,) = INT32.unpack_from(self._buffer, 15)
+            if len(self._buffer) < 19 + extension:
+                return rows
+            offset = 19 + extension
+            self._header_read = True
+
+        while offset + 2 <= len(self._buffer):
+            (fields,) = INT16.unpack_from(self._buffer, offset)
+            if fields == -1:
+                self.finished = True
+                offset += 2
+                break
+
+            row = self._decode_row(offset + 2, fields)
+            if row is None:
+                break
+            offset, values = row
+            rows.append(values)
+
+        del self._buffer[:offset]
+        return rows
+
+    def _decode_row(self, offset: int, fields: int) -> Optional[Tuple[int, tuple]]:
+        values = []
+        for decoder in self.decoders[:fields]:
+            if offset + 4 > len(self._buffer):
+                return None
+            (length,) = INT32.unpack_from(self._buffer, offset)
+            offset += 4
+
+            if length == -1:
+                values.append(None)
+                continue
+
+            if offset + length > len(self._buffer):
+                return None
+            values.append(decoder(bytes(self._buffer[offset : offset + length])))
+            offset += length
+
+        return offset, tuple(values)
+
+
+def _jsonable(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.hex()
+    return value
+
+
+class Writer(ABC):
+    extension: str
+
+    def __init__(self, path: str, columns: Sequence[str]):
+        self.path = path
+        self.columns = list(columns)
+        self.rows = 0
+
+    @abstractmethod
+    def write(self, rows: List[tuple]) -> None:
+        ...
+
+    @abstractmethod
+    def close(self) -> None:
+        ...
+
+
+class CsvWriter(Writer):
+    extension = "csv.gz"
+
+    def __init__(self, path: str, columns: Sequence[str]):
+        super().__init__(path, columns)
+        self._file = gzip.open(path, "wt", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.columns)
+
+    def write(self, rows: List[tuple]) -> None:
+        self._writer.writerows(rows)
+        self.rows += len(rows)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class JsonlWriter(Writer):
+    extension = "jsonl.gz"
+
+    def __init__(self, path: str, columns: Sequence[str]):
+        super().__init__(path, columns)
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+
+    def write(self, rows: List[tuple]) -> None:
+        for row in rows:
+            record = {column: _jsonable(value) for column, value in zip(self.columns, row)}
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.rows += len(rows)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ParquetWriter(Writer):
+    """Needs pyarrow, which isn't a dependency of the bot."""
+
+    extension = "parquet"
+
+    def __init__(self, path: str, columns: Sequence[str]):
+        super().__init__(path, columns)
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Exporting to parquet requires pyarrow, install it with `pip install pyarrow`")
+
+        self._pyarrow = pyarrow
+        self._writer = None
+        self._parquet = pyarrow.parquet
+
+    def write(self, rows: List[tuple]) -> None:
+        if not rows:
+            return
+
+        table = self._pyarrow.Table.from_pydict(
+            {column: [row[i] for row in rows] for i, column in enumerate(self.columns)}
+        )
+        if self._writer is None:
+            self._writer = self._parquet.ParquetWriter(self.path, table.schema, compression="zstd")
+        self._writer.write_table(table)
+        self.rows += len(rows)
+
+    def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+
+
+WRITERS = {"csv": CsvWriter, "jsonl": JsonlWriter, "parquet": ParquetWriter}
+
+
+async def copy_to_writer(
+    con,
+    query: str,
+    *args,
+    types: Sequence[str],
+    writer: Writer,
+    transform: Optional[Callable[[tuple], tuple]] = None,
+    on_rows: Optional[Callable[[int], None]] = None,
+) -> int:
+    """Streams the result of `query` into `writer` using a binary COPY.
+
+    asyncpg awaits `output` for every chunk it receives, so at most one chunk
+    is held in memory no matter how many rows the query returns."""
+    decoder = BinaryCopyDecoder(types)
+
+    async def output(chunk: bytes) -> None:
+        rows = decoder.feed(chunk)
+        if transform is not None:
+            rows = [transform(row) for row in rows]
+        writer.write(rows)
+        if on_rows is not None:
+            on_rows(len(rows))
+
+    before = writer.rows
+    await con.copy_from_query(query, *args, output=output, format="binary")
+    return writer.rows - before
@@ -0,0 +1,59 @@
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from typing import Set
+
+
+class IdSet:
+    """A compact set of 64-bit ids (e.g. discord snowflakes).
+
+    Ids are kept in a sorted array which is searched with bisect, using 8 bytes per id instead
+    of the ~70 a python set needs. New ids go into a small set first, which is merged into the
+    array once it holds `merge_at` ids. The set never grows past `max_size` ids."""
+
+    def __init__(self, max_size: int = 1_000_000, merge_at: int = 1024):
+        self.max_size = max_size
+        self.merge_at = merge_at
+        # True if every id that exists is in here, so a miss means the id is definitely unknown
+        self.complete = False
+
+        self._ids = array("q")
+        self._recent: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._ids) + len(self._recent)
+
+    def __contains__(self, id_: int) -> bool:
+        if id_ in self._recent:
+            return True
+        i = bisect_left(self._ids, id_)
+        return i < len(self._ids) and self._ids[i] == id_
+
+    def clear(self) -> None:
+        self.complete = False
+        self._ids = array("q")
+        self._recent.clear()
+
+    def append_sorted(self, id_: int) -> bool:
+        """Append an id that is larger than every id in the array, used for loading ids in bulk.
+        Returns False if the set is full."""
+        if len(self) >= self.max_size:
+            self.complete = False
+            return False
+        self._ids.append(id_)
+        return True
+
+    def add(self, id_: int) -> bool:
+        """Returns False if the set is full and the id was not added."""
+        if id_ in self:
+            return True
+
+        if len(self) >= self.max_size:
+            self.complete = False
+            return False
+
+        self._recent.add(id_)
+        if len(self._recent) >= self.merge_at:
+            self._ids = array("q", sorted(chain(self._ids, self._recent)))
+            self._recent.clear()
+        return True
@@ -0,0 +1,156 @@
+import asyncio
+import heapq
+import logging
+from operator import itemgetter
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+Scores = List[Tuple[Hashable, int]]
+LoadCallback = Callable[[int], Awaitable[Scores]]
+RenderCallback = Callable[[Scores], Awaitable[str]]
+
+
+class Leaderboard:
+    """Keeps the `size` highest scores in memory, so the top `shown` can be read without a query.
+
+    `load(limit)` returns the highest (key, score) pairs from the database, it is called on `reconcile`.
+    Between reconciles scores are kept up to date with `bump`. A key that isn't tracked scored at most
+    the lowest tracked score at the last reconcile, so once what it gained since could bring it into
+    the shown entries the leaderboard is marked stale and reconciled before it's read again.
+    The rendered table is cached until one of the shown entries changes."""
+
+    def __init__(
+        self,
+        name: str,
+        load: LoadCallback,
+        *,
+        size: int = 100,
+        shown: int = 10,
+        interval: float = 300.0,
+        render: Optional[RenderCallback] = None,
+    ):
+        self.name = name
+        self.load = load
+        self.size = size
+        self.shown = shown
+        self.interval = interval
+        self.render = render
+        self.stale = True
+
+        self.reconciles = 0
+        self.renders = 0
+        self.hits = 0
+
+        self._scores: Dict[Hashable, int] = {}
+        self._gains: Dict[Hashable, int] = {}  # Increments of keys that aren't tracked, since the last reconcile
+        self._during: Optional[Dict[Hashable, int]] = None  # Increments made while reconciling
+        self._full = False
+        self._floor = 0
+        self._cutoff = 0
+        self._top: Optional[Scores] = None
+        self._top_keys: Set[Hashable] = set()
+        self._table: Optional[str] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def bump(self, key: Hashable, amount: int = 1) -> None:
+        if self._during is not None:
+            self._during[key] = self._during.get(key, 0) + amount
+
+        if key in self._scores:
+            score = self._scores[key] = self._scores[key] + amount
+        elif not self._full:  # Every key in the database is tracked, so this is its whole score
+            score = self._scores[key] = amount
+        else:
+            gain = self._gains[key] = self._gains.get(key, 0) + amount
+            if self._floor + gain >= self._cutoff:
+                self.stale = True
+            return
+
+        if key in self._top_keys or score >= self._cutoff:
+            self._top = self._table = None
+
+    def top(self, limit: Optional[int] = None) -> Scores:
+        """The highest scores as of the last reconcile plus everything bumped since."""
+        if self._top is None:
+            self._top = heapq.nlargest(self.shown, self._scores.items(), key=itemgetter(1))
+            self._top_keys = {key for key, _ in self._top}
+            self._cutoff = self._top[-1][1] if len(self._top) == self.shown else 0
+        return self._top[:limit]
+
+    async def fetch_top(self, limit: Optional[int] = None) -> Scores:
+        if self.stale:
+            await self.reconcile()
+        return self.top(limit)
+
+    async def table(self) -> str:
+        """The top scores passed through `render`, which only runs again after they changed."""
+        if self.stale:
+            await self.reconcile()
+
+        if self._table is None:
+            self._table = await self.render(self.top())
+            self.renders += 1
+        else:
+            self.hits += 1
+        return self._table
+
+    async def reconcile(self) -> None:
+        """Replace the tracked scores with the ones from the database."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            self._during = {}
+            try:
+                rows = await self.load(self.size)
+            finally:
+                during, self._during = self._during, None
+
+            self._scores = dict(rows)
+            self._full = len(rows) >= self.size
+            self._floor = min(self._scores.values()) if self._full else 0
+            self._gains = {}
+            for key, amount in during.items():  # Loaded rows might miss these, at worst they are counted twice
+                if key in self._scores or not self._full:
+                    self._scores[key] = self._scores.get(key, 0) + amount
+                else:
+                    self._gains[key] = amount
+
+            self._top = self._table = None
+            self.top()
+            self.stale = False
+            self.reconciles += 1
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as error:
+                log.error(f"{self.name}: failed to reconcile the leaderboard", exc_info=error)
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """Reconcile in the background every `interval` seconds."""
+        if self._task is None:
+            self._lock = self._lock or asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "tracked": len(self._scores),
+            "candidates": len(self._gains),
+            "reconciles": self.reconciles,
+            "renders": self.renders,
+            "hits": self.hits,
+        }
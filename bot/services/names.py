@@ -0,0 +1,94 @@
+import bisect
+import heapq
+import re
+from typing import Dict, FrozenSet, Iterable, List, Set, Tuple
+
+WORD = re.compile(r"[^\W_]+")
+
+
+def trigrams(text: str) -> FrozenSet[str]:
+    """The trigrams of `text` the way pg_trgm makes them: per word, padded with two spaces in front and one after."""
+    grams = set()
+    for word in WORD.findall(text.lower()):
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return frozenset(grams)
+
+
+class NameIndex:
+    """Fuzzy and prefix search over a set of names, e.g. the tags of a guild.
+
+    Every trigram maps to the names that contain it, so a search only scores the names that share
+    a trigram with the term, instead of comparing the term against every name.
+    The names are also kept sorted, the ones starting with a prefix are found with a binary search."""
+
+    def __init__(self, names: Iterable[str] = ()):
+        self._grams: Dict[str, Set[str]] = {}
+        self._names: Dict[str, FrozenSet[str]] = {}
+        self._sorted: List[str] = []
+        for name in names:
+            self.add(name)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._names
+
+    def add(self, name: str) -> None:
+        if name in self._names:
+            return
+
+        grams = self._names[name] = trigrams(name)
+        bisect.insort(self._sorted, name)
+        for gram in grams:
+            self._grams.setdefault(gram, set()).add(name)
+
+    def remove(self, name: str) -> None:
+        if name not in self._names:
+            return
+
+        del self._sorted[bisect.bisect_left(self._sorted, name)]
+        for gram in self._names.pop(name):
+            names = self._grams[gram]
+            names.discard(name)
+            if not names:
+                del self._grams[gram]
+
+    def search(self, term: str, limit: int = 10, threshold: float = 0.3) -> List[Tuple[str, float]]:
+        """The `limit` best (name, similarity) matches of `term`.
+        Names starting with the term come first, then names containing it, then the most similar ones.
+        The similarity is the one of pg_trgm: shared trigrams / all distinct trigrams of both."""
+        term = term.lower()
+        grams = trigrams(term)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for name in self._grams.get(gram, ()):
+                shared[name] = shared.get(name, 0) + 1
+
+        if len(term) < 3:  # Too short to share trigrams with names that only contain it
+            shared.update((name, 0) for name in self._names if term in name and name not in shared)
+
+        matches = []
+        for name, count in shared.items():
+            similarity = count / (len(grams) + len(self._names[name]) - count) if grams else 0.0
+            if similarity >= threshold or term in name:
+                matches.append((not name.startswith(term), term not in name, -similarity, name))
+
+        return [(name, -similarity) for *_, similarity, name in heapq.nsmallest(limit, matches)]
+
+    def prefix(self, prefix: str, limit: int = 25) -> List[str]:
+        """The first `limit` names starting with `prefix`, alphabetically."""
+        start = bisect.bisect_left(self._sorted, prefix)
+        names = self._sorted[start : start + limit]
+        if names and not names[-1].startswith(prefix):
+            names = names[: bisect.bisect_left(names, prefix + "\U0010ffff")]  # Sorts after any name with the prefix
+        return names
+
+    def complete(self, term: str, limit: int = 25) -> List[str]:
+        """Suggestions while `term` is being typed: names starting with it, then fuzzy matches to fill up to `limit`."""
+        term = term.lower()
+        names = self.prefix(term, limit)
+        if term and len(names) < limit:
+            names += [name for name, _ in self.search(term, limit) if not name.startswith(term)][: limit - len(names)]
+        return names
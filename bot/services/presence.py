@@ -0,0 +1,137 @@
+import logging
+from typing import Dict, Iterable, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+STATUSES = ("online", "idle", "dnd", "offline")
+MemberRow = Tuple[int, str, Iterable[int]]  # (user_id, status, role_ids)
+
+
+class PresenceIndex:
+    """Status counts of all members and the online members of every role, kept up to date from gateway events.
+
+    Users are counted once no matter how many guilds they share with the bot, like a set of
+    `get_all_members()` would. Every change is O(roles of the member), and reading the online
+    members of a role doesn't touch the members that are offline.
+    `check` compares the index with a fresh one built from the cache and repairs it if they differ."""
+
+    def __init__(self):
+        self.ready = False
+        self.counts: Dict[str, int] = dict.fromkeys(STATUSES, 0)
+        self.checks = 0
+        self.repairs = 0
+
+        self._status: Dict[int, str] = {}
+        self._guilds: Dict[int, int] = {}  # Amount of guilds each user is a member of
+        self._roles: Dict[int, Set[int]] = {}
+        self._online: Dict[int, Set[int]] = {}  # role_id: online user ids
+
+    def __len__(self) -> int:
+        return len(self._status)
+
+    @staticmethod
+    def is_online(status: str) -> bool:
+        return status != "offline"
+
+    def online(self, role_id: int) -> Set[int]:
+        """The ids of the members with the role that aren't offline, don't modify it."""
+        return self._online.get(role_id, set())
+
+    def rebuild(self, members: Iterable[MemberRow]) -> None:
+        self.counts = dict.fromkeys(STATUSES, 0)
+        self._status, self._guilds, self._roles, self._online = {}, {}, {}, {}
+        for user_id, status, role_ids in members:
+            self.add(user_id, status, role_ids)
+        self.ready = True
+
+    def add(self, user_id: int, status: str, role_ids: Iterable[int]) -> None:
+        """A member joined, or the index is being built."""
+        if user_id in self._status:
+            self._guilds[user_id] += 1
+            status = self._status[user_id]
+        else:
+            self._status[user_id] = status
+            self._guilds[user_id] = 1
+            self._roles[user_id] = set()
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+        self._add_roles(user_id, set(role_ids))
+
+    def remove(self, user_id: int, role_ids: Iterable[int]) -> None:
+        """A member left a guild, `role_ids` are the roles it had there."""
+        if user_id not in self._status:
+            return
+
+        self._remove_roles(user_id, set(role_ids))
+        self._guilds[user_id] -= 1
+        if self._guilds[user_id] <= 0:
+            status = self._status.pop(user_id)
+            self.counts[status] -= 1
+            del self._guilds[user_id]
+            del self._roles[user_id]
+
+    def set_status(self, user_id: int, status: str) -> None:
+        before = self._status.get(user_id)
+        if before is None or before == status:
+            return
+
+        self._status[user_id] = status
+        self.counts[before] -= 1
+        self.counts[status] = self.counts.get(status, 0) + 1
+
+        if self.is_online(before) != self.is_online(status):
+            for role_id in self._roles[user_id]:
+                if self.is_online(status):
+                    self._online.setdefault(role_id, set()).add(user_id)
+                else:
+                    self._discard_online(role_id, user_id)
+
+    def set_roles(self, user_id: int, before: Iterable[int], after: Iterable[int]) -> None:
+        if user_id not in self._status:
+            return
+
+        before, after = set(before), set(after)
+        self._remove_roles(user_id, before - after)
+        self._add_roles(user_id, after - before)
+
+    def _add_roles(self, user_id: int, role_ids: Set[int]) -> None:
+        self._roles[user_id] |= role_ids
+        if self.is_online(self._status[user_id]):
+            for role_id in role_ids:
+                self._online.setdefault(role_id, set()).add(user_id)
+
+    def _remove_roles(self, user_id: int, role_ids: Set[int]) -> None:
+        self._roles[user_id] -= role_ids
+        for role_id in role_ids:
+            self._discard_online(role_id, user_id)
+
+    def _discard_online(self, role_id: int, user_id: int) -> None:
+        online = self._online.get(role_id)
+        if online is not None:
+            online.discard(user_id)
+            if not online:
+                del self._online[role_id]
+
+    def check(self, members: Iterable[MemberRow]) -> bool:
+        """Compare with an index built from `members`, replacing this one if they differ.
+        Returns whether they were consistent."""
+        fresh = PresenceIndex()
+        fresh.rebuild(members)
+        self.checks += 1
+
+        if fresh.counts == self.counts and fresh._online == self._online:
+            return True
+
+        log.warning(f"Presence index drifted from the cache, {self.counts} != {fresh.counts}, repairing it")
+        self.counts, self._status, self._guilds = fresh.counts, fresh._status, fresh._guilds
+        self._roles, self._online = fresh._roles, fresh._online
+        self.repairs += 1
+        return False
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "members": len(self._status),
+            "roles": len(self._online),
+            "checks": self.checks,
+            "repairs": self.repairs,
+        }
@@ -0,0 +1,188 @@
+import html
+import pathlib
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence
+
+import pandas as pd
+
+from .export import Writer
+
+DISCORD_EPOCH = 1420070400000  # In milliseconds, the start of every snowflake
+
+
+class FrameWriter(Writer):
+    """Hands the streamed rows to `consume` as DataFrames of up to `chunk_size` rows, instead of writing a file."""
+
+    def __init__(self, columns: Sequence[str], consume: Callable[[pd.DataFrame], None], chunk_size: int = 100_000):
+        super().__init__("", columns)
+        self.consume = consume
+        self.chunk_size = chunk_size
+        self._rows: List[tuple] = []
+
+    def write(self, rows: List[tuple]) -> None:
+        self._rows += rows
+        if len(self._rows) >= self.chunk_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._rows:
+            rows, self._rows = self._rows, []
+            self.consume(pd.DataFrame.from_records(rows, columns=self.columns))
+            self.rows += len(rows)
+
+    def close(self) -> None:
+        self._flush()
+
+
+def month_number(timestamps: pd.Series) -> pd.Series:
+    """Months since year 0, so months can be subtracted as plain integers."""
+    return timestamps.dt.year * 12 + timestamps.dt.month - 1
+
+
+def snowflake_months(ids: pd.Series) -> pd.Series:
+    milliseconds = (ids.to_numpy("int64") >> 22) + DISCORD_EPOCH
+    return month_number(pd.Series(pd.to_datetime(milliseconds, unit="ms"), index=ids.index))
+
+
+def month_label(month: int) -> str:
+    return f"{month // 12}-{month % 12 + 1:02}"
+
+
+class Report:
+    """The tables of `cli.py report`, aggregated chunk by chunk.
+
+    Only partial aggregates are kept between chunks: the (author, month) pairs with activity,
+    the messages per (channel, month), the command uses per (command, month) and the cohort of every user.
+    The chunks of pairs and cohorts are collected in lists and only concatenated when read. Pairs are also
+    deduped once the chunks collected since outgrow the deduped pairs, so every pair is deduped a bounded
+    amount of times instead of once per chunk."""
+
+    def __init__(self, since: Optional[datetime] = None, until: Optional[datetime] = None):
+        self.since = since
+        self.until = until
+        self._cohorts = [pd.Series(dtype="int64", name="cohort")]  # Joined month by user id
+        self._activity = [pd.DataFrame({"author_id": pd.Series(dtype="int64"), "month": pd.Series(dtype="int64")})]
+        self._activity_pending = 0  # Rows of the chunks after the deduped first one
+        self.channel_months = pd.Series(
+            dtype="int64", index=pd.MultiIndex.from_arrays([[], []], names=("channel_id", "month"))
+        )
+        self.command_months = pd.Series(
+            dtype="int64", index=pd.MultiIndex.from_arrays([[], []], names=("command", "month"))
+        )
+        self.messages = 0
+
+    def add_users(self, frame: pd.DataFrame) -> None:
+        """A chunk of `id, joined_at` rows."""
+        frame = frame.dropna()
+        cohorts = pd.Series(month_number(pd.to_datetime(frame["joined_at"])).values, index=frame["id"], name="cohort")
+        self._cohorts.append(cohorts)
+
+    @property
+    def cohorts(self) -> pd.Series:
+        if len(self._cohorts) > 1:
+            self._cohorts = [pd.concat(self._cohorts)]
+        return self._cohorts[0]
+
+    @property
+    def activity(self) -> pd.DataFrame:
+        self._dedupe_activity()
+        return self._activity[0]
+
+    def _dedupe_activity(self) -> None:
+        if len(self._activity) > 1:
+            self._activity = [pd.concat(self._activity).drop_duplicates(ignore_index=True)]
+            self._activity_pending = 0
+
+    def add_messages(self, frame: pd.DataFrame) -> None:
+        """A chunk of `message_id, channel_id, author_id` rows."""
+        frame = frame.assign(month=snowflake_months(frame["message_id"]))
+        self.messages += len(frame)
+
+        channels = frame.dropna(subset=["channel_id"]).astype({"channel_id": "int64"})
+        counts = channels.groupby(["channel_id", "month"]).size()
+        self.channel_months = self.channel_months.add(counts, fill_value=0).astype("int64")
+
+        authors = frame.dropna(subset=["author_id"])[["author_id", "month"]].astype("int64").drop_duplicates()
+        self._activity.append(authors)
+        self._activity_pending += len(authors)
+        if self._activity_pending > len(self._activity[0]):
+            self._dedupe_activity()
+
+    def add_commands(self, frame: pd.DataFrame) -> None:
+        """A chunk of `hour, command, uses` rows from the command rollups."""
+        frame = frame.assign(month=month_number(pd.to_datetime(frame["hour"])))
+        uses = frame.groupby(["command", "month"])["uses"].sum()
+        self.command_months = self.command_months.add(uses, fill_value=0).astype("int64")
+
+    @staticmethod
+    def _per_month(counts: pd.Series, name: str) -> pd.DataFrame:
+        """Pivot (key, month) counts to a row per key with a column per month, a total and its share."""
+        if counts.empty:
+            return pd.DataFrame(columns=[name, "Total", "Share %"])
+
+        table = counts.unstack("month", fill_value=0).sort_index(axis=1)
+        table.columns = [month_label(month) for month in table.columns]
+        table["Total"] = table.sum(axis=1)
+        table["Share %"] = (table["Total"] / table["Total"].sum() * 100).round(2)
+        table.index.name = name
+        return table.sort_values("Total", ascending=False).reset_index()
+
+    def channels(self) -> pd.DataFrame:
+        return self._per_month(self.channel_months, "Channel")
+
+    def commands(self) -> pd.DataFrame:
+        return self._per_month(self.command_months, "Command")
+
+    def retention(self) -> pd.DataFrame:
+        """Per month of joining, the share of those users that sent messages 0, 1, 2... months later."""
+        cohorts = self.cohorts[~self.cohorts.index.duplicated()]
+        if self.since is not None:
+            cohorts = cohorts[cohorts >= month_number(pd.Series([self.since])).iloc[0]]
+        if cohorts.empty:
+            return pd.DataFrame(columns=["Joined", "Users"])
+
+        active = self.activity.join(cohorts, on="author_id", how="inner")
+        active = active[active["month"] >= active["cohort"]]
+        counts = active.groupby(["cohort", active["month"] - active["cohort"]]).size().unstack(fill_value=0)
+
+        sizes = cohorts.value_counts().sort_index()
+        table = (counts.reindex(sizes.index, fill_value=0).div(sizes, axis=0) * 100).round(1)
+        last = self.activity["month"].max()
+        for age in table.columns:  # Months that haven't been reached yet are left empty
+            table.loc[table.index + age > last, age] = None
+        table.columns = [f"+{age}" for age in table.columns]
+        table.insert(0, "Users", sizes)
+        table.index = [month_label(month) for month in table.index]
+        table.index.name = "Joined"
+        return table.reset_index()
+
+    def tables(self) -> dict:
+        return {
+            "retention": ("Retention by join month (% of the cohort active)", self.retention()),
+            "channels": ("Messages per channel", self.channels()),
+            "commands": ("Command uses", self.commands()),
+        }
+
+    def write(self, output: pathlib.Path) -> List[pathlib.Path]:
+        """Write every table to a CSV file and all of them to `report.html`, returns the written paths."""
+        output.mkdir(parents=True, exist_ok=True)
+        period = f"{self.since:%Y-%m-%d}" if self.since else "the start"
+        period += f" until {self.until:%Y-%m-%d}" if self.until else " until now"
+
+        paths = []
+        sections = []
+        for name, (title, table) in self.tables().items():
+            path = output / f"{name}.csv"
+            table.to_csv(path, index=False)
+            paths.append(path)
+            sections.append(f"<h2>{html.escape(title)}</h2>\n{table.to_html(index=False, border=0)}")
+
+        path = output / "report.html"
+        path.write_text(
+            f'<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"><title>Server report</title></head>\n<body>\n'
+            f"<h1>Server report</h1>\n<p>{self.messages} messages from {period}, "
+            f"generated {datetime.utcnow():%Y-%m-%d %H:%M} UTC.</p>\n" + "\n".join(sections) + "\n</body>\n</html>\n",
+            encoding="utf-8",
+        )
+        paths.append(path)
+        return paths
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+Job = Tuple[Callable[..., Awaitable[Any]], tuple]
+
+
+class Priority(IntEnum):
+    MODERATION = 0
+    COMMANDS = 1
+    ANALYTICS = 2
+
+
+class Scheduler:
+    """Runs event work on a fixed amount of workers, taking the highest priority job first.
+
+    Every priority class has its own queue of `queue_size` jobs. Only ANALYTICS jobs are dropped when
+    their queue is full, MODERATION and COMMANDS jobs are queued regardless and counted as overflowed,
+    so filters and commands are never skipped. While the event loop lags more than `lag_threshold` seconds,
+    only a share of the ANALYTICS jobs is accepted, shrinking with the lag down to `min_sample_rate`.
+    A worker waits at most `detach_after` seconds for a job, after that the job keeps running
+    on its own so long running commands can't starve the queues. At most `max_detached` jobs run
+    on their own, past that workers wait for their jobs to finish."""
+
+    def __init__(
+        self,
+        *,
+        workers: int = 8,
+        queue_size: int = 1000,
+        lag_threshold: float = 0.25,
+        min_sample_rate: float = 0.1,
+        detach_after: float = 2.0,
+        max_detached: int = 100,
+        lag_interval: float = 0.5,
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.lag_threshold = lag_threshold
+        self.min_sample_rate = min_sample_rate
+        self.detach_after = detach_after
+        self.max_detached = max_detached
+        self.lag_interval = lag_interval
+
+        self.lag = 0.0
+        self.sample_rate = 1.0
+        self.detached = 0
+        self.dropped: Dict[Priority, int] = dict.fromkeys(Priority, 0)
+        self.overflowed: Dict[Priority, int] = dict.fromkeys(Priority, 0)
+        self.shed: Dict[Priority, int] = dict.fromkeys(Priority, 0)
+
+        self._queues: Dict[Priority, Deque[Job]] = {priority: deque() for priority in Priority}
+        self._ready: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._detached: Set[asyncio.Task] = set()  # Keeps the detached jobs referenced until they are done
+
+    def submit(self, priority: Priority, func: Callable[..., Awaitable[Any]], *args) -> bool:
+        """Queue `func(*args)`, returns False if the ANALYTICS job was dropped or shed."""
+        if priority == Priority.ANALYTICS and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.shed[priority] += 1
+            return False
+
+        queue = self._queues[priority]
+        if len(queue) >= self.queue_size:
+            if priority == Priority.ANALYTICS:
+                self.dropped[priority] += 1
+                return False
+            self.overflowed[priority] += 1
+
+        queue.append((func, args))
+        if self._ready is not None:
+            self._ready.set()
+        return True
+
+    def _next(self) -> Optional[Job]:
+        for priority in Priority:
+            queue = self._queues[priority]
+            if queue:
+                return queue.popleft()
+        return None
+
+    async def _run_job(self, job: Job) -> None:
+        func, args = job
+        try:
+            await func(*args)
+        except Exception as error:
+            log.error(f"Unhandled error in scheduled {getattr(func, '__qualname__', func)!r}", exc_info=error)
+
+    async def _worker(self) -> None:
+        while True:
+            job = self._next()
+            if job is None:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            task = asyncio.create_task(self._run_job(job))
+            if len(self._detached) >= self.max_detached:
+                await task
+                continue
+
+            done, _ = await asyncio.wait({task}, timeout=self.detach_after)
+            if not done:
+                self.detached += 1
+                self._detached.add(task)
+                task.add_done_callback(self._detached.discard)
+
+    async def _monitor_lag(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.lag_interval)
+            lag = time.monotonic() - started - self.lag_interval
+            self.lag = 0.8 * self.lag + 0.2 * max(lag, 0.0)
+
+            if self.lag > self.lag_threshold:
+                self.sample_rate = max(self.min_sample_rate, self.lag_threshold / self.lag)
+            else:
+                self.sample_rate = 1.0
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+
+        self._ready = asyncio.Event()
+        self._ready.set()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._monitor_lag()))
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """Stop the workers, running whatever is still queued or detached for at most `timeout` seconds.
+        Jobs that aren't done by then are cancelled."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        jobs = set(self._detached)
+        while (job := self._next()) is not None:
+            jobs.add(asyncio.create_task(self._run_job(job)))
+        if jobs:
+            _, pending = await asyncio.wait(jobs, timeout=timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                log.warning(f"Cancelled {len(pending)} scheduled jobs that were still running")
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "lag": round(self.lag, 3),
+            "sample_rate": round(self.sample_rate, 2),
+            "detached": self.detached,
+            "running_detached": len(self._detached),
+        }
+        for priority in Priority:
+            name = priority.name.lower()
+            stats[f"{name}_queued"] = len(self._queues[priority])
+            stats[f"{name}_dropped"] = self.dropped[priority]
+            stats[f"{name}_overflowed"] = self.overflowed[priority]
+            stats[f"{name}_shed"] = self.shed[priority]
+        return stats
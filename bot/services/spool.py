@@ -0,0 +1,349 @@
+import asyncio
+import logging
+import mmap
+import os
+import pickle
+import struct
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+import asyncpg
+
+log = logging.getLogger(__name__)
+
+HEADER = struct.Struct(">I")
+# Errors that mean postgres can't be reached right now, as opposed to something being wrong with the data
+UNAVAILABLE = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.InterfaceError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.TooManyConnectionsError,
+)
+
+ReplayHandler = Callable[[List[Any], Optional[uuid.UUID]], Awaitable[None]]
+
+
+class Spool:
+    """An append-only queue on disk for writes that couldn't reach postgres.
+
+    Batches are appended to numbered segment files as length-prefixed pickles of `(kind, items, batch_id)`.
+    While the spool is unhealthy writers go straight to disk, and a background task replays the
+    segments, oldest first, through the handler registered for each kind. Once everything is
+    replayed the spool becomes healthy again.
+    The replay position is saved after a handler returns, so after a crash in between a batch is replayed
+    again. Handlers get the batch's id along with its items, to skip batches they have written already.
+    Batches a handler rejects for anything but postgres being unavailable are moved to the segments
+    in `dead/`, to be looked at and requeued once fixed. Opening segments, fsyncs and the replay's
+    position writes run in an executor, so a slow disk doesn't stall the event loop."""
+
+    def __init__(
+        self,
+        path: str,
+        *,
+        segment_size: int = 16 * 1024 * 1024,
+        fsync_interval: float = 1.0,
+        replay_interval: float = 5.0,
+        use_mmap: bool = True,
+    ):
+        self.path = Path(path)
+        self.dead_path = self.path / "dead"
+        self.segment_size = segment_size
+        self.fsync_interval = fsync_interval
+        self.replay_interval = replay_interval
+        self.use_mmap = use_mmap
+
+        self.healthy = True
+        self.spooled = 0
+        self.replayed = 0
+        self.rejected = 0
+        self.replay_rate = 0.0  # items per second during the last replay
+
+        self.handlers: Dict[str, ReplayHandler] = {}
+        self._file = None
+        self._dirty = False
+        self._last_sync = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        self._write_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+        self._background: Set[asyncio.Future] = set()
+
+    def register(self, kind: str, handler: ReplayHandler) -> None:
+        self.handlers[kind] = handler
+
+    # Writing
+
+    def segments(self) -> List[Path]:
+        if not self.path.exists():
+            return []
+        return sorted(self.path.glob("*.seg"))
+
+    def _open_segment(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        segments = self.segments()
+        number = int(segments[-1].stem) + 1 if segments else 1
+        return open(self.path / f"{number:012}.seg", "ab")
+
+    def rotate(self) -> None:
+        """Close the current segment, the next write starts a new one."""
+        if self._file is not None:
+            file, self._file = self._file, None
+            self._dirty = False
+            file.flush()
+
+            def close():
+                os.fsync(file.fileno())
+                file.close()
+
+            self._in_background(close)
+
+    async def write(self, kind: str, items: List[Any]) -> None:
+        """Append a batch and mark the spool unhealthy, so writers keep spooling until it's replayed."""
+        data = pickle.dumps((kind, items, uuid.uuid4()), protocol=pickle.HIGHEST_PROTOCOL)
+        async with self._writing():
+            if self._file is None or self._file.tell() >= self.segment_size:
+                self.rotate()
+                self._file = await asyncio.get_running_loop().run_in_executor(None, self._open_segment)
+
+            self._file.write(HEADER.pack(len(data)) + data)
+        self._dirty = True
+        self.healthy = False
+        self.spooled += len(items)
+
+        if time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def _writing(self) -> asyncio.Lock:
+        """Held while a segment is opened, so no replay lists the new segment before it's the current one."""
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        return self._write_lock
+
+    def sync(self) -> None:
+        """fsync the current segment, in an executor when called on the event loop."""
+        if self._file is not None and self._dirty:
+            self._file.flush()
+            fd = os.dup(self._file.fileno())  # Stays valid if the segment is closed meanwhile
+            self._dirty = False
+
+            def fsync():
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+            self._in_background(fsync)
+        self._last_sync = time.monotonic()
+
+    def _in_background(self, func: Callable[[], Any]) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return func()
+
+        future = loop.run_in_executor(None, func)
+        self._background.add(future)
+        future.add_done_callback(self._background_done)
+
+    def _background_done(self, future: asyncio.Future) -> None:
+        self._background.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            log.error("Spool file operation failed", exc_info=future.exception())
+
+    async def drain(self) -> None:
+        """Wait for the fsyncs and closes running in the executor."""
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+
+    # Reading
+
+    def read(self, segment: Path, offset: int = 0) -> Iterator[Tuple[int, str, List[Any], Optional[uuid.UUID]]]:
+        """Yields `(end_offset, kind, items, batch_id)` for every complete record in `segment` after `offset`.
+        A record that was cut off by a crash ends the segment. Records spooled before batches had ids have None."""
+        with open(segment, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.use_mmap else f.read()
+
+            try:
+                while offset + HEADER.size <= size:
+                    (length,) = HEADER.unpack_from(buffer, offset)
+                    end = offset + HEADER.size + length
+                    if end > size:
+                        log.warning(f"{segment.name}: ignoring a truncated record at offset {offset}")
+                        break
+
+                    kind, items, *batch_id = pickle.loads(buffer[offset + HEADER.size : end])
+                    yield end, kind, items, batch_id[0] if batch_id else None
+                    offset = end
+            finally:
+                if isinstance(buffer, mmap.mmap):
+                    buffer.close()
+
+    def _position_file(self, segment: Path) -> Path:
+        return segment.with_suffix(".pos")
+
+    def _write_position(self, segment: Path, position: int) -> None:
+        self._position_file(segment).write_text(str(position))
+
+    def _remove_segment(self, segment: Path) -> None:
+        segment.unlink()
+        self._position_file(segment).unlink(missing_ok=True)
+
+    def _read_position(self, segment: Path) -> int:
+        try:
+            return int(self._position_file(segment).read_text())
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def depth(self) -> Dict[str, int]:
+        segments = self.segments()
+        size = sum(segment.stat().st_size - self._read_position(segment) for segment in segments)
+        return {"segments": len(segments), "bytes": size}
+
+    # Replaying
+
+    async def replay(self) -> int:
+        """Replay every closed segment, returns the amount of items replayed.
+        Stops early if postgres is still unavailable."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            replayed = 0
+            started = time.monotonic()
+
+            while True:
+                async with self._writing():
+                    self.rotate()
+                    segments = self.segments()
+                if not segments:
+                    self.healthy = True
+                    break
+
+                for segment in segments:
+                    count = await self._replay_segment(segment)
+                    if count is None:
+                        return replayed
+                    replayed += count
+
+            elapsed = time.monotonic() - started
+            if replayed:
+                self.replay_rate = replayed / elapsed if elapsed else float(replayed)
+                log.info(f"Replayed {replayed} spooled items in {elapsed:.2f}s")
+            return replayed
+
+    async def _replay_segment(self, segment: Path) -> Optional[int]:
+        records = self.read(segment, self._read_position(segment))
+        try:
+            return await self._replay_records(segment, records)
+        finally:
+            records.close()
+
+    async def _replay_records(
+        self, segment: Path, records: Iterator[Tuple[int, str, List[Any], Optional[uuid.UUID]]]
+    ) -> Optional[int]:
+        loop = asyncio.get_running_loop()
+        count = 0
+        for end, kind, items, batch_id in records:
+            handler = self.handlers.get(kind)
+            if handler is None:
+                log.error(f"{segment.name}: no handler for {kind!r}, moving {len(items)} items to the dead letters")
+                await loop.run_in_executor(None, self._dead_letter, segment, kind, items, batch_id)
+                self.rejected += len(items)
+            else:
+                try:
+                    await handler(items, batch_id)
+                except UNAVAILABLE as error:
+                    log.warning(f"Postgres is still unavailable, replay will be retried: {error!r}")
+                    return None
+                except Exception as error:
+                    log.error(
+                        f"{segment.name}: failed to replay {len(items)} {kind!r} items, moving them to dead letters",
+                        exc_info=error,
+                    )
+                    await loop.run_in_executor(None, self._dead_letter, segment, kind, items, batch_id)
+                    self.rejected += len(items)
+                else:
+                    count += len(items)
+                    self.replayed += len(items)
+
+            await loop.run_in_executor(None, self._write_position, segment, end)
+
+        await loop.run_in_executor(None, self._remove_segment, segment)
+        return count
+
+    # Dead letters
+
+    def _dead_letter(self, segment: Path, kind: str, items: List[Any], batch_id: Optional[uuid.UUID]) -> None:
+        """Append a rejected batch to the dead letter segment of `segment`, keeping its id.
+        It is fsynced before the replay position moves past the batch."""
+        self.dead_path.mkdir(parents=True, exist_ok=True)
+        data = pickle.dumps((kind, items, batch_id), protocol=pickle.HIGHEST_PROTOCOL)
+        with open(self.dead_path / segment.name, "ab") as f:
+            f.write(HEADER.pack(len(data)) + data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def dead_letters(self) -> List[Path]:
+        if not self.dead_path.exists():
+            return []
+        return sorted(self.dead_path.glob("*.seg"))
+
+    def requeue(self) -> int:
+        """Move the dead letter segments back into the spool, after the segments that are waiting already.
+        Returns the amount of segments moved, they are replayed with the next replay."""
+        self.rotate()
+        dead = self.dead_letters()
+        segments = self.segments()
+        number = int(segments[-1].stem) + 1 if segments else 1
+        for offset, segment in enumerate(dead):
+            segment.rename(self.path / f"{number + offset:012}.seg")
+        if dead:
+            self.healthy = False
+        return len(dead)
+
+    async def _run(self) -> None:
+        last_replay = 0.0
+        while True:
+            await asyncio.sleep(self.fsync_interval)
+            self.sync()
+            await self.drain()
+
+            if time.monotonic() - last_replay >= self.replay_interval:
+                last_replay = time.monotonic()
+                if self.segments():
+                    await self.replay()
+
+    def start(self) -> None:
+        """Start syncing and replaying in the background."""
+        if self._task is None:
+            self._lock = self._lock or asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        self.rotate()
+        await self.drain()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "healthy": self.healthy,
+            **self.depth(),
+            "spooled": self.spooled,
+            "replayed": self.replayed,
+            "rejected": self.rejected,
+            "dead_letters": len(self.dead_letters()),
+            "replay_rate": round(self.replay_rate, 1),
+        }
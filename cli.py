@@ -2,20 +2,27 @@ import asyncio
 import logging
 import pathlib
 import re
+import time
+from datetime import datetime, timedelta, timezone
 from functools import wraps
-from typing import Callable, Dict, Optional, Tuple, TypeVar
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
+from urllib.parse import urlsplit
 
 import asyncpg
 import click
 import discord
+from tabulate import tabulate
 
 from bot.bot import Tim
 from bot.config import settings
-from bot.models import Model
-from bot.models.migrations.migration import Migration
+from bot.models import BackfillCheckpoint, Counter, Message, Model, User
+from bot.models.migrations.migration import Migration, Step
+from bot.services import WRITERS, Backfill, BackfillJob, FrameWriter, Report, copy_to_writer
 
 FN = TypeVar("FN", bound=Callable)
+T = TypeVar("T")
 ROOT_DIR = pathlib.Path(__file__).parent.resolve()
+MIGRATIONS_DIR = ROOT_DIR / "bot" / "models" / "migrations"
 REVISION_FILE = re.compile(r"(?P<version>\d+)_(?P<direction>(up)|(down))__(?P<name>.+).sql")
 
 
@@ -40,7 +47,7 @@ class Revisions:
 
     @classmethod
     def load_revisions(cls) -> None:
-        root = ROOT_DIR / "migrations"
+        root = MIGRATIONS_DIR
         for file in root.glob("*.sql"):
             match = REVISION_FILE.match(file.name)
             if match is not None:
@@ -97,20 +104,98 @@ async def main(ctx):
             await Tim().start(settings.bot.token)
 
 
-async def run_migration(file: str = "000_migrations.sql") -> None:
-    path = ROOT_DIR / "migrations"
-
-    with open(path / file) as f:
+async def run_migration(
+    file: str = "000_migrations.sql", *, lock_timeout: float = 2.0, retries: int = 10, pause: float = 0.1
+) -> None:
+    """Runs a migration file, as a whole or step by step if it has `-- step:` lines (see `Step`).
+    Steps recorded by an earlier, interrupted run are skipped or resumed."""
+    with open(MIGRATIONS_DIR / file) as f:
         query = f.read()
 
-    await Model.execute(query)
     match = REVISION_FILE.match(file)
+    mig = Migration.from_match(match) if match is not None else None
+    steps = Step.parse(query)
+    started_at, started = datetime.utcnow(), time.monotonic()
+
+    if mig is None or not steps:
+        await Model.execute(query)
+    else:
+        previous = await mig.fetch_steps()
+        for step in steps:
+            await run_step(mig, step, previous.get(step.name), lock_timeout=lock_timeout, retries=retries, pause=pause)
 
-    if match is not None:
-        mig = Migration.from_match(match)
+    duration = time.monotonic() - started
+    if mig is not None:
+        mig.started_at, mig.duration, mig.timestamp = started_at, duration, datetime.utcnow()
         await mig.post()
 
-    click.echo(f"{file} was executed.")
+    click.echo(f"{file} was executed in {duration:.1f}s.")
+
+
+async def with_lock_timeout(func: Callable[[asyncpg.Connection], Awaitable[T]], lock_timeout: float, retries: int) -> T:
+    """Runs `func` in a transaction that gives up waiting for a lock after `lock_timeout` seconds,
+    so a migration never queues the bot's queries behind it for long. Retried with a growing delay."""
+    for attempt in range(retries + 1):
+        async with Model.pool.acquire() as con:
+            try:
+                async with con.transaction():
+                    await con.execute(f"""SET LOCAL lock_timeout = {int(lock_timeout * 1000)}""")
+                    return await func(con)
+            except asyncpg.LockNotAvailableError:
+                if attempt == retries:
+                    raise
+
+        delay = min(0.5 * 2**attempt, 30.0)
+        click.echo(f"  Lock not granted within {lock_timeout}s, retrying in {delay:.1f}s", err=True)
+        await asyncio.sleep(delay)
+
+
+async def run_step(
+    mig: Migration, step: Step, previous: Optional[Migration], *, lock_timeout: float, retries: int, pause: float
+) -> None:
+    if previous is not None and previous.done:
+        return click.echo(f"  {step.name}: done in an earlier run, skipped")
+
+    row = previous
+    if row is None:
+        row = mig.start_step(step.name)
+        await row.post()
+
+    elapsed = row.duration or 0.0
+    started = time.monotonic()
+
+    if step.mode == "concurrently" and step.generate:
+        statements = [record[0] for record in await Model.fetch(step.sql)]
+        for i, statement in enumerate(statements, 1):
+            await Model.execute(statement)  # Each on its own, outside a transaction, which CONCURRENTLY needs
+            if i % 10 == 0:
+                click.echo(f"  {step.name}: {i}/{len(statements)} statements")
+    elif step.mode == "concurrently":
+        for statement in step.statements:
+            await Model.execute(statement)  # Each on its own, outside a transaction, which CONCURRENTLY needs
+    elif step.mode == "batched":
+        last = row.progress or 0
+        if last:
+            click.echo(f"  {step.name}: resuming after {last}")
+
+        async def batch(con: asyncpg.Connection) -> Optional[int]:
+            key = await con.fetchval(step.sql, last, step.batch_size)
+            if key is not None:
+                await row.save_progress(key, elapsed + time.monotonic() - started, con=con)
+            return key
+
+        batches = 0
+        while (key := await with_lock_timeout(batch, lock_timeout, retries)) is not None:
+            last = key
+            batches += 1
+            if batches % 50 == 0:
+                click.echo(f"  {step.name}: {batches * step.batch_size} rows, at {last}")
+            await asyncio.sleep(pause)
+    else:
+        await with_lock_timeout(lambda con: con.execute(step.sql), lock_timeout, retries)
+
+    await row.finish(elapsed + time.monotonic() - started)
+    click.echo(f"  {step.name}: done in {row.duration:.1f}s")
 
 
 async def get_current_db_rev() -> Optional[Migration]:
@@ -118,7 +203,25 @@ async def get_current_db_rev() -> Optional[Migration]:
         return await Migration.fetch_latest()
     except asyncpg.UndefinedTableError:
         click.echo("Relation 'migrations' does not exits.\nCreating one now...", err=True)
-        await run_migration()
+    except asyncpg.UndefinedColumnError:
+        click.echo("Relation 'migrations' is outdated.\nUpdating it now...", err=True)
+
+    await run_migration()
+    return await Migration.fetch_latest()
+
+
+def step_options(func: FN) -> FN:
+    """Options for running the steps of migrations, shared by the commands that run migrations."""
+    options = (
+        click.option(
+            "--lock-timeout", default=2.0, help="Seconds a step waits for a lock before retrying.", show_default=True
+        ),
+        click.option("--retries", default=10, help="Retries of a step that didn't get its locks.", show_default=True),
+        click.option("--pause", default=0.1, help="Seconds between the batches of batched steps.", show_default=True),
+    )
+    for option in reversed(options):
+        func = option(func)
+    return func
 
 
 @main.group(invoke_without_command=True)
@@ -142,14 +245,15 @@ async def migrate(ctx):
             f"Name      : {rev.name}\n"
             f"Version   : {rev.version}\n"
             f"Direction : {rev.direction}\n"
-            f"Latest run: {rev.timestamp}"
+            f"Latest run: {rev.timestamp}" + (f"\nDuration  : {rev.duration:.1f}s" if rev.duration is not None else "")
         )
 
 
-async def update(n: int, is_target: bool = False):
+async def update(n: int, is_target: bool = False, **options):
     """
     :param n: amount of steps if `is_target` is False (default), otherwise it is treated as a target version
     :param is_target: whether to treat n as the targeted version or amount of steps
+    :param options: passed on to `run_migration`
     """
 
     fake0 = Migration(version=0, direction="up", name="")
@@ -189,9 +293,9 @@ async def update(n: int, is_target: bool = False):
     while cur.version != target:
         if cur.version < target:
             cur = revs[cur.version + 1, "up"]
-            await run_migration(cur.filename)
+            await run_migration(cur.filename, **options)
         else:
-            await run_migration(revs[cur.version, "down"].filename)
+            await run_migration(revs[cur.version, "down"].filename, **options)
             cur = revs.get((cur.version - 1, "up"), fake0)
 
 
@@ -205,8 +309,9 @@ async def init():
 @migrate.command()
 @click.argument("version", type=int)
 @click.argument("direction", type=str)
+@step_options
 @async_command
-async def run(version: int, direction: str):
+async def run(version: int, direction: str, **options):
     """Executes a specific migration."""
     if version < 1:
         return click.echo("Version can't be less than 1.", err=True)
@@ -219,29 +324,33 @@ async def run(version: int, direction: str):
     if rev is None:
         return click.echo("Migration with that version/direction doesn't exist.", err=True)
 
-    await run_migration(rev.filename)
+    await get_current_db_rev()  # Creates or updates the migrations table
+
+    await run_migration(rev.filename, **options)
 
 
 @migrate.command()
 @click.argument("n", type=int, required=False)
 @click.option("--target", "-t", help="Treats n as a targeted version.", is_flag=True)
+@step_options
 @async_command
-async def up(n: Optional[int], target):
+async def up(n: Optional[int], target, **options):
     """Migrating up. Migrates up all the way if `n` isn't passed (n >= 1)"""
     if n is None:
         n, _ = max(Revisions.revisions().keys())
         target = True
     if n < 1:
         return click.echo("Passed argument must be >= 1", err=True)
-    await update(n, is_target=target)
+    await update(n, is_target=target, **options)
 
 
 @migrate.command()
 @click.argument("n", type=int, required=False)
 @click.option("--confirm", "-c", help="Skips the confirmation message", is_flag=True)
 @click.option("--target", "-t", help="Treats n as a targeted version.", is_flag=True)
+@step_options
 @async_command
-async def down(n: Optional[int], confirm, target):
+async def down(n: Optional[int], confirm, target, **options):
     """Migrating down. Migrates down all the way if `n` isn't passed (n >= 1)"""
     confirm = confirm or click.confirm("This may result in loss of data, continue?\n")
     if confirm is False:
@@ -251,7 +360,842 @@ async def down(n: Optional[int], confirm, target):
         target = True
     if n < 1:
         return click.echo("Passed argument must be >= 1", err=True)
-    await update(-n, is_target=target)
+    await update(-n, is_target=target, **options)
+
+
+@migrate.command()
+@click.option("--batch-size", "-b", default=10_000, help="Rows moved per transaction.", show_default=True)
+@click.option("--sleep", "-s", default=0.1, help="Seconds to wait between batches.", show_default=True)
+@async_command
+async def messages(batch_size: int, sleep: float):
+    """Moves the rows left in `messages_legacy` into the partitioned messages table.
+    They are written like new messages, with their channels, search vectors, counters and hourly rollups,
+    which needs the latest schema: run `migrate up` first, then this.
+    Every batch is its own transaction, so this can be stopped and resumed at any time."""
+    if await Model.fetchval("""SELECT TO_REGCLASS('messages_legacy')""") is None:
+        return click.echo("There is no messages_legacy table, nothing to move.", err=True)
+
+    latest, _ = max(Revisions.revisions().keys())
+    current = await get_current_db_rev()
+    if current is None or (current.version, current.direction) != (latest, "up"):
+        return click.echo("Run `migrate up` first, the moved rows are written with the latest schema.", err=True)
+
+    await Message.load_dictionaries()
+    estimate = await Model.fetchval("""SELECT reltuples::BIGINT FROM pg_class WHERE relname = 'messages_legacy'""")
+    query = """DELETE FROM messages_legacy
+               WHERE ctid = ANY(ARRAY(SELECT ctid FROM messages_legacy WHERE message_id IS NOT NULL LIMIT $1))
+               RETURNING message_id, guild_id, channel_id, author_id, content"""
+
+    total_moved = 0
+    with click.progressbar(length=max(estimate, 0), label="Moving messages") as bar:
+        async with Model.pool.acquire() as con:
+            while True:
+                async with con.transaction():
+                    rows = await con.fetch(query, batch_size)
+                    if not rows:
+                        break
+
+                    # Legacy rows may lack some of the ids, the model's validation is skipped for them
+                    records = [
+                        Message.construct(
+                            message_id=row["message_id"],
+                            guild_id=row["guild_id"],
+                            channel_id=row["channel_id"],
+                            author_id=row["author_id"],
+                            content=row["content"] or "",
+                            created_at=discord.utils.snowflake_time(row["message_id"]),
+                        ).to_record()
+                        for row in rows
+                    ]
+                    await Message.bulk_post(records, con=con)  # Duplicates are skipped, and aren't counted
+
+                total_moved += len(rows)
+                bar.update(len(rows))
+                await asyncio.sleep(sleep)
+
+    click.echo(f"Moved {total_moved} rows.")
+
+    left = await Model.fetchval("""SELECT COUNT(*) FROM messages_legacy""")
+    if left:
+        return click.echo(f"{left} rows without a message_id were left in messages_legacy.", err=True)
+
+    await Model.execute("""DROP TABLE messages_legacy""")
+    click.echo("Dropped the empty messages_legacy table.")
+
+
+async def messages_size() -> int:
+    """Size of the messages table in bytes, summed over its partitions and including indexes and TOAST."""
+    query = """SELECT SUM(pg_total_relation_size(relid))::BIGINT FROM pg_partition_tree('messages')"""
+    return await Model.fetchval(query) or 0
+
+
+async def messages_estimate() -> int:
+    """Estimated amount of rows in the messages table, from the planner statistics."""
+    query = """SELECT SUM(GREATEST(c.reltuples, 0))::BIGINT
+               FROM pg_partition_tree('messages') p
+               JOIN pg_class c ON c.oid = p.relid"""
+    return await Model.fetchval(query) or 0
+
+
+def format_size(size: int) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+@main.command()
+@click.option("--batch-size", "-b", default=5_000, help="Rows converted per transaction.", show_default=True)
+@click.option("--retrain", is_flag=True, help="Train a new dictionary even if there already is one.")
+@click.option("--expand", is_flag=True, help="Turn compact rows back into plain rows instead.")
+@click.option("--vacuum-full", is_flag=True, help="Rewrite the table afterwards, this locks it while running.")
+@async_command
+async def compact(batch_size: int, retrain: bool, expand: bool, vacuum_full: bool):
+    """Converts stored messages to the compact format (or back with --expand).
+    Set INGESTION__COMPACT=true to store new messages compactly as well."""
+    if not await prepare_postgres(settings.postgres.uri):
+        return click.echo("Failed to prepare Postgres.", err=True)
+
+    before = await messages_size()
+    await Message.load_dictionaries()
+
+    if expand:
+        select = """SELECT message_id, body FROM messages
+                    WHERE message_id > $1 AND body IS NOT NULL
+                    ORDER BY message_id
+                    LIMIT $2"""
+        update = """UPDATE messages m
+                    SET content    = d.content,
+                        created_at = snowflake_time(m.message_id),
+                        guild_id   = (SELECT c.guild_id FROM channels c WHERE c.channel_id = m.channel_id),
+                        body       = NULL
+                    FROM unnest($1::bigint[], $2::varchar[]) AS d ( message_id, content )
+                    WHERE m.message_id = d.message_id"""
+    else:
+        if retrain or Message.codec.current is None:
+            dictionary_id = await Message.train_dictionary()
+            click.echo(f"Trained compression dictionary #{dictionary_id}.")
+
+        select = """SELECT message_id, guild_id, channel_id, content FROM messages
+                    WHERE message_id > $1 AND body IS NULL
+                    ORDER BY message_id
+                    LIMIT $2"""
+        update = """UPDATE messages m
+                    SET body = d.body, content = NULL, created_at = NULL, guild_id = NULL
+                    FROM unnest($1::bigint[], $2::bytea[]) AS d ( message_id, body )
+                    WHERE m.message_id = d.message_id"""
+
+    last_id = 0
+    converted = 0
+    with click.progressbar(length=await messages_estimate(), label="Converting messages") as bar:
+        while True:
+            records = await Model.fetch(select, last_id, batch_size)
+            if not records:
+                break
+
+            async with Model.pool.acquire() as con:
+                async with con.transaction():
+                    if expand:
+                        values = [Message.codec.decode(record["body"]) for record in records]
+                    else:
+                        values = [Message.codec.encode(record["content"] or "") for record in records]
+                        await Model.execute(
+                            """INSERT INTO channels ( channel_id, guild_id )
+                               SELECT DISTINCT channel_id, guild_id FROM unnest($1::bigint[], $2::bigint[])
+                                   AS d ( channel_id, guild_id )
+                               WHERE channel_id IS NOT NULL AND guild_id IS NOT NULL
+                               ON CONFLICT DO NOTHING""",
+                            [record["channel_id"] for record in records],
+                            [record["guild_id"] for record in records],
+                            con=con,
+                        )
+                    await Model.execute(update, [record["message_id"] for record in records], values, con=con)
+
+            last_id = records[-1]["message_id"]
+            converted += len(records)
+            bar.update(len(records))
+
+    click.echo(f"Converted {converted} messages, vacuuming...")
+    await Model.execute("""VACUUM (FULL, ANALYZE) messages""" if vacuum_full else """VACUUM (ANALYZE) messages""")
+
+    after = await messages_size()
+    click.echo(f"Size before: {format_size(before)}\nSize after : {format_size(after)}")
+    if not vacuum_full:
+        click.echo("Freed space is reused by new rows, use --vacuum-full to give it back to the OS.")
+
+
+async def backfill_channels(http: discord.http.HTTPClient, guild_id: int, channel_ids: Tuple[int]) -> Dict[int, int]:
+    """{channel_id: guild_id} of the channels to backfill, all text channels of the guild if none are passed."""
+    if channel_ids:
+        channels = [await http.get_channel(channel_id) for channel_id in channel_ids]
+    else:
+        channels = await http.get_all_guild_channels(guild_id)
+
+    text_channels = (discord.ChannelType.text.value, discord.ChannelType.news.value)
+    return {int(channel["id"]): int(channel["guild_id"]) for channel in channels if channel["type"] in text_channels}
+
+
+async def run_backfill(
+    guild_id: int,
+    channel_ids: Tuple[int],
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    *,
+    concurrency: int = 4,
+    batch_size: int = 1000,
+    restart: bool = False,
+    api_base: Optional[str] = None,
+    retention: bool = True,
+) -> Dict[str, float]:
+    """The work of `backfill`, for a pool that is prepared already. Returns the stats of the `Backfill`.
+    `api_base` replaces the api's url for this backfill only, `retention=False` keeps messages past the retention."""
+    await Message.load_dictionaries()
+    stop_id = discord.utils.time_snowflake(since.replace(tzinfo=timezone.utc)) - 1 if since else 0
+    oldest_id = 0  # Messages past the retention would be pruned again, and their partitions may be dropped already
+    if retention and settings.retention.messages is not None:
+        oldest = datetime.now(timezone.utc) - timedelta(days=settings.retention.messages)
+        oldest_id = discord.utils.time_snowflake(oldest)
+    start_id = discord.utils.time_snowflake((until or datetime.utcnow()).replace(tzinfo=timezone.utc), high=True)
+
+    # Only the REST side of the client is needed, logging `Tim` in would run its whole setup hook
+    http = discord.http.HTTPClient(asyncio.get_running_loop())
+    base = discord.http.Route.BASE  # Routes only read it when they are created, by the requests of this backfill
+    if api_base is not None:
+        discord.http.Route.BASE = api_base
+    try:
+        await http.static_login(settings.bot.token)
+        channels = await backfill_channels(http, guild_id, channel_ids)
+        if restart:
+            await BackfillCheckpoint.clear(list(channels))
+        checkpoints = await BackfillCheckpoint.fetch_channels(list(channels))
+
+        jobs = []
+        for channel_id in channels:
+            checkpoint = checkpoints.get(channel_id)
+            if checkpoint is None or checkpoint.stop_id != stop_id:
+                jobs.append(BackfillJob(channel_id, start_id, stop_id))
+            elif not checkpoint.done:
+                jobs.append(BackfillJob(channel_id, checkpoint.before_id, stop_id))
+
+        click.echo(f"Backfilling {len(jobs)} channels, {len(channels) - len(jobs)} are already done.")
+        authors = set()
+
+        async def save(job: BackfillJob, messages: List[dict], before_id: int, done: bool) -> None:
+            records = [
+                Message.from_payload(message, channels[job.channel_id]).to_record()
+                for message in messages
+                if not message["author"].get("bot")
+                and message["type"] in (0, 19)  # Default messages and replies
+                and int(message["id"]) >= oldest_id
+            ]
+            authors.update(record[3] for record in records)
+
+            checkpoint = checkpoints.get(job.channel_id)
+            fetched = len(messages) + (checkpoint.fetched if checkpoint and checkpoint.stop_id == stop_id else 0)
+            checkpoints[job.channel_id] = BackfillCheckpoint(
+                channel_id=job.channel_id,
+                guild_id=channels[job.channel_id],
+                before_id=before_id,
+                stop_id=stop_id,
+                fetched=fetched,
+                done=done,
+            )
+
+            async with Model.pool.acquire() as con:
+                async with con.transaction():
+                    if records:
+                        await Message.bulk_post(records, con=con)
+                    await checkpoints[job.channel_id].post(con=con)
+
+        with click.progressbar(length=len(jobs), label="Backfilling channels") as bar:
+            runner = Backfill(
+                http,
+                save,
+                concurrency=concurrency,
+                batch_size=batch_size,
+                on_channel_done=lambda job, fetched: bar.update(1),
+            )
+            await runner.run(jobs)
+    finally:
+        discord.http.Route.BASE = base
+        await http.close()
+
+    stats = runner.stats()
+    click.echo(
+        f"Fetched {stats['fetched']} messages in {stats['pages']} pages ({stats['rate']}/s), "
+        f"{stats['skipped']} channels were not accessible."
+    )
+    if stats["failed"]:
+        click.echo(f"{stats['failed']} channels failed, run the same command again to resume them.", err=True)
+
+    click.echo(f"Recounting messages_sent of {len(authors)} users...")
+    await User.recount_messages(list(authors))
+    return stats
+
+
+@main.command()
+@click.option("--guild", "-g", "guild_id", default=settings.guild.id, help="Guild to backfill.", show_default=True)
+@click.option("--channel", "-c", "channel_ids", type=int, multiple=True, help="Only backfill these channels.")
+@click.option("--since", type=click.DateTime(), help="Stop at this date (UTC), defaults to the start of the channel.")
+@click.option("--until", type=click.DateTime(), help="Start at this date (UTC), defaults to now.")
+@click.option("--concurrency", default=4, help="Channels fetched at once.", show_default=True)
+@click.option("--batch-size", "-b", default=1000, help="Messages inserted per transaction.", show_default=True)
+@click.option("--restart", is_flag=True, help="Ignore the checkpoints of earlier runs.")
+@click.option("--api-base", help="Use another REST api, like a local fake of it (see `backfill-check`).")
+@async_command
+async def backfill(
+    guild_id: int,
+    channel_ids: Tuple[int],
+    since: Optional[datetime],
+    until: Optional[datetime],
+    concurrency: int,
+    batch_size: int,
+    restart: bool,
+    api_base: Optional[str],
+):
+    """Fills the messages table from the channel history, using the api without connecting to the gateway.
+    Progress is checkpointed per channel, running it again with the same --since resumes where it stopped."""
+    if not await prepare_postgres(settings.postgres.uri, max_con=concurrency + 1):
+        return click.echo("Failed to prepare Postgres.", err=True)
+
+    await run_backfill(
+        guild_id,
+        channel_ids,
+        since,
+        until,
+        concurrency=concurrency,
+        batch_size=batch_size,
+        restart=restart,
+        api_base=api_base,
+    )
+
+
+def database_of(uri: str) -> Tuple[str, int, str]:
+    """The server and the database a postgres uri points to."""
+    parts = urlsplit(uri)
+    return parts.hostname or "localhost", parts.port or 5432, parts.path.strip("/")
+
+
+async def delete_scratch(guild_id: int, channel_ids: List[int], author_ids: List[int]) -> None:
+    """Remove what a backfill of the fake api stored in the scratch database, including its share of the counters."""
+    async with Model.pool.acquire() as con:
+        async with con.transaction():
+            records = await Model.fetch(
+                """WITH deleted AS (
+                       DELETE FROM messages WHERE channel_id = ANY($1::bigint[]) RETURNING channel_id
+                   )
+                   SELECT channel_id, COUNT(*) AS n FROM deleted GROUP BY channel_id""",
+                channel_ids,
+                con=con,
+            )
+            counters = await Counter.add_messages({record["channel_id"]: -record["n"] for record in records}, con=con)
+            await Model.execute(
+                """DELETE FROM counters
+                   WHERE name = 'messages' AND (scope = 'channel' AND scope_id = ANY($1::bigint[])
+                                                OR scope = 'guild' AND scope_id = $2)""",
+                channel_ids,
+                guild_id,
+                con=con,
+            )
+            await Model.execute(
+                """DELETE FROM message_rollups
+                   WHERE scope = 'channel' AND scope_id = ANY($1::bigint[])
+                      OR scope = 'user' AND scope_id = ANY($2::bigint[])
+                      OR scope = 'guild' AND scope_id = $3""",
+                channel_ids,
+                author_ids,
+                guild_id,
+                con=con,
+            )
+            await Model.execute("""DELETE FROM channels WHERE channel_id = ANY($1::bigint[])""", channel_ids, con=con)
+            await Model.execute("""DELETE FROM users WHERE id = ANY($1::bigint[])""", author_ids, con=con)
+            await BackfillCheckpoint.clear(channel_ids, con=con)
+
+    Counter.update_cache("messages", [record for record in counters if record["scope"] == "global"])
+
+
+@main.command("backfill-check")
+@click.option("--dsn", required=True, help="Uri of a scratch database, never the bot's. It's migrated to the latest.")
+@click.option("--channels", "channel_count", default=3, help="Channels of the fake guild.", show_default=True)
+@click.option("--messages", default=1250, help="Messages per channel.", show_default=True)
+@click.option("--batch-size", "-b", default=300, help="Messages inserted per transaction.", show_default=True)
+@click.option("--keep", is_flag=True, help="Keep the stored rows to look at them, instead of deleting them.")
+@async_command
+async def backfill_check(dsn: str, channel_count: int, messages: int, batch_size: int, keep: bool):
+    """Runs `backfill` against a local fake of the REST api serving canned history pages, and checks the result.
+    The first channel fails midway through the first run, which the second run has to resume without
+    fetching pages twice. It runs on a scratch database only, the counters of a real one would change.
+    --messages has to be larger than --batch-size for the interruption to happen."""
+    from tools.fake_discord import FakeDiscord
+
+    if database_of(dsn) == database_of(settings.postgres.uri):
+        raise click.ClickException("--dsn is the bot's database, the check needs a scratch database.")
+    if not await prepare_postgres(dsn, max_con=channel_count + 1):
+        return click.echo("Failed to prepare Postgres.", err=True)
+
+    latest, _ = max(Revisions.revisions().keys())
+    current = await get_current_db_rev()
+    if current is None or (current.version, current.direction) != (latest, "up"):
+        await update(latest, is_target=True)
+
+    guild_id, author_ids = 1, list(range(2, 12))
+    channel_ids = list(range(100, 100 + channel_count))
+    # Fail right after the first saved batch, pages that were fetched but not saved yet are fetched again
+    fail_after = {channel_ids[0]: -(-batch_size // 100)}
+    fake = FakeDiscord.generate(guild_id, channel_ids, author_ids, messages, fail_after=fail_after)
+    expected = fake.expected()
+    base = await fake.start()
+    try:
+        await delete_scratch(guild_id, channel_ids, author_ids)  # Leftovers of a run that was --keep'd
+        options = dict(batch_size=batch_size, api_base=base, retention=False)
+        first = await run_backfill(guild_id, (), **options)
+        second = await run_backfill(guild_id, (), **options)
+
+        checkpoints = await BackfillCheckpoint.fetch_channels(channel_ids)
+        stored = await Model.fetch(
+            """SELECT channel_id, author_id, COUNT(*) AS n FROM messages
+               WHERE channel_id = ANY($1::bigint[])
+               GROUP BY channel_id, author_id""",
+            channel_ids,
+        )
+        per_channel = {channel_id: 0 for channel_id in channel_ids}
+        for record in stored:
+            per_channel[record["channel_id"]] += record["n"]
+        users = await Model.fetch("""SELECT id, messages_sent FROM users WHERE id = ANY($1::bigint[])""", author_ids)
+        users = {record["id"]: record["messages_sent"] for record in users}
+
+        sent = {author_id: 0 for author_id in author_ids}
+        for counts in expected.values():
+            for author_id, n in counts.items():
+                sent[author_id] += n
+
+        checks = [
+            ("first run failed one channel", first["failed"] == 1),
+            ("second run failed none", second["failed"] == 0),
+            ("every channel is done", all(checkpoints.get(c) and checkpoints[c].done for c in channel_ids)),
+            (
+                "checkpoints count every fetched message",
+                all(checkpoints.get(c) and checkpoints[c].fetched == len(fake.histories[c]) for c in channel_ids),
+            ),
+            (
+                "no page was fetched twice",
+                all(len(set(requested)) == len(requested) for requested in fake.requested.values()),
+            ),
+            (
+                "rows per channel",
+                all(per_channel[c] == sum(expected[c].values()) for c in channel_ids),
+            ),
+            ("messages_sent per user", all(users.get(a, 0) == n for a, n in sent.items())),
+        ]
+    finally:
+        await fake.stop()
+        if not keep:
+            await delete_scratch(guild_id, channel_ids, author_ids)
+
+    click.echo(tabulate([(name, "ok" if ok else "FAILED") for name, ok in checks], headers=("Check", "Result")))
+    if not all(ok for _, ok in checks):
+        raise click.ClickException("The backfill didn't store what the fake api served.")
+
+
+@main.command("index-search")
+@click.option("--batch-size", "-b", default=5_000, help="Rows indexed per transaction.", show_default=True)
+@async_command
+async def index_search(batch_size: int):
+    """Fills the search vector of messages stored before it was maintained at ingestion.
+    Compact rows are decompressed here, so this works for them as well."""
+    if not await prepare_postgres(settings.postgres.uri):
+        return click.echo("Failed to prepare Postgres.", err=True)
+
+    await Message.load_dictionaries()
+    select = """SELECT message_id, content, body FROM messages
+                WHERE message_id > $1 AND search IS NULL
+                ORDER BY message_id
+                LIMIT $2"""
+    update = """UPDATE messages m
+                SET search = TO_TSVECTOR('english', d.content)
+                FROM unnest($1::bigint[], $2::varchar[]) AS d ( message_id, content )
+                WHERE m.message_id = d.message_id"""
+
+    last_id = 0
+    indexed = 0
+    with click.progressbar(length=await messages_estimate(), label="Indexing messages") as bar:
+        while True:
+            records = await Model.fetch(select, last_id, batch_size)
+            if not records:
+                break
+
+            contents = [
+                record["content"] if record["body"] is None else Message.codec.decode(record["body"])
+                for record in records
+            ]
+            await Model.execute(update, [record["message_id"] for record in records], [c or "" for c in contents])
+
+            last_id = records[-1]["message_id"]
+            indexed += len(records)
+            bar.update(len(records))
+
+    click.echo(f"Indexed {indexed} messages.")
+
+
+@main.group()
+def spool():
+    """Inspect or replay writes that were spooled to disk while postgres was unavailable"""
+
+
+@spool.command()
+def inspect():
+    """Lists the spooled segments and what is in them."""
+    segments = Model.spool.segments()
+    dead = Model.spool.dead_letters()
+    if not segments and not dead:
+        return click.echo("The spool is empty.")
+
+    for segment in segments + dead:
+        counts = {}
+        for _, kind, items, _ in Model.spool.read(segment):
+            counts[kind] = counts.get(kind, 0) + len(items)
+
+        summary = ", ".join(f"{count} {kind}" for kind, count in counts.items()) or "empty"
+        name = f"dead/{segment.name}" if segment in dead else segment.name
+        click.echo(f"{name}  {format_size(segment.stat().st_size):>10}  {summary}")
+
+    depth = Model.spool.depth()
+    click.echo(f"{depth['segments']} segments, {format_size(depth['bytes'])} left to replay.")
+    if dead:
+        click.echo(f"{len(dead)} dead letter segments were rejected while replaying, see `spool requeue`.")
+
+
+@spool.command()
+@async_command
+async def replay():
+    """Replays the spool into postgres. Don't run this while the bot is running, it replays the spool itself."""
+    if not await prepare_postgres(settings.postgres.uri):
+        return click.echo("Failed to prepare Postgres.", err=True)
+
+    count = await Model.spool.replay()
+    stats = Model.spool.stats()
+    click.echo(f"Replayed {count} items at {stats['replay_rate']}/s, {stats['rejected']} rejected.")
+    if not stats["healthy"]:
+        click.echo("Postgres became unavailable while replaying, the rest is left in the spool.", err=True)
+
+
+@spool.command()
+def requeue():
+    """Moves the dead letter segments back into the spool, once whatever made them fail is fixed.
+    They are replayed by the bot or `spool replay`, batches that fail again become dead letters again."""
+    moved = Model.spool.requeue()
+    click.echo(f"Requeued {moved} dead letter segments." if moved else "There are no dead letters.")
+
+
+EXPORT_TABLES = {
+    "users": (
+        """SELECT id, commands_used, joined_at, messages_sent FROM users
+           WHERE ($1::timestamp IS NULL OR joined_at >= $1) AND ($2::timestamp IS NULL OR joined_at < $2)""",
+        (("id", "int8"), ("commands_used", "int4"), ("joined_at", "timestamp"), ("messages_sent", "int4")),
+    ),
+    "tags": (
+        """SELECT guild_id, creator_id, name, text, uses, created_at FROM tags
+           WHERE ($1::timestamp IS NULL OR created_at >= $1::timestamp AT TIME ZONE 'UTC')
+             AND ($2::timestamp IS NULL OR created_at < $2::timestamp AT TIME ZONE 'UTC')""",
+        (
+            ("guild_id", "int8"),
+            ("creator_id", "int8"),
+            ("name", "text"),
+            ("text", "text"),
+            ("uses", "int4"),
+            ("created_at", "timestamptz"),
+        ),
+    ),
+    "reps": (
+        """SELECT rep_id, user_id, author_id, repped_at, extra_info FROM reps
+           WHERE ($1::timestamp IS NULL OR repped_at >= $1) AND ($2::timestamp IS NULL OR repped_at < $2)""",
+        (
+            ("rep_id", "int8"),
+            ("user_id", "int8"),
+            ("author_id", "int8"),
+            ("repped_at", "timestamp"),
+            ("extra_info", "text"),
+        ),
+    ),
+}
+MESSAGE_EXPORT_COLUMNS = (
+    ("message_id", "int8"),
+    ("guild_id", "int8"),
+    ("channel_id", "int8"),
+    ("author_id", "int8"),
+    ("content", "text"),
+    ("body", "bytea"),
+    ("created_at", "timestamp"),
+)
+
+
+def export_options(func: FN) -> FN:
+    """Options shared by all `export` subcommands."""
+    options = (
+        click.option("--format", "-f", "format_", default="csv", type=click.Choice(tuple(WRITERS)), show_default=True),
+        click.option(
+            "--output",
+            "-o",
+            default="export",
+            type=click.Path(file_okay=False, path_type=pathlib.Path),
+            help="Directory to write the files to.",
+            show_default=True,
+        ),
+        click.option("--since", type=click.DateTime(), help="Only rows from this date on (UTC)."),
+        click.option("--until", type=click.DateTime(), help="Only rows before this date (UTC)."),
+        click.option("--workers", "-w", default=4, help="Partitions exported at once.", show_default=True),
+    )
+    for option in reversed(options):
+        func = option(func)
+    return func
+
+
+async def message_partitions(since: Optional[datetime], until: Optional[datetime]) -> List[Tuple[str, int, int, int]]:
+    """The (name, first id, last id, estimated rows) of every messages partition with rows between since and until."""
+    low = discord.utils.time_snowflake(since.replace(tzinfo=timezone.utc)) if since else 0
+    high = discord.utils.time_snowflake(until.replace(tzinfo=timezone.utc)) - 1 if until else 2**63 - 1
+
+    query = """SELECT p.relid::regclass::text AS name, GREATEST(c.reltuples, 0)::BIGINT AS estimate
+               FROM pg_partition_tree('messages') p
+               JOIN pg_class c ON c.oid = p.relid
+               WHERE p.isleaf
+               ORDER BY name"""
+
+    partitions = []
+    for record in await Model.fetch(query):
+        first, last = await Model.fetchrow(f"""SELECT MIN(message_id), MAX(message_id) FROM {record['name']}""")
+        if first is None or last < low or first > high:
+            continue
+
+        start, end = max(first, low), min(last, high)
+        estimate = record["estimate"] * (end - start + 1) // (last - first + 1)
+        partitions.append((record["name"], start, end, estimate))
+
+    return partitions
+
+
+async def run_export(jobs: List[Tuple[str, str, tuple, tuple, Optional[Callable]]], estimate: int, **options) -> None:
+    """Runs (file name, query, args, columns, transform) export jobs, `workers` at a time."""
+    options["output"].mkdir(parents=True, exist_ok=True)
+    writer_class = WRITERS[options["format_"]]
+    semaphore = asyncio.Semaphore(options["workers"])
+
+    with click.progressbar(length=estimate, label="Exporting") as bar:
+
+        async def export(name: str, query: str, args: tuple, columns: tuple, transform: Optional[Callable]) -> int:
+            async with semaphore, Model.pool.acquire() as con:
+                names = [column for column, _ in columns if not (transform and column == "body")]
+                writer = writer_class(str(options["output"] / f"{name}.{writer_class.extension}"), names)
+                try:
+                    return await copy_to_writer(
+                        con,
+                        query,
+                        *args,
+                        types=[type_ for _, type_ in columns],
+                        writer=writer,
+                        transform=transform,
+                        on_rows=bar.update,
+                    )
+                finally:
+                    writer.close()
+
+        counts = await asyncio.gather(*(export(*job) for job in jobs))
+
+    for (name, *_), count in zip(jobs, counts):
+        click.echo(f"{name}: {count} rows")
+
+
+@main.group()
+def export():
+    """Export tables to compressed CSV, JSONL or Parquet (needs pyarrow) files"""
+
+
+@export.command("messages")
+@export_options
+@async_command
+async def export_messages(**options):
+    """Exports messages with one file per monthly partition, compact messages are decompressed."""
+    if not await prepare_postgres(settings.postgres.uri, max_con=options["workers"] + 1):
+        return click.echo("Failed to prepare Postgres.", err=True)
+
+    await Message.load_dictionaries()
+    partitions = await message_partitions(options["since"], options["until"])
+
+    def transform(row: tuple) -> tuple:
+        message_id, guild_id, channel_id, author_id, content, body, created_at = row
+        if body is not None:
+            content = Message.codec.decode(body)
+        return message_id, guild_id, channel_id, author_id, content, created_at
+
+    query = """SELECT message_id, guild_id, channel_id, author_id, content, body, created_at FROM messages_expanded
+               WHERE message_id BETWEEN $1 AND $2"""
+    jobs = [(name, query, (start, end), MESSAGE_EXPORT_COLUMNS, transform) for name, start, end, _ in partitions]
+    await run_export(jobs, sum(estimate for *_, estimate in partitions), **options)
+
+
+def register_export(table: str) -> None:
+    query, columns = EXPORT_TABLES[table]
+
+    @export.command(table, help=f"Exports the {table} table.")
+    @export_options
+    @async_command
+    async def command(**options):
+        if not await prepare_postgres(settings.postgres.uri):
+            return click.echo("Failed to prepare Postgres.", err=True)
+
+        estimate = await Model.fetchval(
+            """SELECT GREATEST(reltuples, 0)::BIGINT FROM pg_class WHERE oid = TO_REGCLASS($1)""", table
+        )
+        args = (options["since"], options["until"])
+        await run_export([(table, query, args, columns, None)], estimate, **options)
+
+
+for export_table in EXPORT_TABLES:
+    register_export(export_table)
+
+
+@main.command()
+@click.option("--guild", "-g", "guild_id", default=settings.guild.id, help="Guild to report on.", show_default=True)
+@click.option("--since", type=click.DateTime(), help="Only activity from this date on (UTC).")
+@click.option("--until", type=click.DateTime(), help="Only activity before this date (UTC).")
+@click.option(
+    "--output",
+    "-o",
+    default="report",
+    type=click.Path(file_okay=False, path_type=pathlib.Path),
+    help="Directory to write the report to.",
+    show_default=True,
+)
+@click.option("--chunk-size", default=100_000, help="Rows aggregated at a time.", show_default=True)
+@async_command
+async def report(
+    guild_id: int, since: Optional[datetime], until: Optional[datetime], output: pathlib.Path, chunk_size: int
+):
+    """Writes a report of member retention, messages per channel and command uses as HTML and CSV.
+    The rows are streamed with COPY and aggregated in chunks, so memory use doesn't grow with the tables."""
+    if not await prepare_postgres(settings.postgres.uri):
+        return click.echo("Failed to prepare Postgres.", err=True)
+
+    result = Report(since, until)
+    partitions = await message_partitions(since, until)
+    streams = [
+        (
+            """SELECT id, joined_at FROM users""",
+            (),
+            (("id", "int8"), ("joined_at", "timestamp")),
+            result.add_users,
+        ),
+        *(
+            (
+                """SELECT message_id, channel_id, author_id FROM messages
+                   WHERE message_id BETWEEN $1 AND $2
+                     AND channel_id IN (SELECT channel_id FROM channels WHERE guild_id = $3)""",
+                (start, end, guild_id),
+                (("message_id", "int8"), ("channel_id", "int8"), ("author_id", "int8")),
+                result.add_messages,
+            )
+            for _, start, end, _ in partitions
+        ),
+        (
+            """SELECT hour, command, uses FROM command_rollups
+               WHERE ($1::timestamp IS NULL OR hour >= $1) AND ($2::timestamp IS NULL OR hour < $2)""",
+            (since, until),
+            (("hour", "timestamp"), ("command", "text"), ("uses", "int4")),
+            result.add_commands,
+        ),
+    ]
+
+    async with Model.pool.acquire() as con:
+        estimate = sum(estimate for *_, estimate in partitions)
+        with click.progressbar(length=estimate, label="Aggregating messages") as bar:
+            for query, args, columns, consume in streams:
+                writer = FrameWriter([column for column, _ in columns], consume, chunk_size=chunk_size)
+                on_rows = bar.update if consume == result.add_messages else None
+                try:
+                    await copy_to_writer(
+                        con, query, *args, types=[type_ for _, type_ in columns], writer=writer, on_rows=on_rows
+                    )
+                finally:
+                    writer.close()
+
+    for path in result.write(output):
+        click.echo(f"Wrote {path}")
+
+
+@main.group()
+def stats():
+    """Repair the counters kept on the users table"""
+
+
+@stats.command()
+@click.option("--workers", "-w", default=4, help="Ranges counted at once.", show_default=True)
+@click.option("--range-size", default=2_000_000, help="Estimated messages per counted range.", show_default=True)
+@click.option("--dry-run", is_flag=True, help="Only report how the stored counters differ.")
+@click.option("--limit", default=20, help="Largest differences listed.", show_default=True)
+@click.option("--ignore-retention", is_flag=True, help="Also lower counts, although messages were pruned.")
+@async_command
+async def rebuild(workers: int, range_size: int, dry_run: bool, limit: int, ignore_retention: bool):
+    """Recounts `users.messages_sent` from the messages table.
+    The partitions are split into message id ranges that are counted concurrently, the results are merged
+    here and written with a single upsert. Run it while the bot is stopped, or messages that are
+    buffered while counting are missed.
+    With a message retention the pruned messages are still part of the lifetime counts, so counts are
+    only raised then, unless --ignore-retention is passed."""
+    if not await prepare_postgres(settings.postgres.uri, max_con=workers + 1):
+        return click.echo("Failed to prepare Postgres.", err=True)
+
+    only_raise = settings.retention.messages is not None and not ignore_retention
+    if only_raise:
+        click.echo("Messages are pruned after the retention, counts that would go down are kept.", err=True)
+
+    ranges = []
+    for _, start, end, estimate in await message_partitions(None, None):
+        parts = max(1, estimate // range_size)
+        step = (end - start) // parts + 1
+        ranges += [(low, min(low + step - 1, end), estimate // parts) for low in range(start, end + 1, step)]
+
+    query = """SELECT author_id, COUNT(*) AS n FROM messages
+               WHERE message_id BETWEEN $1 AND $2 AND author_id IS NOT NULL
+               GROUP BY author_id"""
+    semaphore = asyncio.Semaphore(workers)
+    counted: Dict[int, int] = {}
+
+    with click.progressbar(length=sum(estimate for *_, estimate in ranges), label="Counting messages") as bar:
+
+        async def count(low: int, high: int, estimate: int) -> None:
+            async with semaphore:
+                records = await Model.fetch(query, low, high)
+            for record in records:
+                counted[record["author_id"]] = counted.get(record["author_id"], 0) + record["n"]
+            bar.update(estimate)
+
+        await asyncio.gather(*(count(*range_) for range_ in ranges))
+
+    stored = {
+        record["id"]: record["messages_sent"] for record in await Model.fetch("""SELECT id, messages_sent FROM users""")
+    }
+    changes = {
+        user_id: counted.get(user_id, 0)
+        for user_id in counted.keys() | stored.keys()
+        if counted.get(user_id, 0) > (stored.get(user_id) or 0)
+        or (not only_raise and counted.get(user_id, 0) != (stored.get(user_id) or 0))
+    }
+    click.echo(
+        f"{len(counted)} authors with {sum(counted.values())} messages, {len(changes)} of {len(stored)} users differ "
+        f"(stored total {sum(value or 0 for value in stored.values())})."
+    )
+    if not changes:
+        return
+
+    largest = sorted(changes.items(), key=lambda item: abs(item[1] - (stored.get(item[0]) or 0)), reverse=True)
+    rows = [(user_id, stored.get(user_id), value, value - (stored.get(user_id) or 0)) for user_id, value in largest]
+    click.echo(tabulate(rows[:limit], headers=("User", "Stored", "Counted", "Difference")))
+    if dry_run:
+        return
+
+    await User.set_messages_sent(changes)
+    click.echo(f"Updated the messages_sent of {len(changes)} users.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,133 @@
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set
+
+from aiohttp import web
+from discord.utils import time_snowflake
+
+log = logging.getLogger(__name__)
+
+# Worker and process id bits of the generated snowflakes, real ones created at the same millisecond won't use both
+SNOWFLAKE_SOURCE = 0b11111 << 17 | 0b11111 << 12
+
+
+class FakeDiscord:
+    """A local stand-in for the parts of the REST api a backfill uses, serving canned channel histories,
+    for `cli.py backfill-check`. It's a test double, nothing in the bot uses it.
+
+    `histories` are the messages of every channel, newest first, as the api returns them. Pages are served
+    like `GET /channels/{id}/messages?before=&limit=` does, and every `before` a channel was asked for is
+    recorded in `requested`, so a check can tell whether a resumed backfill fetched pages twice.
+    `fail_after` makes a channel answer with an error once, after that many pages, to interrupt a backfill."""
+
+    def __init__(self, guild_id: int, histories: Dict[int, List[dict]], *, fail_after: Dict[int, int] = None):
+        self.guild_id = guild_id
+        self.histories = histories
+        self.fail_after = dict(fail_after or {})
+        self.requested: Dict[int, List[Optional[int]]] = defaultdict(list)
+        self.failed: Set[int] = set()
+
+        self.app = web.Application()
+        self.app.add_routes(
+            [
+                web.get("/users/@me", self.me),
+                web.get("/guilds/{guild_id}/channels", self.guild_channels),
+                web.get("/channels/{channel_id}", self.channel),
+                web.get("/channels/{channel_id}/messages", self.messages),
+            ]
+        )
+        self._runner: Optional[web.AppRunner] = None
+
+    @classmethod
+    def generate(
+        cls,
+        guild_id: int,
+        channel_ids: List[int],
+        author_ids: List[int],
+        messages: int,
+        *,
+        since: timedelta = timedelta(hours=1),
+        **kwargs,
+    ) -> "FakeDiscord":
+        """Spread `messages` per channel over the last `since`, with a bot message every 7th
+        and a member join (type 7) every 11th, which a backfill is expected to skip."""
+        start = datetime.now(timezone.utc) - since
+        step = since / (messages + 1)
+        histories = {}
+        for channel_index, channel_id in enumerate(channel_ids):
+            history = []
+            for i in range(messages):
+                created_at = start + step * (i + 1)
+                author_id = author_ids[(i + channel_index) % len(author_ids)]
+                history.append(
+                    {
+                        "id": str(time_snowflake(created_at) | SNOWFLAKE_SOURCE | channel_index),
+                        "channel_id": str(channel_id),
+                        "author": {"id": str(author_id), "username": f"user{author_id}", "bot": i % 7 == 6},
+                        "content": f"Message {i} in channel {channel_id}",
+                        "timestamp": created_at.isoformat(),
+                        "type": 7 if i % 11 == 10 else 0,
+                    }
+                )
+            histories[channel_id] = history[::-1]
+        return cls(guild_id, histories, **kwargs)
+
+    def expected(self) -> Dict[int, Dict[int, int]]:
+        """{channel_id: {author_id: messages}} of the messages a backfill should store."""
+        expected = {}
+        for channel_id, history in self.histories.items():
+            counts = expected[channel_id] = defaultdict(int)
+            for message in history:
+                if not message["author"]["bot"] and message["type"] in (0, 19):
+                    counts[int(message["author"]["id"])] += 1
+        return expected
+
+    def _channel_payload(self, channel_id: int) -> dict:
+        return {"id": str(channel_id), "guild_id": str(self.guild_id), "type": 0, "name": f"channel-{channel_id}"}
+
+    async def me(self, request: web.Request) -> web.Response:
+        return web.json_response({"id": "1", "username": "fake", "discriminator": "0000", "avatar": None, "bot": True})
+
+    async def guild_channels(self, request: web.Request) -> web.Response:
+        if int(request.match_info["guild_id"]) != self.guild_id:
+            return web.json_response({"message": "Unknown Guild", "code": 10004}, status=404)
+        return web.json_response([self._channel_payload(channel_id) for channel_id in self.histories])
+
+    async def channel(self, request: web.Request) -> web.Response:
+        channel_id = int(request.match_info["channel_id"])
+        if channel_id not in self.histories:
+            return web.json_response({"message": "Unknown Channel", "code": 10003}, status=404)
+        return web.json_response(self._channel_payload(channel_id))
+
+    async def messages(self, request: web.Request) -> web.Response:
+        channel_id = int(request.match_info["channel_id"])
+        history = self.histories.get(channel_id)
+        if history is None:
+            return web.json_response({"message": "Unknown Channel", "code": 10003}, status=404)
+
+        pages = len(self.requested[channel_id])
+        if channel_id not in self.failed and self.fail_after.get(channel_id) == pages:
+            self.failed.add(channel_id)
+            return web.json_response({"message": "Canned failure", "code": 0}, status=400)
+
+        before = int(request.query["before"]) if "before" in request.query else None
+        limit = min(int(request.query.get("limit", 50)), 100)
+        self.requested[channel_id].append(before)
+        page = [message for message in history if before is None or int(message["id"]) < before][:limit]
+        return web.json_response(page)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serve on `host`, on a free port by default. Returns the base url to use instead of the api's."""
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        log.info(f"Fake discord api is serving on {host}:{port}")
+        return f"http://{host}:{port}"
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None